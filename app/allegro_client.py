@@ -1,24 +1,91 @@
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
+from functools import lru_cache, partial
 from typing import Any
+from xml.sax.saxutils import escape
 
-from flask import g
-from requests import ConnectionError
+from flask import current_app, g
+import requests
+from requests import ConnectionError, RequestException
 from zeep import Client
 from zeep.settings import Settings
-from zeep.transports import Transport
-from zeep.xsd.elements.element import Element
+from zeep.wsdl.utils import etree_to_string
 
+from app.bulkhead import limit_concurrency
+from app.cache import hash_key, krefia_cache
 from app.config import (
+    ALLEGRO_ADAPTIVE_TIMEOUTS,
+    ALLEGRO_BULKHEAD,
+    ALLEGRO_CLIENT_BACKOFF_BASE_DELAY,
+    ALLEGRO_CLIENT_BACKOFF_MAX_DELAY,
+    ALLEGRO_CLIENT_PROBE_TIMEOUT,
     ALLEGRO_EXCLUDE_OPDRACHTGEVER,
+    ALLEGRO_HEDGED_OPERATIONS,
+    ALLEGRO_HEDGING,
+    ALLEGRO_RECORD,
     ALLEGRO_REQUEST_TIMEOUT,
+    ALLEGRO_SHARED_TRANSPORT,
+    ALLEGRO_TEMPLATED_ENVELOPES,
+    ALLEGRO_TEMPLATED_OPERATIONS,
+    KREFIA_CACHE_TTL,
+    KREFIA_NEGATIVE_CACHE_TTL,
+    KREFIA_RELATIECODE_CACHE_TTL,
+    KREFIA_SECTION_CACHE_TTL,
+    KREFIA_SECTION_WORKERS,
     KREFIA_SSO_FIBU,
     KREFIA_SSO_KREDIETBANK,
     get_allegro_service_description,
+    get_allegro_service_endpoint,
+)
+from app.hedging import call_hedged, timed_call
+from app.helpers import dotdict, format_currency, get_etag
+from app.load_shedding import get_request_deadline, get_time_left, set_request_deadline
+from app.models import TPLHeader, TSRVAanvraagHeader, get_models
+from app.recording import record_response
+from app.retry import call_with_retry
+from app.server_timing import get_server_timing, set_server_timing, timed
+from app.soap_calls import (
+    get_soap_call_failure_scopes,
+    get_soap_call_log,
+    record_soap_call,
+    record_soap_call_failure,
+    set_soap_call_failure_scopes,
+    set_soap_call_log,
+    track_soap_call_failures,
+)
+from app.timeouts import (
+    AdaptiveTimeoutTransport,
+    with_deadline,
+    with_operation_timeout,
 )
-from app.helpers import dotdict, format_currency
 
 allegro_client = {}
+client_settings = Settings(xsd_ignore_sequence_order=True, strict=False)
+# The services get_all calls
+allegro_services = [
+    "LoginService",
+    "SchuldHulpService",
+    "FinancieringService",
+    "BBRService",
+    "BerichtenBoxService",
+]
+allegro_client_locks = {}
+allegro_client_locks_lock = threading.Lock()
+# service_name -> (number of consecutive failures, monotonic time of the next attempt)
+allegro_client_failures = {}
+
+
+class AllegroUnavailable(Exception):
+    code = 503
+
+    def __init__(self, service_name: str, retry_after: float = 0):
+        super().__init__(f"Allegro service {service_name} is unavailable")
+        self.service_name = service_name
+        self.retry_after = retry_after
+
 
 bedrijf = dotdict({"FIBU": "FIBU", "KREDIETBANK": "KREDIETBANK"})
 bedrijf_code = dotdict(
@@ -37,37 +104,142 @@ notification_urls = {
     bedrijf.KREDIETBANK: KREDIETBANK_NOTIFICATION_URL,
 }
 
+ENVELOPE_ARG_PLACEHOLDER = "__KREFIA_ARG_{}__"
+ENVELOPE_SESSION_PLACEHOLDER = "__KREFIA_SESSION_ID__"
 
-def get_client(service_name: str):
-    global allegro_client
 
-    if service_name not in allegro_client:
-        logging.info(f"Establishing a connection with Allegro service {service_name}")
+def get_client_lock(service_name: str):
+    with allegro_client_locks_lock:
+        if service_name not in allegro_client_locks:
+            allegro_client_locks[service_name] = threading.Lock()
+        return allegro_client_locks[service_name]
 
-        try:
-            transport = Transport(timeout=ALLEGRO_REQUEST_TIMEOUT)
-            client = Client(
-                wsdl=get_allegro_service_description(service_name),
-                transport=transport,
-                settings=Settings(xsd_ignore_sequence_order=True, strict=False),
+
+@lru_cache(maxsize=None)
+def get_shared_transport():
+    # One session and connection pool for all services. No document cache, every client parses its
+    # own schema anyway, keeping the downloaded documents would only add to the memory of the worker
+    return AdaptiveTimeoutTransport(
+        timeout=ALLEGRO_REQUEST_TIMEOUT, operation_timeout=ALLEGRO_REQUEST_TIMEOUT
+    )
+
+
+def get_transport():
+    if ALLEGRO_SHARED_TRANSPORT:
+        return get_shared_transport()
+
+    return AdaptiveTimeoutTransport(
+        timeout=ALLEGRO_REQUEST_TIMEOUT, operation_timeout=ALLEGRO_REQUEST_TIMEOUT
+    )
+
+
+def create_client(service_name: str):
+    logging.info("Establishing a connection with Allegro service %s", service_name)
+
+    try:
+        client = Client(
+            wsdl=get_allegro_service_description(service_name),
+            transport=get_transport(),
+            settings=client_settings,
+        )
+        return client
+    except ConnectionError as e:
+        # do not rethrow the error, because the error has a object address in it, it is a new error every time.
+        logging.error(f"Failed to establish a connection with Allegro: ({type(e)})")
+        return None
+    except Exception as error:
+        logging.error(
+            "Failed to establish a connection with Allegro: {} {}".format(
+                type(error), str(error)
             )
+        )
+        return None
+
+
+def get_client_backoff(service_name: str):
+    """Returns the seconds left before the client may be initialised again"""
+    failure = allegro_client_failures.get(service_name)
+
+    if not failure:
+        return 0
+
+    return max(0, failure[1] - time.monotonic())
+
+
+def record_client_failure(service_name: str):
+    failures = allegro_client_failures.get(service_name, (0, 0))[0] + 1
+    delay = min(
+        ALLEGRO_CLIENT_BACKOFF_BASE_DELAY * 2 ** (failures - 1),
+        ALLEGRO_CLIENT_BACKOFF_MAX_DELAY,
+    )
+    allegro_client_failures[service_name] = (failures, time.monotonic() + delay)
+
+
+def probe_allegro(service_name: str):
+    """Checks if Allegro responds at all, without waiting for the full request timeout"""
+    try:
+        requests.head(
+            get_allegro_service_endpoint(service_name),
+            timeout=ALLEGRO_CLIENT_PROBE_TIMEOUT,
+        )
+        return True
+    except RequestException as error:
+        logging.error("Allegro health probe failed: (%s)", type(error))
+        return False
+
+
+def get_client(service_name: str):
+    global allegro_client
+
+    if service_name in allegro_client:
+        return allegro_client[service_name]
+
+    # Fail fast while backing off, don't queue up behind the lock
+    retry_after = get_client_backoff(service_name)
+    if retry_after:
+        raise AllegroUnavailable(service_name, retry_after)
+
+    # Only one thread builds the client (downloads and parses the WSDL), the others wait for it
+    with get_client_lock(service_name):
+        if service_name not in allegro_client:
+            retry_after = get_client_backoff(service_name)
+            if retry_after:
+                raise AllegroUnavailable(service_name, retry_after)
+
+            # After a failure, probe quickly before blocking on the WSDL download again
+            if service_name in allegro_client_failures and not probe_allegro(
+                service_name
+            ):
+                client = None
+            else:
+                client = create_client(service_name)
+
+            if client is None:
+                record_client_failure(service_name)
+                return None
+
+            allegro_client_failures.pop(service_name, None)
             allegro_client[service_name] = client
-            return client
-        except ConnectionError as e:
-            # do not rethrow the error, because the error has a object address in it, it is a new error every time.
-            logging.error(f"Failed to establish a connection with Allegro: ({type(e)})")
-            return None
-        except Exception as error:
-            logging.error(
-                "Failed to establish a connection with Allegro: {} {}".format(
-                    type(error), str(error)
-                )
-            )
-            return None
 
     return allegro_client[service_name]
 
 
+def warm_up_clients():
+    """Builds the clients that aren't built yet, skips the ones that are backing off"""
+    for service_name in allegro_services:
+        try:
+            get_client(service_name)
+        except AllegroUnavailable:
+            pass
+
+
+def get_client_status():
+    return {
+        service_name: service_name in allegro_client
+        for service_name in allegro_services
+    }
+
+
 def get_service(service_name: str):
     client = get_client(service_name)
     try:
@@ -91,7 +263,7 @@ def get_session_header(service_name: str):
         return []
 
     client = get_client(service_name)
-    header = client.get_element("ns0:ROClientIDHeader")
+    header = get_client_element(client, "ns0:ROClientIDHeader")
     session_header = header(
         ID=get_session_id(),
     )
@@ -100,31 +272,179 @@ def get_session_header(service_name: str):
     return [session_header]
 
 
+@lru_cache(maxsize=None)
+def get_client_element(client: Client, name: str):
+    return client.get_element(name)
+
+
+@lru_cache(maxsize=None)
+def get_envelope_template(
+    client: Client, method_name: str, arg_count: int, with_session: bool
+):
+    """Serializes the operation once with placeholder values, returns the envelope as text and the http headers"""
+    args = [ENVELOPE_ARG_PLACEHOLDER.format(index) for index in range(arg_count)]
+    placeholders = list(args)
+    soapheaders = []
+
+    if with_session:
+        header = get_client_element(client, "ns0:ROClientIDHeader")
+        soapheaders.append(header(ID=ENVELOPE_SESSION_PLACEHOLDER))
+        placeholders.append(ENVELOPE_SESSION_PLACEHOLDER)
+
+    try:
+        envelope, http_headers = client.service._binding._create(
+            method_name,
+            args,
+            {"_soapheaders": soapheaders},
+            client=client,
+            options=client.service._binding_options,
+        )
+        template = etree_to_string(envelope).decode("utf-8")
+    except Exception as error:
+        logging.error(
+            "Could not create envelope template for %s: %s", method_name, error
+        )
+        return None
+
+    # Placeholders that are transformed by the xsd serializer can't be substituted later on
+    if not all(placeholder in template for placeholder in placeholders):
+        logging.error("Envelope template not supported for %s", method_name)
+        return None
+
+    return template, http_headers
+
+
+def format_envelope_value(value: Any):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    return str(value)
+
+
+def render_envelope(template: str, session_id: str, args: tuple):
+    message = template.replace(ENVELOPE_SESSION_PLACEHOLDER, escape(session_id or ""))
+
+    for index, value in enumerate(args):
+        message = message.replace(
+            ENVELOPE_ARG_PLACEHOLDER.format(index), escape(format_envelope_value(value))
+        )
+
+    return message.encode("utf-8")
+
+
+def get_templated_envelope(service_name: str, method_name: str, args: tuple):
+    """Renders the request from a pre-serialized envelope, returns None if the call can't be templated"""
+    if None in args:
+        return None
+
+    client = get_client(service_name)
+    session_id = get_session_id()
+    envelope_template = get_envelope_template(
+        client, method_name, len(args), bool(session_id)
+    )
+
+    if not envelope_template:
+        return None
+
+    template, http_headers = envelope_template
+
+    return render_envelope(template, session_id, args), dict(http_headers)
+
+
+def post_templated_envelope(
+    service_name: str, method_name: str, message: bytes, http_headers: dict
+):
+    client = get_client(service_name)
+    binding = client.service._binding
+    response = client.transport.post(
+        client.service._binding_options["address"], message, http_headers
+    )
+
+    return binding.process_reply(client, binding.get(method_name), response)
+
+
 def call_service_method(operation: str, *args):
     service_name, method_name = operation.split(".")
     service = get_service(service_name)
 
     if not service:
         logging.error(f"{operation}, no service.")
+        record_soap_call_failure(operation)
         return
 
     try:
-        response = getattr(service, method_name)(
-            _soapheaders=get_session_header(service_name), *args
-        )
+        envelope = None
+
+        if ALLEGRO_TEMPLATED_ENVELOPES and operation in ALLEGRO_TEMPLATED_OPERATIONS:
+            envelope = get_templated_envelope(service_name, method_name, args)
+
+        if envelope:
+
+            def send():
+                return post_templated_envelope(service_name, method_name, *envelope)
+
+        else:
+            method = getattr(service, method_name)
+            soapheaders = get_session_header(service_name)
+
+            def send():
+                return method(*args, _soapheaders=soapheaders)
+
+        # Bound to the deadline of the request, send() may run on a hedging worker thread
+        remaining_time = partial(get_time_left, get_request_deadline())
+
+        if ALLEGRO_ADAPTIVE_TIMEOUTS:
+            send = with_operation_timeout(
+                get_client(service_name), operation, send, remaining_time
+            )
+
+        # The latency of the call itself, not including the wait for a bulkhead slot
+        send = partial(timed_call, operation, send)
+
+        if ALLEGRO_BULKHEAD:
+            send = limit_concurrency(service_name, send)
+
+        if ALLEGRO_ADAPTIVE_TIMEOUTS:
+            send = with_deadline(operation, send, remaining_time)
+
+        # The session header is resolved above, send() doesn't need the request context
+        if ALLEGRO_HEDGING and operation in ALLEGRO_HEDGED_OPERATIONS:
+
+            def attempt():
+                return call_hedged(operation, send)
+
+        else:
+            attempt = send
+
+        started_at = time.perf_counter()
+
+        try:
+            response = call_with_retry(operation, attempt, remaining_time)
+        finally:
+            record_soap_call(operation, started_at)
 
         if not response or "body" not in response:
             logging.error("Unexpected response for %s", operation)
+            record_soap_call_failure(operation)
             return None
         else:
             logging.debug("\n\nResponse for %s", operation)
             logging.debug(response)
 
+            if ALLEGRO_RECORD:
+                record_response(
+                    operation, response["body"], time.perf_counter() - started_at
+                )
+
             return response["body"]
     except Exception as error:
         logging.error(
             f"Could not execute service operation: {operation}, error: {error}"
         )
+        record_soap_call_failure(operation)
 
     return None
 
@@ -146,21 +466,56 @@ def login_tijdelijk():
 def get_relatiecode_bedrijf(bsn: str):
     response_body = call_service_method("LoginService.BSNNaarRelatieMetBedrijf", bsn)
 
-    tr_relatiecodes = get_result(response_body, "TRelatiecodeBedrijfcode", [])
+    # The call failed, this doesn't mean the user has no relaties
+    if response_body is None:
+        return None
+
+    tr_relatiecodes = get_models("LoginService.BSNNaarRelatieMetBedrijf", response_body)
     relatiecodes = {}
 
-    if isinstance(tr_relatiecodes, list):
-        for relatie in tr_relatiecodes:
-            if str(relatie["Bedrijfscode"]) == bedrijf_code.FIBU:
-                relatiecodes[bedrijf.FIBU] = relatie["Relatiecode"]
-            elif str(relatie["Bedrijfscode"]) == bedrijf_code.KREDIETBANK:
-                relatiecodes[bedrijf.KREDIETBANK] = relatie["Relatiecode"]
+    for relatie in tr_relatiecodes:
+        if str(relatie.Bedrijfscode) == bedrijf_code.FIBU:
+            relatiecodes[bedrijf.FIBU] = relatie.Relatiecode
+        elif str(relatie.Bedrijfscode) == bedrijf_code.KREDIETBANK:
+            relatiecodes[bedrijf.KREDIETBANK] = relatie.Relatiecode
 
-        logging.debug(relatiecodes)
+    logging.debug(relatiecodes)
 
     return relatiecodes
 
 
+def get_relaties_cache_key(bsn: str):
+    return hash_key("relaties", bsn)
+
+
+def get_cached_relaties(bsn: str):
+    """The cached relatiecodes, an empty dict means the user is known to have no relaties"""
+    if not (KREFIA_RELATIECODE_CACHE_TTL or KREFIA_NEGATIVE_CACHE_TTL):
+        return None
+
+    with timed("cache"):
+        return krefia_cache.get(get_relaties_cache_key(bsn))
+
+
+def get_relaties(bsn: str):
+    """Relatiecodes per bedrijf, cached when KREFIA_RELATIECODE_CACHE_TTL / KREFIA_NEGATIVE_CACHE_TTL are set"""
+    relaties = get_cached_relaties(bsn)
+
+    if relaties is not None:
+        return relaties
+
+    relaties = get_relatiecode_bedrijf(bsn)
+
+    if relaties and KREFIA_RELATIECODE_CACHE_TTL:
+        krefia_cache.set(
+            get_relaties_cache_key(bsn), relaties, KREFIA_RELATIECODE_CACHE_TTL
+        )
+    elif relaties == {} and KREFIA_NEGATIVE_CACHE_TTL:
+        krefia_cache.set(get_relaties_cache_key(bsn), {}, KREFIA_NEGATIVE_CACHE_TTL)
+
+    return relaties
+
+
 def login_allowed(relatiecode: str, setSessionId: bool = False):
     response_body = call_service_method(
         "LoginService.AllegroWebMagAanmelden", relatiecode, "", ""
@@ -213,14 +568,6 @@ def get_result(response_body: dict, key: str = None, return_default: Any = None)
             result = result[key]
         elif key:
             return return_default
-
-        # Compensate for XML's weirdness in treating 1 Element = dict, >=1 Element = list
-        if (
-            result
-            and isinstance(return_default, list)
-            and not isinstance(result, type(return_default))
-        ):
-            result = [result]
     except Exception as error:
         logging.error(
             f"Unexpected result for key: {key}, error: {error}",
@@ -231,26 +578,16 @@ def get_result(response_body: dict, key: str = None, return_default: Any = None)
     return result
 
 
-def value_or_default(source: Element, key: str, default_value: Any):
-    return source[key] if key in source and source[key] else default_value
-
-
-def get_schuldhulp_aanvraag(aanvraag_header: dict):
-    aanvraag_header_clean = {
-        "RelatieCode": aanvraag_header["RelatieCode"],
-        "Volgnummer": aanvraag_header["Volgnummer"],
-        "IsNPS": aanvraag_header["IsNPS"],
-        "Status": value_or_default(aanvraag_header, "Status", ""),
-        "Statustekst": aanvraag_header["Statustekst"],
-        "Aanvraagdatum": aanvraag_header["Aanvraagdatum"],
-        "ExtraStatus": value_or_default(aanvraag_header, "ExtraStatus", ""),
-    }
-
-    TSRV_Header = get_client("SchuldHulpService").get_type("ns0:TSRVAanvraagHeader")
-
-    tsrv_header = TSRV_Header(**aanvraag_header_clean)
+def get_schuldhulp_aanvraag(aanvraag_header: TSRVAanvraagHeader):
+    aanvraag_header_clean = aanvraag_header._replace(
+        Status=aanvraag_header.Status or "",
+        ExtraStatus=aanvraag_header.ExtraStatus or "",
+    )
 
-    response_body = call_service_method("SchuldHulpService.GetSRVAanvraag", tsrv_header)
+    # zeep serializes the fields of a dict as is, there's no need to build its TSRVAanvraagHeader type
+    response_body = call_service_method(
+        "SchuldHulpService.GetSRVAanvraag", aanvraag_header_clean._asdict()
+    )
 
     aanvraag_source = get_result(response_body)
 
@@ -264,8 +601,8 @@ def get_schuldhulp_aanvraag(aanvraag_header: dict):
 
     if aanvraag_source:
         title = get_schuldhulp_title(
-            aanvraag_header["Status"],
-            aanvraag_header["ExtraStatus"],
+            aanvraag_header.Status,
+            aanvraag_header.ExtraStatus,
             aanvraag_source["Eindstatus"],
         )
         aanvraag = {
@@ -278,10 +615,11 @@ def get_schuldhulp_aanvraag(aanvraag_header: dict):
 
 
 def get_schuldhulp_aanvragen(relatiecode_fibu: str):
-    response_body = call_service_method(
-        "SchuldHulpService.GetSRVOverzicht", relatiecode_fibu
+    # Only the models are kept, the zeep response is released before the detail calls
+    tsrv_headers = get_models(
+        "SchuldHulpService.GetSRVOverzicht",
+        call_service_method("SchuldHulpService.GetSRVOverzicht", relatiecode_fibu),
     )
-    tsrv_headers = get_result(response_body, "TSRVAanvraagHeader", [])
     schuldhulp_aanvragen = []
 
     for aanvraag_header in tsrv_headers:
@@ -292,8 +630,10 @@ def get_schuldhulp_aanvragen(relatiecode_fibu: str):
     return schuldhulp_aanvragen
 
 
-def get_lening(tpl_header: dict):
-    response_body = call_service_method("FinancieringService.GetPL", tpl_header)
+def get_lening(tpl_header: TPLHeader):
+    response_body = call_service_method(
+        "FinancieringService.GetPL", tpl_header._asdict()
+    )
     lening_source = get_result(response_body)
     lening = None
 
@@ -316,10 +656,13 @@ def get_lening(tpl_header: dict):
 
 
 def get_leningen(relatiecode_kredietbank: str):
-    response_body = call_service_method(
-        "FinancieringService.GetPLOverzicht", relatiecode_kredietbank
+    # Only the models are kept, the zeep response is released before the detail calls
+    tpl_headers = get_models(
+        "FinancieringService.GetPLOverzicht",
+        call_service_method(
+            "FinancieringService.GetPLOverzicht", relatiecode_kredietbank
+        ),
     )
-    tpl_headers = get_result(response_body, "TPLHeader", [])
     leningen = []
 
     for tpl_header in tpl_headers:
@@ -332,7 +675,7 @@ def get_leningen(relatiecode_kredietbank: str):
 
 def get_budgetbeheer(relatiecode_fibu: str):
     response_body = call_service_method("BBRService.GetBBROverzicht", relatiecode_fibu)
-    tbbr_headers = get_result(response_body, "TBBRHeader", [])
+    tbbr_headers = get_models("BBRService.GetBBROverzicht", response_body)
     budgetbeheer = []
 
     title = "Lopend"
@@ -375,7 +718,7 @@ def get_notification(relatiecode: str, bedrijf: str):
             "Oplopend",
         )
 
-        tbbox_headers = get_result(response_body, "TBBoxHeader", [])
+        tbbox_headers = get_models("BerichtenBoxService.GetBerichten", response_body)
 
         if tbbox_headers:
             date_published = date.today().strftime("%Y-%m-%d")
@@ -388,49 +731,180 @@ def get_notification(relatiecode: str, bedrijf: str):
     return notification
 
 
-def get_all(bsn: str):
-    is_logged_in = login_tijdelijk()
+def first(items: list):
+    return items[0] if items else None
+
+
+# The sections of the get_all response, FIBU first because the first relatie login provides the session
+sections = {
+    "budgetbeheer": (
+        bedrijf.FIBU,
+        lambda relatiecode: first(get_budgetbeheer(relatiecode)),
+    ),
+    "fibuNotification": (
+        bedrijf.FIBU,
+        lambda relatiecode: get_notification(relatiecode, bedrijf.FIBU),
+    ),
+    "schuldhulp": (
+        bedrijf.KREDIETBANK,
+        lambda relatiecode: first(get_schuldhulp_aanvragen(relatiecode)),
+    ),
+    "lening": (
+        bedrijf.KREDIETBANK,
+        lambda relatiecode: first(get_leningen(relatiecode)),
+    ),
+    "kredietbankNotification": (
+        bedrijf.KREDIETBANK,
+        lambda relatiecode: get_notification(relatiecode, bedrijf.KREDIETBANK),
+    ),
+}
+
 
-    if is_logged_in:
-        relaties = get_relatiecode_bedrijf(bsn)
+# Where the sections end up in the response
+section_paths = {
+    "budgetbeheer": "deepLinks.budgetbeheer",
+    "fibuNotification": "notificationTriggers.fibu",
+    "schuldhulp": "deepLinks.schuldhulp",
+    "lening": "deepLinks.lening",
+    "kredietbankNotification": "notificationTriggers.krediet",
+}
 
-        schuldhulp = None
-        budgetbeheer = None
-        lening = None
-        notification_triggers = None
-        fibu_notification = None
-        kredietbank_notification = None
+section_executor = ThreadPoolExecutor(
+    max_workers=KREFIA_SECTION_WORKERS, thread_name_prefix="krefia-section"
+)
 
-        if not relaties:
-            logging.info("No relaties for this user.")
-            return None
+# The parts of the response that can be requested separately and the sections they consist of
+section_selectors = {
+    "deepLinks.schuldhulp": ["schuldhulp"],
+    "deepLinks.lening": ["lening"],
+    "deepLinks.budgetbeheer": ["budgetbeheer"],
+    "notificationTriggers": ["fibuNotification", "kredietbankNotification"],
+}
 
-        fibu_relatie_code = relaties.get(bedrijf.FIBU)
-        kredietbank_relatie_code = relaties.get(bedrijf.KREDIETBANK)
 
-        if fibu_relatie_code:
-            if login_allowed(fibu_relatie_code, True):
-                budgetbeheer = get_budgetbeheer(fibu_relatie_code)
-                fibu_notification = get_notification(
-                    relaties[bedrijf.FIBU], bedrijf.FIBU
-                )
+def get_section_names(selection: list = None):
+    if selection is None:
+        return list(sections.keys())
 
-        if kredietbank_relatie_code:
-            if login_allowed(kredietbank_relatie_code, fibu_relatie_code is None):
-                schuldhulp = get_schuldhulp_aanvragen(kredietbank_relatie_code)
-                lening = get_leningen(kredietbank_relatie_code)
-                kredietbank_notification = get_notification(
-                    relaties[bedrijf.KREDIETBANK], bedrijf.KREDIETBANK
+    section_names = []
+
+    for selector in selection:
+        section_names.extend(section_selectors[selector])
+
+    # Keep the order of the sections, the first relatie login provides the session
+    return [name for name in sections.keys() if name in section_names]
+
+
+class AllegroLogin:
+    """Logs in to Allegro on first use, data served from the cache doesn't need a session"""
+
+    def __init__(self):
+        self.is_logged_in = None
+        self.relatie_logins = {}
+
+    def login(self):
+        if self.is_logged_in is None:
+            with timed("login"):
+                self.is_logged_in = login_tijdelijk()
+
+        if not self.is_logged_in:
+            raise Exception("Could not login to Allegro")
+
+    def login_relatie(self, relatiecode: str):
+        if relatiecode not in self.relatie_logins:
+            self.login()
+
+            with timed("login"):
+                self.relatie_logins[relatiecode] = login_allowed(
+                    relatiecode, not self.relatie_logins
                 )
 
-        if not (
-            budgetbeheer
-            or schuldhulp
-            or lening
-            or fibu_notification
-            or kredietbank_notification
-        ):
-            return None
+        return self.relatie_logins[relatiecode]
+
+
+def get_section_cache_key(name: str, relatiecode: str):
+    return hash_key("section", name, relatiecode)
+
+
+def get_cached_section(name: str, relatiecode: str):
+    """Returns (is_cached, value)"""
+    if not KREFIA_SECTION_CACHE_TTL.get(name):
+        return False, None
+
+    with timed("cache"):
+        cached = krefia_cache.get(get_section_cache_key(name, relatiecode))
+
+    if cached is None:
+        return False, None
+
+    return True, cached["value"]
+
+
+def cache_section(name: str, relatiecode: str, value: Any):
+    ttl = KREFIA_SECTION_CACHE_TTL.get(name)
+
+    if ttl:
+        krefia_cache.set(
+            get_section_cache_key(name, relatiecode), {"value": value}, ttl
+        )
+
+
+def load_section(name: str, relatiecode: str):
+    """The value of the section, cached unless one of its calls failed"""
+    section_bedrijf, get_section_value = sections[name]
+
+    with track_soap_call_failures() as failures, timed(f"section-{name}"):
+        value = get_section_value(relatiecode)
+
+    if not failures:
+        cache_section(name, relatiecode, value)
+
+    return value
+
+
+def run_in_app_context(fn, *args):
+    """Wraps fn to run on another thread with the app context, Allegro session and deadline of this one"""
+    app = current_app._get_current_object()
+    session_id = get_session_id()
+    server_timing = get_server_timing()
+    soap_call_log = get_soap_call_log()
+    soap_call_failure_scopes = get_soap_call_failure_scopes()
+    request_deadline = get_request_deadline()
+
+    def run():
+        with app.app_context():
+            set_session_id(session_id)
+            set_server_timing(server_timing)
+            set_soap_call_log(soap_call_log)
+            set_soap_call_failure_scopes(soap_call_failure_scopes)
+            set_request_deadline(request_deadline)
+            return fn(*args)
+
+    return run
+
+
+def create_all_response(section_values: dict, selection: list = None):
+    if not any(section_values.values()):
+        return None
+
+    def is_selected(selector: str):
+        return selection is None or selector in selection
+
+    response = {}
+
+    deep_links = {
+        name: section_values.get(name)
+        for name in ["schuldhulp", "lening", "budgetbeheer"]
+        if is_selected(f"deepLinks.{name}")
+    }
+
+    if deep_links:
+        response["deepLinks"] = deep_links
+
+    if is_selected("notificationTriggers"):
+        fibu_notification = section_values.get("fibuNotification")
+        kredietbank_notification = section_values.get("kredietbankNotification")
+        notification_triggers = None
 
         if fibu_notification or kredietbank_notification:
             notification_triggers = {}
@@ -441,13 +915,134 @@ def get_all(bsn: str):
             if kredietbank_notification:
                 notification_triggers["krediet"] = kredietbank_notification
 
-        return {
-            "deepLinks": {
-                "schuldhulp": schuldhulp[0] if schuldhulp else None,
-                "lening": lening[0] if lening else None,
-                "budgetbeheer": budgetbeheer[0] if budgetbeheer else None,
-            },
-            "notificationTriggers": notification_triggers,
-        }
+        response["notificationTriggers"] = notification_triggers
+
+    return response
+
+
+def get_user_relaties(bsn: str, allegro_login: AllegroLogin):
+    relaties = get_cached_relaties(bsn)
+
+    # Most users don't have any relatie, skip Allegro altogether for the ones we already know of
+    if relaties == {}:
+        logging.info("No relaties for this user (cached).")
+        return None
+
+    if relaties is None:
+        allegro_login.login()
+
+        with timed("relaties"):
+            relaties = get_relaties(bsn)
+
+    if not relaties:
+        logging.info("No relaties for this user.")
+        return None
+
+    return relaties
+
+
+def iter_sections(bsn: str, selection: list = None, executor=None):
+    """Yields (name, value) of the sections, nothing for users without relaties.
+
+    With an executor the sections that aren't cached are loaded concurrently and yielded as they
+    complete, otherwise they are loaded one by one in order.
+    """
+    allegro_login = AllegroLogin()
+    relaties = get_user_relaties(bsn, allegro_login)
+
+    if not relaties:
+        return
+
+    futures = {}
+
+    for name in get_section_names(selection):
+        section_bedrijf, get_section_value = sections[name]
+        relatiecode = relaties.get(section_bedrijf)
+
+        if not relatiecode:
+            yield name, None
+            continue
+
+        is_cached, value = get_cached_section(name, relatiecode)
+
+        if is_cached:
+            yield name, value
+            continue
+
+        # The relatie logins run in order, they determine the session used for the section calls
+        with track_soap_call_failures() as failures:
+            is_allowed = allegro_login.login_relatie(relatiecode)
+
+        if not is_allowed:
+            if not failures:
+                cache_section(name, relatiecode, None)
+
+            yield name, None
+            continue
+
+        if executor is None:
+            yield name, load_section(name, relatiecode)
+        else:
+            future = executor.submit(
+                run_in_app_context(load_section, name, relatiecode)
+            )
+            futures[future] = name
+
+    for future in as_completed(futures):
+        yield futures[future], future.result()
+
+
+def get_all(bsn: str, selection: list = None):
+    """The deeplinks and notification triggers of a user, selection limits the response to
+    some of the section_selectors (and Allegro calls to the ones these need)."""
+    section_values = dict(iter_sections(bsn, selection))
+    return create_all_response(section_values, selection)
+
+
+def get_all_cache_key(bsn: str, selection: list = None):
+    if selection is None:
+        return hash_key("all", bsn)
+
+    return hash_key("all", bsn, ",".join(sorted(selection)))
+
+
+def refresh_all_cached(bsn: str, selection: list = None):
+    """Fetches the data from Allegro and caches it, returns (content, etag).
+
+    Data that is incomplete because Allegro calls failed is not cached, a previously cached
+    entry is kept.
+    """
+    with track_soap_call_failures() as failures:
+        content = get_all(bsn, selection)
+
+    etag = get_etag(content)
+
+    if failures:
+        logging.warning("Not caching the response, failed calls: %s", failures)
+    else:
+        krefia_cache.set(
+            get_all_cache_key(bsn, selection),
+            {"content": content, "etag": etag},
+            KREFIA_CACHE_TTL,
+        )
+
+    return content, etag
+
+
+def get_all_cached(bsn: str, selection: list = None):
+    """Returns (content, etag), the etag is None when caching is disabled"""
+    if not KREFIA_CACHE_TTL:
+        return get_all(bsn, selection), None
+
+    with timed("cache"):
+        cached = krefia_cache.get(get_all_cache_key(bsn, selection))
+
+    if cached is not None:
+        return cached["content"], cached["etag"]
+
+    return refresh_all_cached(bsn, selection)
+
 
-    raise Exception("Could not login to Allegro")
+def get_all_expires_at(bsn: str):
+    entry = krefia_cache.get_entry(get_all_cache_key(bsn))
+    return entry[1] if entry else None
@@ -5,6 +5,7 @@ from flask_httpauth import HTTPTokenAuth
 import jwt
 
 from app.config import VERIFY_JWT_SIGNATURE
+from app.server_timing import timed
 
 auth = HTTPTokenAuth(scheme="Bearer")
 
@@ -138,7 +139,9 @@ def get_user_profile_from_token(token):
 def verify_token(token):
     if not token:
         raise AuthError("Token not found")
-    return get_user_profile_from_token(token)
+
+    with timed("auth"):
+        return get_user_profile_from_token(token)
 
 
 def get_current_user():
@@ -0,0 +1,153 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from requests import RequestException
+from zeep.exceptions import TransportError
+
+from app.config import (
+    ALLEGRO_BULKHEAD_ADAPTIVE,
+    ALLEGRO_BULKHEAD_GLOBAL_LIMIT,
+    ALLEGRO_BULKHEAD_LATENCY_TARGET,
+    ALLEGRO_BULKHEAD_MAX_QUEUE,
+    ALLEGRO_BULKHEAD_QUEUE_TIMEOUT,
+    ALLEGRO_BULKHEAD_SERVICE_LIMIT,
+)
+from app.timeouts import DeadlineExceeded
+
+
+class BulkheadRejected(Exception):
+    pass
+
+
+class Bulkhead:
+    """Limits the number of concurrent calls, callers over the limit wait in a bounded queue.
+
+    With adaptive=True the limit follows AIMD: +1/limit for every call that completes within
+    the latency target, halved when a call is slower or fails in transport. SOAP faults are
+    answers of Allegro and count by their latency, calls that never reached Allegro don't count.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        max_queue: int = ALLEGRO_BULKHEAD_MAX_QUEUE,
+        queue_timeout: float = ALLEGRO_BULKHEAD_QUEUE_TIMEOUT,
+        adaptive: bool = ALLEGRO_BULKHEAD_ADAPTIVE,
+        latency_target: float = ALLEGRO_BULKHEAD_LATENCY_TARGET,
+        min_limit: int = 1,
+    ):
+        self.name = name
+        self.max_limit = limit
+        self.min_limit = min(min_limit, limit)
+        self.limit = float(limit)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.latency_target = latency_target
+
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.condition = threading.Condition()
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire(self):
+        with self.condition:
+            if self.has_capacity() and not self.queued:
+                self.in_flight += 1
+                return
+
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise BulkheadRejected(f"Bulkhead {self.name} queue is full")
+
+            self.queued += 1
+            try:
+                if not self.condition.wait_for(self.has_capacity, self.queue_timeout):
+                    self.timed_out += 1
+                    raise BulkheadRejected(f"Bulkhead {self.name} queue timeout")
+                self.in_flight += 1
+            finally:
+                self.queued -= 1
+
+    def release(self, duration: float = None, failed: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+
+            if self.adaptive and (duration is not None or failed):
+                if failed or (duration is not None and duration > self.latency_target):
+                    self.limit = max(self.limit / 2, self.min_limit)
+                else:
+                    self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start = time.monotonic()
+        called = True
+        failed = False
+        try:
+            yield
+        except (BulkheadRejected, DeadlineExceeded):
+            # Rejected by the global bulkhead or out of time, Allegro wasn't called
+            called = False
+            raise
+        except (RequestException, TransportError):
+            failed = True
+            raise
+        finally:
+            self.release(time.monotonic() - start if called else None, failed)
+
+    def get_metrics(self):
+        with self.condition:
+            return {
+                "limit": int(self.limit),
+                "inFlight": self.in_flight,
+                "queueDepth": self.queued,
+                "rejected": self.rejected,
+                "timedOut": self.timed_out,
+            }
+
+
+global_bulkhead = Bulkhead("global", ALLEGRO_BULKHEAD_GLOBAL_LIMIT)
+service_bulkheads = {}
+service_bulkheads_lock = threading.Lock()
+
+
+def get_service_bulkhead(service_name: str):
+    with service_bulkheads_lock:
+        if service_name not in service_bulkheads:
+            service_bulkheads[service_name] = Bulkhead(
+                service_name, ALLEGRO_BULKHEAD_SERVICE_LIMIT
+            )
+        return service_bulkheads[service_name]
+
+
+def limit_concurrency(service_name: str, fn):
+    """Wraps fn so it only runs with a slot in both the service and the global bulkhead"""
+
+    def limited(*args, **kwargs):
+        # Always acquire in the same order (service, then global) to prevent deadlocks
+        with get_service_bulkhead(service_name).slot(), global_bulkhead.slot():
+            return fn(*args, **kwargs)
+
+    return limited
+
+
+def get_bulkhead_metrics():
+    with service_bulkheads_lock:
+        services = dict(service_bulkheads)
+
+    return {
+        "global": global_bulkhead.get_metrics(),
+        "services": {
+            name: bulkhead.get_metrics() for name, bulkhead in services.items()
+        },
+    }
@@ -0,0 +1,195 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from app.config import (
+    KREFIA_CACHE_BACKEND,
+    KREFIA_CACHE_KEY_SECRET,
+    KREFIA_CACHE_MAX_ENTRIES,
+    KREFIA_CACHE_PATH,
+)
+
+
+def hash_key(*parts: str):
+    """Cache keys never contain the BSN / relatiecode itself, nor a plain hash that can be brute-forced"""
+    return hmac.new(
+        KREFIA_CACHE_KEY_SECRET.encode(),
+        ":".join(str(part) for part in parts).encode(),
+        hashlib.sha256,
+    ).hexdigest()
+
+
+class MemoryCache:
+    """Process local LRU cache with a TTL per entry"""
+
+    def __init__(self, max_entries: int = KREFIA_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_entry(self, key: str):
+        """Returns (value, expires_at) or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[1] <= time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return entry
+
+    def get(self, key: str, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value, ttl: int):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def serialize(value):
+    return zlib.compress(
+        json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    )
+
+
+def deserialize(data: bytes):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class SQLiteCache:
+    """Cache in a local SQLite file, shared by the worker processes and kept across respawns.
+
+    Values are stored as compressed JSON so only JSON serializable values can be cached.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(
+        self, path: str = KREFIA_CACHE_PATH, max_entries: int = KREFIA_CACHE_MAX_ENTRIES
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.writes = 0
+
+        with self.connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+        # The default path is in the (shared) temp dir, the WAL files get the same permissions
+        try:
+            os.chmod(self.path, 0o600)
+        except OSError as error:
+            logging.error("Could not restrict the cache file permissions: %s", error)
+
+    def connection(self):
+        # A connection can't be shared between threads or forked processes
+        pid = os.getpid()
+
+        if getattr(self.local, "pid", None) != pid:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = pid
+
+        return self.local.connection
+
+    def get_entry(self, key: str):
+        """Returns (value, expires_at) or None"""
+        try:
+            row = (
+                self.connection()
+                .execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ? AND expires_at > ?",
+                    (key, time.time()),
+                )
+                .fetchone()
+            )
+        except sqlite3.Error as error:
+            logging.error("Cache read failed: %s", error)
+            return None
+
+        if row is None:
+            return None
+
+        return deserialize(row[0]), row[1]
+
+    def get(self, key: str, default=None):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key: str, value, ttl: int):
+        try:
+            self.connection().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, serialize(value), time.time() + ttl),
+            )
+        except sqlite3.Error as error:
+            logging.error("Cache write failed: %s", error)
+            return
+
+        self.writes += 1
+
+        if self.writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self):
+        try:
+            connection = self.connection()
+            connection.execute(
+                "DELETE FROM cache WHERE expires_at <= ?", (time.time(),)
+            )
+            connection.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error as error:
+            logging.error("Cache prune failed: %s", error)
+
+    def delete(self, key: str):
+        try:
+            self.connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as error:
+            logging.error("Cache delete failed: %s", error)
+
+    def clear(self):
+        try:
+            self.connection().execute("DELETE FROM cache")
+        except sqlite3.Error as error:
+            logging.error("Cache clear failed: %s", error)
+
+
+def create_cache(backend: str = KREFIA_CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteCache(KREFIA_CACHE_PATH)
+
+    return MemoryCache()
+
+
+krefia_cache = create_cache()
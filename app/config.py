@@ -1,10 +1,14 @@
 import logging
 import logging.config
 import os
+import secrets
+import tempfile
 from datetime import date, time
 
 from flask.json.provider import DefaultJSONProvider
 
+from app.queued_logging import configure_logging
+
 BASE_PATH = os.path.abspath(os.path.dirname(__file__))
 
 OTAP_ENV = os.getenv("MA_OTAP_ENV")
@@ -30,16 +34,178 @@ ALLEGRO_EXCLUDE_OPDRACHTGEVER = os.getenv("ALLEGRO_EXCLUDE_OPDRACHTGEVER", "").s
 )
 ALLEGRO_REQUEST_TIMEOUT = 60
 
+# Time out each call at a multiple of the observed latency percentile of its operation, between the
+# floor and ALLEGRO_REQUEST_TIMEOUT
+ALLEGRO_ADAPTIVE_TIMEOUTS = (
+    os.getenv("ALLEGRO_ADAPTIVE_TIMEOUTS", "true").lower() == "true"
+)
+ALLEGRO_TIMEOUT_PERCENTILE = float(os.getenv("ALLEGRO_TIMEOUT_PERCENTILE", 99))
+ALLEGRO_TIMEOUT_MULTIPLIER = float(os.getenv("ALLEGRO_TIMEOUT_MULTIPLIER", 3))
+ALLEGRO_TIMEOUT_FLOOR = float(os.getenv("ALLEGRO_TIMEOUT_FLOOR", 2))
+
+# Share one transport (requests session and connection pool) between the service clients
+ALLEGRO_SHARED_TRANSPORT = (
+    os.getenv("ALLEGRO_SHARED_TRANSPORT", "false").lower() == "true"
+)
+
+# Record the (scrubbed) responses and durations of the Allegro calls, for replay in benchmarks
+ALLEGRO_RECORD = (
+    os.getenv("ALLEGRO_RECORD", "false").lower() == "true" and not IS_PRODUCTION
+)
+ALLEGRO_RECORD_PATH = os.getenv(
+    "ALLEGRO_RECORD_PATH", os.path.join(tempfile.gettempdir(), "allegro-corpus")
+)
+
+# Back off exponentially after a failed client initialisation, probing Allegro quickly before trying again
+ALLEGRO_CLIENT_BACKOFF_BASE_DELAY = float(
+    os.getenv("ALLEGRO_CLIENT_BACKOFF_BASE_DELAY", 1)
+)
+ALLEGRO_CLIENT_BACKOFF_MAX_DELAY = float(
+    os.getenv("ALLEGRO_CLIENT_BACKOFF_MAX_DELAY", 60)
+)
+ALLEGRO_CLIENT_PROBE_TIMEOUT = float(os.getenv("ALLEGRO_CLIENT_PROBE_TIMEOUT", 3))
+
+# Send the fixed-shape read operations from a pre-serialized envelope instead of building them with zeep on every call
+ALLEGRO_TEMPLATED_ENVELOPES = (
+    os.getenv("ALLEGRO_TEMPLATED_ENVELOPES", "false").lower() == "true"
+)
+ALLEGRO_TEMPLATED_OPERATIONS = [
+    "LoginService.BSNNaarRelatieMetBedrijf",
+    "FinancieringService.GetPLOverzicht",
+    "BerichtenBoxService.GetBerichten",
+]
+
+# Retry transient transport errors of read operations, with jittered exponential backoff
+ALLEGRO_RETRY_ATTEMPTS = int(os.getenv("ALLEGRO_RETRY_ATTEMPTS", 3))
+ALLEGRO_RETRY_BASE_DELAY = float(os.getenv("ALLEGRO_RETRY_BASE_DELAY", 0.2))
+ALLEGRO_RETRY_MAX_DELAY = float(os.getenv("ALLEGRO_RETRY_MAX_DELAY", 2))
+
+# Rolling window (number of calls) used for the per-operation latency percentiles
+ALLEGRO_LATENCY_WINDOW_SIZE = int(os.getenv("ALLEGRO_LATENCY_WINDOW_SIZE", 200))
+ALLEGRO_LATENCY_MIN_SAMPLES = int(os.getenv("ALLEGRO_LATENCY_MIN_SAMPLES", 20))
+
+# Send a duplicate request for slow idempotent read operations, first response wins
+ALLEGRO_HEDGING = os.getenv("ALLEGRO_HEDGING", "false").lower() == "true"
+ALLEGRO_HEDGED_OPERATIONS = [
+    "FinancieringService.GetPLOverzicht",
+    "FinancieringService.GetPL",
+    "SchuldHulpService.GetSRVOverzicht",
+    "BBRService.GetBBROverzicht",
+    "BerichtenBoxService.GetBerichten",
+]
+ALLEGRO_HEDGE_PERCENTILE = float(os.getenv("ALLEGRO_HEDGE_PERCENTILE", 95))
+# Delay used until enough latencies have been observed for an operation
+ALLEGRO_HEDGE_DEFAULT_DELAY = float(os.getenv("ALLEGRO_HEDGE_DEFAULT_DELAY", 2.0))
+ALLEGRO_HEDGE_MIN_DELAY = float(os.getenv("ALLEGRO_HEDGE_MIN_DELAY", 0.05))
+# Hedged requests may add at most this fraction of extra calls
+ALLEGRO_HEDGE_MAX_RATIO = float(os.getenv("ALLEGRO_HEDGE_MAX_RATIO", 0.1))
+ALLEGRO_HEDGE_MAX_WORKERS = int(os.getenv("ALLEGRO_HEDGE_MAX_WORKERS", 8))
+
+# Concurrency limits (per worker process) for outbound Allegro calls
+ALLEGRO_BULKHEAD = os.getenv("ALLEGRO_BULKHEAD", "true").lower() == "true"
+ALLEGRO_BULKHEAD_GLOBAL_LIMIT = int(os.getenv("ALLEGRO_BULKHEAD_GLOBAL_LIMIT", 16))
+ALLEGRO_BULKHEAD_SERVICE_LIMIT = int(os.getenv("ALLEGRO_BULKHEAD_SERVICE_LIMIT", 8))
+ALLEGRO_BULKHEAD_MAX_QUEUE = int(os.getenv("ALLEGRO_BULKHEAD_MAX_QUEUE", 32))
+ALLEGRO_BULKHEAD_QUEUE_TIMEOUT = float(os.getenv("ALLEGRO_BULKHEAD_QUEUE_TIMEOUT", 5))
+# Adapt the limits (AIMD) to the observed latency: calls slower than the target halve the limit
+ALLEGRO_BULKHEAD_ADAPTIVE = (
+    os.getenv("ALLEGRO_BULKHEAD_ADAPTIVE", "false").lower() == "true"
+)
+ALLEGRO_BULKHEAD_LATENCY_TARGET = float(os.getenv("ALLEGRO_BULKHEAD_LATENCY_TARGET", 5))
+
+# Cache for the get_all results, seconds (0 disables caching)
+KREFIA_CACHE_TTL = int(os.getenv("KREFIA_CACHE_TTL", 0))
+KREFIA_CACHE_MAX_ENTRIES = int(os.getenv("KREFIA_CACHE_MAX_ENTRIES", 1000))
+# Relatiecodes per BSN, seconds (0 disables caching)
+KREFIA_RELATIECODE_CACHE_TTL = int(os.getenv("KREFIA_RELATIECODE_CACHE_TTL", 0))
+# Users without any relatie with FIBU / KREDIETBANK, seconds (0 disables caching)
+KREFIA_NEGATIVE_CACHE_TTL = int(os.getenv("KREFIA_NEGATIVE_CACHE_TTL", 0))
+# Profile types (see auth.py) that can have Krefia data, other profiles never reach Allegro
+KREFIA_PROFILE_TYPES = os.getenv("KREFIA_PROFILE_TYPES", "private").split(",")
+# Sections of the get_all response per relatiecode, seconds (0 disables caching)
+KREFIA_SECTION_CACHE_TTL = {
+    "budgetbeheer": int(os.getenv("KREFIA_SECTION_CACHE_TTL_BUDGETBEHEER", 0)),
+    "schuldhulp": int(os.getenv("KREFIA_SECTION_CACHE_TTL_SCHULDHULP", 0)),
+    "lening": int(os.getenv("KREFIA_SECTION_CACHE_TTL_LENING", 0)),
+    "fibuNotification": int(os.getenv("KREFIA_SECTION_CACHE_TTL_FIBU_NOTIFICATION", 0)),
+    "kredietbankNotification": int(
+        os.getenv("KREFIA_SECTION_CACHE_TTL_KREDIETBANK_NOTIFICATION", 0)
+    ),
+}
+# Threads (per worker process) that load the sections of streamed responses concurrently
+KREFIA_SECTION_WORKERS = int(os.getenv("KREFIA_SECTION_WORKERS", 8))
+# memory: per worker process, sqlite: a local file shared by the workers on the node
+KREFIA_CACHE_BACKEND = os.getenv("KREFIA_CACHE_BACKEND", "memory")
+KREFIA_CACHE_PATH = os.getenv(
+    "KREFIA_CACHE_PATH", os.path.join(tempfile.gettempdir(), "krefia-cache.sqlite")
+)
+# HMAC secret of the cache keys, a BSN can't be recovered from a key without it. Without a configured
+# secret a random one is used, shared by the workers forked from the master process.
+KREFIA_CACHE_KEY_SECRET = os.getenv("KREFIA_CACHE_KEY_SECRET") or secrets.token_hex(32)
+
+# Refresh the cached get_all results of recently active users shortly before they expire
+KREFIA_REFRESH = os.getenv("KREFIA_REFRESH", "false").lower() == "true"
+KREFIA_REFRESH_BEFORE_EXPIRY = int(os.getenv("KREFIA_REFRESH_BEFORE_EXPIRY", 60))
+KREFIA_REFRESH_INTERVAL = int(os.getenv("KREFIA_REFRESH_INTERVAL", 15))
+KREFIA_REFRESH_ACTIVE_WINDOW = int(os.getenv("KREFIA_REFRESH_ACTIVE_WINDOW", 1800))
+KREFIA_REFRESH_MAX_USERS = int(os.getenv("KREFIA_REFRESH_MAX_USERS", 500))
+KREFIA_REFRESH_CONCURRENCY = int(os.getenv("KREFIA_REFRESH_CONCURRENCY", 2))
+# Pause between starting two refreshes, seconds
+KREFIA_REFRESH_PACING = float(os.getenv("KREFIA_REFRESH_PACING", 0.2))
+
+# Load the data of users that logged in (POST /krefia/prefetch) in the background, into the cache
+KREFIA_PREFETCH_CONCURRENCY = int(os.getenv("KREFIA_PREFETCH_CONCURRENCY", 2))
+KREFIA_PREFETCH_MAX_PENDING = int(os.getenv("KREFIA_PREFETCH_MAX_PENDING", 100))
+# Seconds /krefia/all waits for a running prefetch of the same user instead of fetching it again
+KREFIA_PREFETCH_WAIT = float(os.getenv("KREFIA_PREFETCH_WAIT", 5))
+
+# /status/ready: build the Allegro clients and probe Allegro in the background every interval seconds,
+# the worker is ready once all clients are built and a probe succeeded within max age seconds
+KREFIA_READINESS_INTERVAL = float(os.getenv("KREFIA_READINESS_INTERVAL", 15))
+KREFIA_READINESS_MAX_AGE = float(os.getenv("KREFIA_READINESS_MAX_AGE", 60))
+
+# Reject requests early (503) that can't finish within their time budget anymore
+KREFIA_LOAD_SHEDDING = os.getenv("KREFIA_LOAD_SHEDDING", "true").lower() == "true"
+# Set by the front-end proxy, t=<seconds>, or a timestamp in seconds, milli- or microseconds
+KREFIA_REQUEST_START_HEADER = os.getenv(
+    "KREFIA_REQUEST_START_HEADER", "X-Request-Start"
+)
+# Total time a request may take, including the time it waited in the queue (see harakiri in uwsgi.ini)
+KREFIA_REQUEST_BUDGET = float(os.getenv("KREFIA_REQUEST_BUDGET", 20))
+# Expected processing time until enough requests have been observed
+KREFIA_REQUEST_DEFAULT_DURATION = float(os.getenv("KREFIA_REQUEST_DEFAULT_DURATION", 2))
+KREFIA_RETRY_AFTER = int(os.getenv("KREFIA_RETRY_AFTER", 5))
+
+# Add a Server-Timing header with the durations of the request phases to /krefia/all responses
+KREFIA_SERVER_TIMING = (
+    os.getenv("KREFIA_SERVER_TIMING", str(not IS_PRODUCTION)).lower() == "true"
+)
+
+# Sample the stacks of /krefia/all requests outside production: always, on request header or a fraction of requests
+KREFIA_PROFILING = os.getenv("KREFIA_PROFILING", "false").lower() == "true"
+KREFIA_PROFILING_HEADER = os.getenv("KREFIA_PROFILING_HEADER", "X-Krefia-Profile")
+KREFIA_PROFILING_SAMPLE_RATE = float(os.getenv("KREFIA_PROFILING_SAMPLE_RATE", 0))
+# Seconds between two stack samples
+KREFIA_PROFILING_INTERVAL = float(os.getenv("KREFIA_PROFILING_INTERVAL", 0.005))
+# Folded stacks, one file per request, for flamegraph.pl or speedscope
+KREFIA_PROFILING_DIR = os.getenv(
+    "KREFIA_PROFILING_DIR", os.path.join(tempfile.gettempdir(), "krefia-profiles")
+)
+
 KREFIA_SSO_KREDIETBANK = os.getenv("KREFIA_SSO_KREDIETBANK", "")
 KREFIA_SSO_FIBU = os.getenv("KREFIA_SSO_FIBU", "")
 
 # Set-up logging
 LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR").upper()
 
-logging.basicConfig(
+# Records waiting for the writer thread, more are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+queued_logging = configure_logging(
+    level=LOG_LEVEL,
     format="%(asctime)s,%(msecs)d %(levelname)-8s [%(pathname)s:%(lineno)d in function %(funcName)s] %(message)s",
     datefmt="%Y-%m-%d:%H:%M:%S",
-    level=LOG_LEVEL,
+    maxsize=LOG_QUEUE_SIZE,
 )
 
 
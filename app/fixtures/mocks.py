@@ -1,13 +1,24 @@
 # Mock the soap client
+import json
 import os
 import pprint
+import random
 import re
+import time
+from contextlib import contextmanager
 from types import FunctionType, LambdaType
 from typing import List, Tuple, Union
 from unittest.mock import Mock
+from flask import g
 from lxml import etree
+from requests import Response
+from zeep import Client
+from zeep.settings import Settings
 
 from app.config import BASE_PATH
+from app.models import operation_models
+from app.recording import load_corpus
+from app.soap_calls import set_soap_call_log, start_soap_call_log
 
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -89,6 +100,14 @@ class MockService:
                 ]
             }
 
+            # Like zeep, a single array element is a list too (lxml_to_dict doesn't know the schema)
+            operation = f"{service_name}.{method_name}"
+            result = response["body"].get("Result")
+            if operation in operation_models and isinstance(result, dict):
+                key = operation_models[operation][0]
+                if isinstance(result.get(key), dict):
+                    result[key] = [result[key]]
+
             return response
 
         return r
@@ -136,6 +155,63 @@ def mock_clients(
     return mocked_services
 
 
+def fixture_client(service_name: str):
+    """A real zeep client for the (minimal) service description in the fixtures"""
+    return Client(
+        wsdl=os.path.join(FIXTURES_PATH, f"{service_name}.wsdl"),
+        settings=Settings(xsd_ignore_sequence_order=True, strict=False),
+    )
+
+
+def fixture_http_response(service_name: str, method_name: str):
+    response = Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/xml; charset=utf-8"
+    response._content = load_response_file(service_name, method_name)
+    return response
+
+
+@contextmanager
+def count_soap_calls():
+    """Yields the log of the Allegro calls made in the block (within a request context), works with
+    mock_client/mock_clients as the calls are counted in call_service_method"""
+    previous = g.get("soap_call_log")
+    soap_call_log = start_soap_call_log()
+
+    try:
+        yield soap_call_log
+    finally:
+        g.pop("soap_call_log", None)
+        set_soap_call_log(previous)
+
+
+def replay_method(recordings: list, speed: float):
+    def call(*args, **kwargs):
+        recording = random.choice(recordings)
+
+        if speed:
+            time.sleep(recording["duration"] / speed)
+
+        # A fresh copy, callers may modify the response
+        return {"body": json.loads(json.dumps(recording["body"]))}
+
+    return call
+
+
+def replay_clients(path: str = None, speed: float = 1):
+    """Stand-in clients answering with the recorded responses, after the recorded duration divided
+    by speed (0 to answer immediately). Use like mock_clients."""
+    methods = {}
+
+    for operation, recordings in load_corpus(path).items():
+        service_name, method_name = operation.split(".")
+        methods.setdefault(service_name, []).append(
+            (method_name, replay_method(recordings, speed))
+        )
+
+    return mock_clients(list(methods.items()))
+
+
 # def mock_soap_response(file_name: str):
 #     def response(*args):
 #         r = Response()
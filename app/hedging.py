@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from requests.exceptions import Timeout
+
+from app.config import (
+    ALLEGRO_HEDGE_DEFAULT_DELAY,
+    ALLEGRO_HEDGE_MAX_RATIO,
+    ALLEGRO_HEDGE_MAX_WORKERS,
+    ALLEGRO_HEDGE_MIN_DELAY,
+    ALLEGRO_HEDGE_PERCENTILE,
+)
+from app.latency import get_latency_percentile, record_latency
+
+
+class HedgeBudget:
+    """Token bucket that limits hedged requests to a fraction of all calls.
+
+    Every call adds `ratio` tokens (up to `max_tokens`), every hedge costs one token.
+    """
+
+    def __init__(self, ratio: float = ALLEGRO_HEDGE_MAX_RATIO, max_tokens: float = 10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.lock = threading.Lock()
+
+    def add_call(self):
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def acquire(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+hedge_budget = HedgeBudget()
+hedge_stats = {"calls": 0, "hedged": 0, "hedge_won": 0, "budget_exhausted": 0}
+hedge_stats_lock = threading.Lock()
+
+executor = ThreadPoolExecutor(
+    max_workers=ALLEGRO_HEDGE_MAX_WORKERS, thread_name_prefix="allegro-hedge"
+)
+
+
+def count_hedge_stat(name: str):
+    # The request threads and the hedging workers update the stats concurrently
+    with hedge_stats_lock:
+        hedge_stats[name] += 1
+
+
+def get_hedge_metrics():
+    with hedge_stats_lock:
+        return dict(hedge_stats)
+
+
+def get_hedge_delay(operation: str):
+    delay = get_latency_percentile(operation, ALLEGRO_HEDGE_PERCENTILE)
+
+    if delay is None:
+        return ALLEGRO_HEDGE_DEFAULT_DELAY
+
+    return max(delay, ALLEGRO_HEDGE_MIN_DELAY)
+
+
+def timed_call(operation: str, fn):
+    """Calls fn and records its latency, wrap the actual call (not the wait for a bulkhead slot)"""
+    start = time.monotonic()
+
+    try:
+        result = fn()
+    except Timeout:
+        # Timed out calls count too, otherwise the adaptive timeouts could only shrink
+        record_latency(operation, time.monotonic() - start)
+        raise
+
+    record_latency(operation, time.monotonic() - start)
+    return result
+
+
+def call_hedged(operation: str, fn):
+    """Calls fn, and calls it a second time if the first call takes longer than the observed p95.
+
+    The first successful result wins. fn runs on a worker thread so it must not depend on
+    the request / app context, it records its own latency (see timed_call).
+    """
+    count_hedge_stat("calls")
+    hedge_budget.add_call()
+
+    primary = executor.submit(fn)
+    done, _ = wait([primary], timeout=get_hedge_delay(operation))
+
+    if done:
+        return primary.result()
+
+    if not hedge_budget.acquire():
+        count_hedge_stat("budget_exhausted")
+        return primary.result()
+
+    logging.info("Hedging slow call to %s", operation)
+    count_hedge_stat("hedged")
+
+    hedge = executor.submit(fn)
+    pending = {primary, hedge}
+
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        succeeded = [future for future in done if future.exception() is None]
+
+        if succeeded:
+            if hedge in succeeded:
+                count_hedge_stat("hedge_won")
+                return hedge.result()
+            return primary.result()
+
+        if not pending:
+            # Both attempts failed, raise the error of the last one
+            return done.pop().result()
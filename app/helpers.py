@@ -1,12 +1,52 @@
+import hashlib
+import json
+
+from flask import request
 from flask.helpers import make_response
 
 
-def success_response_json(response_content):
-    return make_response({"status": "OK", "content": response_content}, 200)
+def success_response_json(response_content, code: int = 200):
+    return make_response({"status": "OK", "content": response_content}, code)
+
+
+def error_response_json(message: str, code: int = 500, content=None):
+    response_content = {"status": "ERROR", "message": message}
+
+    if content is not None:
+        response_content["content"] = content
+
+    return make_response(response_content, code)
+
+
+def get_etag(response_content):
+    """Strong ETag over the (canonically serialized) response content"""
+    content_json = json.dumps(
+        response_content, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(content_json.encode("utf-8")).hexdigest()
+
+
+def conditional_response_json(response_content, etag: str = None):
+    """Success response with an ETag, answers a matching If-None-Match with a 304.
+
+    Pass a precomputed etag (e.g. stored alongside cached content) to skip serializing
+    the content when the client already has it.
+    """
+    if etag is None:
+        etag = get_etag(response_content)
+
+    # If-None-Match uses the weak comparison, proxies may have weakened the tag (W/"...")
+    if request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = success_response_json(response_content)
 
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Authorization")
 
-def error_response_json(message: str, code: int = 500):
-    return make_response({"status": "ERROR", "message": message}, code)
+    return response
 
 
 class dotdict(dict):
@@ -0,0 +1,58 @@
+import math
+import threading
+from collections import deque
+
+from app.config import ALLEGRO_LATENCY_MIN_SAMPLES, ALLEGRO_LATENCY_WINDOW_SIZE
+
+
+class LatencyWindow:
+    """Rolling window of the most recent call durations (in seconds) of one operation"""
+
+    def __init__(self, size: int = ALLEGRO_LATENCY_WINDOW_SIZE):
+        self.samples = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def record(self, duration: float):
+        with self.lock:
+            self.samples.append(duration)
+
+    def percentile(self, percentile: float, min_samples: int = 1):
+        with self.lock:
+            samples = sorted(self.samples)
+
+        if not samples or len(samples) < min_samples:
+            return None
+
+        # Nearest-rank percentile
+        rank = max(math.ceil(percentile / 100 * len(samples)), 1)
+        return samples[rank - 1]
+
+
+operation_latencies = {}
+operation_latencies_lock = threading.Lock()
+
+
+def get_latency_window(operation: str):
+    with operation_latencies_lock:
+        if operation not in operation_latencies:
+            operation_latencies[operation] = LatencyWindow()
+        return operation_latencies[operation]
+
+
+def record_latency(operation: str, duration: float):
+    get_latency_window(operation).record(duration)
+
+
+def get_latency_percentile(
+    operation: str, percentile: float, min_samples: int = ALLEGRO_LATENCY_MIN_SAMPLES
+):
+    """Returns None as long as too few calls have been observed"""
+    return get_latency_window(operation).percentile(percentile, min_samples)
+
+
+def reset_latencies():
+    with operation_latencies_lock:
+        operation_latencies.clear()
@@ -0,0 +1,125 @@
+import threading
+import time
+
+from flask import g
+
+from app.config import (
+    KREFIA_REQUEST_BUDGET,
+    KREFIA_REQUEST_DEFAULT_DURATION,
+)
+from app.latency import get_latency_percentile, record_latency
+
+REQUEST_LATENCY_KEY = "request"
+
+
+def parse_request_start(value: str):
+    """Epoch seconds of a X-Request-Start header (t=<seconds>, seconds, milli- or microseconds)"""
+    if not value:
+        return None
+
+    try:
+        timestamp = float(value.strip().removeprefix("t="))
+    except ValueError:
+        return None
+
+    if timestamp > 1e14:
+        return timestamp / 1e6
+
+    if timestamp > 1e11:
+        return timestamp / 1e3
+
+    return timestamp
+
+
+def get_queue_wait(request_start: float, now: float):
+    if request_start is None:
+        return None
+
+    return max(now - request_start, 0)
+
+
+def get_expected_duration():
+    duration = get_latency_percentile(REQUEST_LATENCY_KEY, 50)
+    return KREFIA_REQUEST_DEFAULT_DURATION if duration is None else duration
+
+
+class LoadShedder:
+    def __init__(self, budget: float = KREFIA_REQUEST_BUDGET):
+        self.budget = budget
+        self.in_flight = 0
+        self.shed = 0
+        self.accepted = 0
+        self.lock = threading.Lock()
+
+    def should_shed(self, queue_wait: float):
+        """A request that already waited too long won't finish within its budget"""
+        if queue_wait is None:
+            return False
+
+        return queue_wait + get_expected_duration() > self.budget
+
+    def start(self, request_start: float = None, measure: bool = True):
+        """Returns False when the request has to be rejected.
+
+        With measure=False the duration of the request doesn't count towards the expected
+        duration, for requests that don't do the work (e.g. only queue it).
+        """
+        now = time.time()
+        queue_wait = get_queue_wait(request_start, now)
+
+        g.queue_wait = queue_wait
+        g.request_deadline = (request_start or now) + self.budget
+
+        with self.lock:
+            if self.should_shed(queue_wait):
+                self.shed += 1
+                return False
+
+            self.in_flight += 1
+            self.accepted += 1
+
+        g.request_started_at = time.monotonic()
+        g.request_measured = measure
+        return True
+
+    def finish(self):
+        started_at = g.pop("request_started_at", None)
+
+        if started_at is None:
+            return
+
+        if g.pop("request_measured", True):
+            record_latency(REQUEST_LATENCY_KEY, time.monotonic() - started_at)
+
+        with self.lock:
+            self.in_flight -= 1
+
+    def get_metrics(self):
+        with self.lock:
+            return {
+                "inFlight": self.in_flight,
+                "accepted": self.accepted,
+                "shed": self.shed,
+                "expectedDuration": get_expected_duration(),
+            }
+
+
+def get_request_deadline():
+    """Epoch seconds of the deadline of the current request, None outside of a request"""
+    return g.get("request_deadline") if g else None
+
+
+def set_request_deadline(deadline: float):
+    g.request_deadline = deadline
+
+
+def get_time_left(deadline: float = None):
+    if deadline is None:
+        return None
+
+    return deadline - time.time()
+
+
+def get_remaining_time():
+    """Seconds left until the deadline of the current request, None outside of a request"""
+    return get_time_left(get_request_deadline())
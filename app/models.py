@@ -0,0 +1,78 @@
+import logging
+from datetime import datetime
+from typing import Any, NamedTuple, Optional
+
+
+def get_field(source: Any, key: str):
+    """A field of a zeep object or (mocked) dict, None if it's missing"""
+    try:
+        return source[key]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def to_model(model: type, source: Any):
+    return model(*(get_field(source, field) for field in model._fields))
+
+
+class TRelatiecodeBedrijfcode(NamedTuple):
+    Relatiecode: int
+    Bedrijfscode: int
+    Bedrijfsnaam: Optional[str]
+
+
+class TSRVAanvraagHeader(NamedTuple):
+    RelatieCode: int
+    Volgnummer: int
+    IsNPS: bool
+    Status: Optional[str]
+    Statustekst: Optional[str]
+    Aanvraagdatum: Optional[datetime]
+    ExtraStatus: Optional[str]
+
+
+class TPLHeader(NamedTuple):
+    RelatieCode: int
+    Volgnummer: int
+    Startdatum: Optional[datetime]
+
+
+class TBBRHeader(NamedTuple):
+    RelatieCode: int
+    Volgnummer: int
+
+
+class TBBoxHeader(NamedTuple):
+    Code: int
+    Tijdstip: Optional[datetime]
+    IndicatieGelezen: Optional[bool]
+
+
+# The array element in the Result of the operation, per the schema there can be any number of them
+operation_models = {
+    "LoginService.BSNNaarRelatieMetBedrijf": (
+        "TRelatiecodeBedrijfcode",
+        TRelatiecodeBedrijfcode,
+    ),
+    "SchuldHulpService.GetSRVOverzicht": ("TSRVAanvraagHeader", TSRVAanvraagHeader),
+    "FinancieringService.GetPLOverzicht": ("TPLHeader", TPLHeader),
+    "BBRService.GetBBROverzicht": ("TBBRHeader", TBBRHeader),
+    "BerichtenBoxService.GetBerichten": ("TBBoxHeader", TBBoxHeader),
+}
+
+
+def get_models(operation: str, response_body: Any):
+    """Converts the Result of the operation to a list of models, once, so the zeep objects can be released"""
+    key, model = operation_models[operation]
+
+    try:
+        items = response_body["Result"][key] if response_body else None
+    except (KeyError, IndexError, TypeError) as error:
+        logging.error("Unexpected result for key: %s, error: %s", key, error)
+        return []
+
+    if not items:
+        return []
+
+    # zeep returns the array as a list, also when it has a single element (maxOccurs="unbounded")
+    return [to_model(model, item) for item in items]
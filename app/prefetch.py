@@ -0,0 +1,99 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from app.cache import hash_key
+from app.config import KREFIA_PREFETCH_CONCURRENCY, KREFIA_PREFETCH_MAX_PENDING
+
+PREFETCH_QUEUED = "queued"
+PREFETCH_DUPLICATE = "duplicate"
+PREFETCH_REJECTED = "rejected"
+PREFETCH_SKIPPED = "skipped"
+
+
+class Prefetcher:
+    """Loads the data of users in the background before they ask for it.
+
+    `prefetch(user_id)` fetches and caches the data of a user, `is_cached(user_id)` tells if that's
+    still needed. At most one prefetch per user is pending, users are tracked by the hash of their id.
+    """
+
+    def __init__(
+        self,
+        prefetch,
+        is_cached,
+        concurrency: int = KREFIA_PREFETCH_CONCURRENCY,
+        max_pending: int = KREFIA_PREFETCH_MAX_PENDING,
+    ):
+        self.prefetch = prefetch
+        self.is_cached = is_cached
+        self.max_pending = max_pending
+
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="krefia-prefetch"
+        )
+        self.stats = {
+            "queued": 0,
+            "duplicate": 0,
+            "rejected": 0,
+            "prefetched": 0,
+            "cached": 0,
+            "failed": 0,
+        }
+
+    def submit(self, user_id: str):
+        key = hash_key(user_id)
+
+        with self.lock:
+            if key in self.pending:
+                self.stats["duplicate"] += 1
+                return PREFETCH_DUPLICATE
+
+            # Prefetching is an optimisation, don't let a burst of logins pile up work
+            if len(self.pending) >= self.max_pending:
+                self.stats["rejected"] += 1
+                return PREFETCH_REJECTED
+
+            self.stats["queued"] += 1
+            self.pending[key] = self.executor.submit(self.prefetch_user, key, user_id)
+
+        return PREFETCH_QUEUED
+
+    def prefetch_user(self, key: str, user_id: str):
+        try:
+            if self.is_cached(user_id):
+                self.count("cached")
+            else:
+                self.prefetch(user_id)
+                self.count("prefetched")
+        except Exception as error:
+            self.count("failed")
+            logging.error(
+                "Could not prefetch user %s: %s %s", key[:8], type(error), error
+            )
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def count(self, name: str):
+        # Updated from the executor threads concurrently, submit() counts under the lock itself
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def wait_for(self, user_id: str, timeout: float):
+        """Waits (at most timeout seconds) for a pending prefetch of the user to finish"""
+        with self.lock:
+            future = self.pending.get(hash_key(user_id))
+
+        if future is None:
+            return False
+
+        done, _ = wait([future], timeout=timeout)
+
+        return bool(done)
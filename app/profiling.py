@@ -0,0 +1,155 @@
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from app.config import (
+    IS_PRODUCTION,
+    KREFIA_PROFILING,
+    KREFIA_PROFILING_DIR,
+    KREFIA_PROFILING_INTERVAL,
+    KREFIA_PROFILING_SAMPLE_RATE,
+)
+
+# Busy worker threads of these pools are sampled along with the request thread
+WORKER_THREAD_PREFIXES = ("krefia-section", "allegro-hedge")
+WORK_ITEM_FILE = os.path.join("concurrent", "futures", "thread.py")
+
+
+def should_profile(header_value: str = None):
+    if IS_PRODUCTION:
+        return False
+
+    if KREFIA_PROFILING or header_value in ("1", "true"):
+        return True
+
+    return random.random() < KREFIA_PROFILING_SAMPLE_RATE
+
+
+def format_frame(frame):
+    code = frame.f_code
+    filename = code.co_filename
+
+    # Shorten library paths, app paths relative to the working directory
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def get_stack(frame):
+    """Root first, and whether a pool thread is running a work item"""
+    stack = []
+    busy = False
+
+    while frame:
+        stack.append(format_frame(frame))
+        if frame.f_code.co_name == "run" and frame.f_code.co_filename.endswith(
+            WORK_ITEM_FILE
+        ):
+            busy = True
+        frame = frame.f_back
+
+    stack.reverse()
+
+    return stack, busy
+
+
+class SamplingProfiler:
+    """Samples the stacks of the request thread and busy worker threads, aggregated as folded stacks"""
+
+    def __init__(
+        self, thread_id: int = None, interval: float = KREFIA_PROFILING_INTERVAL
+    ):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.duration = 0
+        self.started_at = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.thread = threading.Thread(
+            target=self.run, name="krefia-profiler", daemon=True
+        )
+        self.thread.start()
+
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.duration = time.perf_counter() - self.started_at
+
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        for thread_id, frame in sys._current_frames().items():
+            name = thread_names.get(thread_id, "")
+
+            if thread_id == self.thread_id:
+                root = "request"
+            elif name.startswith(WORKER_THREAD_PREFIXES):
+                root = name.rsplit("_", 1)[0]
+            else:
+                continue
+
+            stack, busy = get_stack(frame)
+
+            if thread_id != self.thread_id and not busy:
+                continue
+
+            self.stacks[";".join([root] + stack)] += 1
+
+        self.samples += 1
+
+    def get_folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def get_summary(self, limit: int = 10):
+        """The frames the most samples were taken in (self time)"""
+        leaves = Counter()
+
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+
+        return leaves.most_common(limit)
+
+    def write(self, name: str, directory: str = None):
+        directory = directory or KREFIA_PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(directory, f"{timestamp}-{name}.folded")
+
+        with open(path, "w") as file:
+            file.write(self.get_folded())
+
+        return path
+
+    def log_summary(self, path: str):
+        lines = [
+            f"Profiled {self.duration * 1000:.0f}ms, {self.samples} samples, written to {path}"
+        ]
+
+        total = sum(self.stacks.values()) or 1
+        for frame, count in self.get_summary():
+            lines.append(f"{count / total * 100:5.1f}% {frame}")
+
+        logging.info("\n".join(lines))
@@ -0,0 +1,116 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Seconds to wait for the writer thread to make room for the stop sentinel
+STOP_TIMEOUT = 1
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to a bounded queue, records are dropped when the writer can't keep up"""
+
+    def __init__(self, maxsize: int, ensure_running=None):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self.ensure_running = ensure_running
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.ensure_running is not None:
+            self.ensure_running()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord):
+        # Only merge the message, the formatting (timestamps, paths, tracebacks) is done by the writer thread.
+        # Records only get here when their level is enabled, merging now keeps the message as it was at the
+        # time of the call when the arguments change afterwards.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+
+class FlushingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room in a full queue, so the records before the sentinel are still written
+        self.queue.put(self._sentinel, timeout=STOP_TIMEOUT)
+
+
+class QueuedLogging:
+    """Writes the records of the queue handler to the actual handler on a background thread"""
+
+    def __init__(self, handler: logging.Handler, maxsize: int):
+        self.handler = handler
+        self.queue_handler = DroppingQueueHandler(maxsize, self.ensure_running)
+        # Records the writer would skip aren't merged or queued at all
+        self.queue_handler.setLevel(handler.level)
+        self.listener = None
+        # The process the writer thread was started in
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.pid = os.getpid()
+        self.listener = FlushingQueueListener(
+            self.queue_handler.queue, self.handler, respect_handler_level=True
+        )
+        self.listener.start()
+
+    def ensure_running(self):
+        """Starts the writer thread in a forked worker on its first record.
+
+        uwsgi doesn't run the at-fork hooks unless configured to (py-call-osafterfork), the app is
+        imported in the master process and the writer thread doesn't exist in the workers.
+        """
+        if self.pid is None or self.pid == os.getpid():
+            return
+
+        # Only ever taken in a forked process, the master can't hold it while forking
+        with self.lock:
+            if self.pid != os.getpid():
+                self.restart_after_fork()
+
+    def stop(self):
+        if self.listener is None:
+            return
+
+        try:
+            self.listener.stop()
+        except queue.Full:
+            pass
+
+        self.listener = None
+
+    def restart_after_fork(self):
+        # The writer thread doesn't survive the fork, start a new one with a new queue in the worker
+        self.queue_handler.queue = queue.Queue(self.queue_handler.queue.maxsize)
+        self.start()
+
+    def get_metrics(self):
+        return {
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+        }
+
+
+def configure_logging(level: str, format: str, datefmt: str, maxsize: int):
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(format, datefmt))
+
+    queued_logging = QueuedLogging(stream_handler, maxsize)
+
+    logging.basicConfig(level=level, handlers=[queued_logging.queue_handler])
+
+    queued_logging.start()
+    os.register_at_fork(after_in_child=queued_logging.restart_after_fork)
+    atexit.register(queued_logging.stop)
+
+    return queued_logging
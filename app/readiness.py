@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from app.config import KREFIA_READINESS_INTERVAL, KREFIA_READINESS_MAX_AGE
+
+
+class ReadinessProbe:
+    """Tracks whether the worker can serve requests, without doing I/O when asked.
+
+    `warm_up()` builds what's needed to serve requests, `get_clients()` tells per client whether
+    it's built and `probe()` checks if the backend can be reached. The background thread calls
+    them every interval seconds, `get_status()` only reports the last results.
+    """
+
+    def __init__(
+        self,
+        probe,
+        warm_up,
+        get_clients,
+        interval: float = KREFIA_READINESS_INTERVAL,
+        max_age: float = KREFIA_READINESS_MAX_AGE,
+    ):
+        self.probe = probe
+        self.warm_up = warm_up
+        self.get_clients = get_clients
+        self.interval = interval
+        self.max_age = max_age
+
+        self.last_probe_at = None
+        self.last_success_at = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def check(self):
+        try:
+            self.warm_up()
+        except Exception as error:
+            logging.error("Warm up failed: %s %s", type(error), error)
+
+        try:
+            is_reachable = self.probe()
+        except Exception as error:
+            is_reachable = False
+            logging.error("Readiness probe failed: %s %s", type(error), error)
+
+        with self.lock:
+            self.last_probe_at = time.time()
+
+            if is_reachable:
+                self.last_success_at = self.last_probe_at
+
+    def get_status(self):
+        clients = self.get_clients()
+
+        with self.lock:
+            last_probe_at = self.last_probe_at
+            last_success_at = self.last_success_at
+
+        probe_age = None if last_success_at is None else time.time() - last_success_at
+
+        return {
+            "ready": all(clients.values())
+            and probe_age is not None
+            and probe_age <= self.max_age,
+            "clients": clients,
+            "lastProbeAt": last_probe_at,
+            "lastSuccessAt": last_success_at,
+            "probeAge": probe_age,
+        }
+
+    def run(self):
+        self.check()
+
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Starts the probe thread, call it from the worker process (not before the fork)"""
+        with self.lock:
+            if self.is_running():
+                return
+
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name="krefia-readiness", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
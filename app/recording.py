@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import re
+import uuid
+
+from zeep.helpers import serialize_object
+
+from app.config import ALLEGRO_RECORD_PATH
+
+# Keys of which the values are known not to contain personal data (amounts, dates, codes and statuses),
+# the values of all other keys are replaced by a placeholder of the same size
+SAFE_KEYS = {
+    "AantalKwartalen",
+    "AantalMaanden",
+    "Aanvraagdatum",
+    "Achterstand",
+    "BedragLaatsteBetaling",
+    "Bedrijfscode",
+    "Bedrijfsnaam",
+    "Betaald",
+    "BetaaldeBoeterente",
+    "BetaaldeKredietvergoeding",
+    "BetaaldeVertragingsrente",
+    "BrutoAfloscapaciteit",
+    "BrutoKredietsom",
+    "Code",
+    "DatumBerekening",
+    "DatumEersteAflossing",
+    "DatumLaatsteBetaling",
+    "EffectiefJaarpercentage",
+    "Einddatum",
+    "Eindstatus",
+    "ExtraInleg",
+    "ExtraStatus",
+    "IndicatieArchief",
+    "IndicatieBijlage",
+    "IndicatieGelezen",
+    "IndicatieOntvangen",
+    "IsNPS",
+    "KostenFinancieelBeheer",
+    "KostenSchuldhulpverlening",
+    "KostenVVA",
+    "Kredietvergoeding",
+    "KwartaalTermijn",
+    "LeningSoort",
+    "LoginType",
+    "MaandPercentage",
+    "MaandTermijn",
+    "NettoAfloscapaciteit",
+    "NettoKredietsom",
+    "OpenstaandeKredietvergoeding",
+    "OpenstaandeVertragingsrente",
+    "ProductNaam",
+    "Result",
+    "ResterendeLooptijd",
+    "SaldoLening",
+    "Startdatum",
+    "Status",
+    "TheoEinddatum",
+    "Tijdstip",
+    "TotaalAangemeldeSchuld",
+    "TotaalTeruggemeldeSchuld",
+    "Volgnummer",
+    "VolledigVervroegdeAflossing",
+    "Voorstand",
+    "VormCode",
+    "VormNaam",
+    "VTLB",
+    "WachtwoordWijzigen",
+}
+# Anything that looks like a BSN, wherever it occurs
+BSN_PATTERN = re.compile(r"\b\d{9}\b")
+
+
+def is_safe_key(key: str):
+    return key in SAFE_KEYS
+
+
+def scrub_value(value):
+    if isinstance(value, bool) or value is None:
+        return value
+
+    if isinstance(value, int):
+        return int("9" * len(str(abs(value))))
+
+    if isinstance(value, str):
+        return "x" * len(value)
+
+    return None
+
+
+def scrub(value, key: str = ""):
+    """Removes personal data, keeps the structure and size of the response.
+
+    Only the values of SAFE_KEYS are kept, new or unknown fields are scrubbed.
+    """
+    if isinstance(value, dict):
+        return {k: scrub(v, k) for k, v in value.items()}
+
+    if isinstance(value, list):
+        return [scrub(item, key) for item in value]
+
+    if not is_safe_key(key):
+        return scrub_value(value)
+
+    if isinstance(value, str):
+        return BSN_PATTERN.sub("000000000", value)
+
+    return value
+
+
+def record_response(operation: str, body, duration: float, path: str = None):
+    """Writes the scrubbed response body and duration of a call to the corpus"""
+    path = os.path.join(path or ALLEGRO_RECORD_PATH, operation)
+
+    try:
+        os.makedirs(path, exist_ok=True)
+
+        recording = {
+            "operation": operation,
+            "duration": duration,
+            "body": scrub(serialize_object(body, dict)),
+        }
+
+        with open(os.path.join(path, f"{uuid.uuid4().hex}.json"), "w") as file:
+            json.dump(recording, file, default=str)
+    except Exception as error:
+        logging.error("Could not record response of %s: %s", operation, error)
+
+
+def load_corpus(path: str = None):
+    """The recordings per operation"""
+    path = path or ALLEGRO_RECORD_PATH
+    corpus = {}
+
+    for operation in sorted(os.listdir(path)):
+        operation_path = os.path.join(path, operation)
+        recordings = []
+
+        for file_name in sorted(os.listdir(operation_path)):
+            with open(os.path.join(operation_path, file_name)) as file:
+                recordings.append(json.load(file))
+
+        if recordings:
+            corpus[operation] = recordings
+
+    return corpus
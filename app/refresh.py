@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.cache import hash_key
+from app.config import (
+    KREFIA_REFRESH_ACTIVE_WINDOW,
+    KREFIA_REFRESH_BEFORE_EXPIRY,
+    KREFIA_REFRESH_CONCURRENCY,
+    KREFIA_REFRESH_INTERVAL,
+    KREFIA_REFRESH_MAX_USERS,
+    KREFIA_REFRESH_PACING,
+)
+
+
+class RefreshScheduler:
+    """Keeps the cached data of recently active users warm.
+
+    `get_expires_at(user_id)` returns when the cached data of a user expires (None if not cached),
+    `refresh(user_id)` fetches and caches it again. Users are tracked by the hash of their id,
+    the id itself is only kept in memory to be able to refresh.
+    """
+
+    def __init__(
+        self,
+        refresh,
+        get_expires_at,
+        max_users: int = KREFIA_REFRESH_MAX_USERS,
+        active_window: int = KREFIA_REFRESH_ACTIVE_WINDOW,
+        refresh_before_expiry: int = KREFIA_REFRESH_BEFORE_EXPIRY,
+        interval: int = KREFIA_REFRESH_INTERVAL,
+        concurrency: int = KREFIA_REFRESH_CONCURRENCY,
+        pacing: float = KREFIA_REFRESH_PACING,
+    ):
+        self.refresh = refresh
+        self.get_expires_at = get_expires_at
+        self.max_users = max_users
+        self.active_window = active_window
+        self.refresh_before_expiry = refresh_before_expiry
+        self.interval = interval
+        self.pacing = pacing
+
+        self.users = OrderedDict()
+        self.in_progress = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="krefia-refresh"
+        )
+        self.stats = {"refreshed": 0, "failed": 0}
+
+    def touch(self, user_id: str):
+        key = hash_key(user_id)
+
+        with self.lock:
+            self.users[key] = (user_id, time.time())
+            self.users.move_to_end(key)
+
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+
+    def get_due(self):
+        """The (key, user_id) pairs of active users whose data expires soon"""
+        now = time.time()
+        due = []
+
+        with self.lock:
+            for key, (user_id, last_active) in list(self.users.items()):
+                if now - last_active > self.active_window:
+                    del self.users[key]
+
+            candidates = [
+                (key, user_id)
+                for key, (user_id, last_active) in self.users.items()
+                if key not in self.in_progress
+            ]
+
+        # Looking up the expiry can hit the disk (sqlite), don't block touch() meanwhile
+        for key, user_id in candidates:
+            expires_at = self.get_expires_at(user_id)
+
+            if expires_at and expires_at - now <= self.refresh_before_expiry:
+                due.append((key, user_id))
+
+        return due
+
+    def refresh_user(self, key: str, user_id: str):
+        try:
+            self.refresh(user_id)
+            self.count("refreshed")
+        except Exception as error:
+            self.count("failed")
+            logging.error(
+                "Could not refresh user %s: %s %s", key[:8], type(error), error
+            )
+        finally:
+            with self.lock:
+                self.in_progress.discard(key)
+
+    def count(self, name: str):
+        # Updated from the executor threads concurrently
+        with self.lock:
+            self.stats[name] += 1
+
+    def get_metrics(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def run_once(self):
+        futures = []
+
+        for key, user_id in self.get_due():
+            if self.stopped.is_set():
+                break
+
+            with self.lock:
+                self.in_progress.add(key)
+
+            futures.append(self.executor.submit(self.refresh_user, key, user_id))
+            self.stopped.wait(self.pacing)
+
+        return futures
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as error:
+                logging.error("Refresh run failed: %s %s", type(error), error)
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Starts the scheduler thread, call it from the worker process (not before the fork)"""
+        with self.lock:
+            if self.is_running():
+                return
+
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, name="krefia-refresh-scheduler", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+        if self.thread:
+            self.thread.join()
@@ -0,0 +1,95 @@
+import logging
+import random
+import time
+from typing import NamedTuple
+
+from requests import ConnectionError, Timeout
+from zeep.exceptions import TransportError
+
+from app.config import (
+    ALLEGRO_RETRY_ATTEMPTS,
+    ALLEGRO_RETRY_BASE_DELAY,
+    ALLEGRO_RETRY_MAX_DELAY,
+    ALLEGRO_TIMEOUT_FLOOR,
+)
+
+# Gateway errors, the request most likely never reached Allegro
+TRANSIENT_STATUS_CODES = [502, 503, 504]
+
+
+class RetryPolicy(NamedTuple):
+    attempts: int = ALLEGRO_RETRY_ATTEMPTS
+    base_delay: float = ALLEGRO_RETRY_BASE_DELAY
+    max_delay: float = ALLEGRO_RETRY_MAX_DELAY
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+# Only idempotent read operations are retried, the login operations create a session
+retry_policies = {
+    "LoginService.BSNNaarRelatieMetBedrijf": RetryPolicy(),
+    "SchuldHulpService.GetSRVOverzicht": RetryPolicy(),
+    "SchuldHulpService.GetSRVAanvraag": RetryPolicy(),
+    "FinancieringService.GetPLOverzicht": RetryPolicy(),
+    "FinancieringService.GetPL": RetryPolicy(),
+    "BBRService.GetBBROverzicht": RetryPolicy(),
+    "BerichtenBoxService.GetBerichten": RetryPolicy(),
+}
+
+
+def get_retry_policy(operation: str):
+    return retry_policies.get(operation, NO_RETRY)
+
+
+def is_transient_error(error: Exception):
+    """Transport errors are worth a retry, SOAP faults (and anything else) are not"""
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+
+    if isinstance(error, TransportError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+
+    return False
+
+
+def get_backoff_delay(policy: RetryPolicy, attempt: int):
+    """Exponential backoff with full jitter"""
+    return random.uniform(
+        0, min(policy.max_delay, policy.base_delay * 2 ** (attempt - 1))
+    )
+
+
+def call_with_retry(operation: str, fn, get_remaining_time=lambda: None):
+    """Calls fn, retries transient errors as long as the policy and the time budget allow it.
+
+    get_remaining_time returns the time the request has left, it's checked before every retry.
+    """
+    policy = get_retry_policy(operation)
+    attempt = 1
+
+    while True:
+        try:
+            return fn()
+        except Exception as error:
+            if attempt >= policy.attempts or not is_transient_error(error):
+                raise
+
+            delay = get_backoff_delay(policy, attempt)
+            remaining_time = get_remaining_time()
+
+            # Leave the time for another attempt with at least the minimum timeout, not just for the delay
+            if (
+                remaining_time is not None
+                and remaining_time < delay + ALLEGRO_TIMEOUT_FLOOR
+            ):
+                raise
+
+            logging.warning(
+                "Retrying %s in %.2fs after attempt %s: %s",
+                operation,
+                delay,
+                attempt,
+                type(error),
+            )
+            time.sleep(delay)
+            attempt += 1
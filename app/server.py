@@ -1,20 +1,44 @@
 import logging
+import math
 import os
 
 from azure.monitor.opentelemetry import configure_azure_monitor
-from flask import Flask
+from flask import Flask, Response, g, request, stream_with_context
 from opentelemetry import trace
 from opentelemetry.instrumentation.flask import FlaskInstrumentor
 from opentelemetry.trace import get_tracer_provider
 from requests.exceptions import HTTPError
+from werkzeug.exceptions import BadRequest
 
-from app import allegro_client, auth
+from app import allegro_client, auth, hedging
+from app.bulkhead import get_bulkhead_metrics
+from app.load_shedding import LoadShedder, parse_request_start
+from app.prefetch import PREFETCH_SKIPPED, Prefetcher
+from app.profiling import SamplingProfiler, should_profile
+from app.readiness import ReadinessProbe
+from app.refresh import RefreshScheduler
+from app.server_timing import get_server_timing, start_server_timing, timed
+from app.soap_calls import get_soap_call_log, start_soap_call_log
 from app.config import (
     IS_DEV,
+    KREFIA_CACHE_TTL,
+    KREFIA_LOAD_SHEDDING,
+    KREFIA_PREFETCH_WAIT,
+    KREFIA_PROFILE_TYPES,
+    KREFIA_PROFILING_HEADER,
+    KREFIA_REFRESH,
+    KREFIA_REQUEST_START_HEADER,
+    KREFIA_RETRY_AFTER,
+    KREFIA_SERVER_TIMING,
     UpdatedJSONProvider,
     get_application_insights_connection_string,
+    queued_logging,
+)
+from app.helpers import (
+    conditional_response_json,
+    error_response_json,
+    success_response_json,
 )
-from app.helpers import error_response_json, success_response_json
 
 # See also: https://medium.com/@tedisaacs/auto-instrumenting-python-fastapi-and-monitoring-with-azure-application-insights-768a59d2f4b9
 if get_application_insights_connection_string():
@@ -23,18 +47,230 @@ if get_application_insights_connection_string():
 tracer = trace.get_tracer(__name__, tracer_provider=get_tracer_provider())
 app = Flask(__name__)
 app.json = UpdatedJSONProvider(app)
+app.config["SERVER_TIMING"] = KREFIA_SERVER_TIMING
 
 FlaskInstrumentor.instrument_app(app)
 
 
+def refresh_user(bsn: str):
+    with app.app_context():
+        allegro_client.refresh_all_cached(bsn)
+
+
+refresh_scheduler = RefreshScheduler(refresh_user, allegro_client.get_all_expires_at)
+
+
+def is_cached(bsn: str):
+    return allegro_client.get_all_expires_at(bsn) is not None
+
+
+prefetcher = Prefetcher(refresh_user, is_cached)
+
+
+readiness_probe = ReadinessProbe(
+    lambda: allegro_client.probe_allegro("LoginService"),
+    allegro_client.warm_up_clients,
+    allegro_client.get_client_status,
+)
+
+
+def is_refresh_enabled():
+    return KREFIA_REFRESH and KREFIA_CACHE_TTL > 0
+
+
+@app.before_request
+def start_refresh_scheduler():
+    # Threads don't survive the uwsgi fork, start the scheduler in the worker itself
+    if is_refresh_enabled() and not refresh_scheduler.is_running():
+        refresh_scheduler.start()
+
+
+load_shedder = LoadShedder()
+
+
+@app.before_request
+def shed_load():
+    if not KREFIA_LOAD_SHEDDING or not request.path.startswith("/krefia/"):
+        return None
+
+    request_start = parse_request_start(
+        request.headers.get(KREFIA_REQUEST_START_HEADER)
+    )
+
+    # Prefetch only queues the work, its quick 202 would drag the expected duration of /krefia/all down
+    if not load_shedder.start(request_start, measure=request.path == "/krefia/all"):
+        response = error_response_json("Server overloaded", 503)
+        response.headers["Retry-After"] = str(KREFIA_RETRY_AFTER)
+        return response
+
+    return None
+
+
+@app.teardown_request
+def finish_request(error=None):
+    load_shedder.finish()
+
+
+@app.before_request
+def start_request_timing():
+    if request.path != "/krefia/all":
+        return
+
+    start_soap_call_log()
+
+    if app.config["SERVER_TIMING"]:
+        start_server_timing()
+
+
+@app.after_request
+def add_server_timing(response):
+    # Streamed responses only include the phases before the first chunk
+    server_timing = get_server_timing()
+
+    if server_timing is not None:
+        response.headers["Server-Timing"] = server_timing.get_header()
+
+    return response
+
+
+@app.teardown_request
+def log_soap_calls(error=None):
+    soap_call_log = get_soap_call_log()
+
+    if soap_call_log is not None and logging.root.isEnabledFor(logging.INFO):
+        logging.info(
+            "%s Allegro calls in %.0fms: %s",
+            soap_call_log.count(),
+            soap_call_log.get_duration() * 1000,
+            dict(soap_call_log.get_counts()),
+        )
+
+
+@app.before_request
+def start_profiling():
+    if request.path == "/krefia/all" and should_profile(
+        request.headers.get(KREFIA_PROFILING_HEADER)
+    ):
+        g.profiler = SamplingProfiler().start()
+
+
+@app.teardown_request
+def stop_profiling(error=None):
+    profiler = g.pop("profiler", None)
+
+    if profiler:
+        profiler.stop()
+        profiler.log_summary(profiler.write("krefia-all"))
+
+
+def get_selection():
+    """The sections requested with ?sections=notificationTriggers,deepLinks.lening, None for all"""
+    sections = request.args.get("sections")
+
+    # Trailing or double commas (?sections=a, or ?sections=a,,b) leave empty names, skip them
+    selection = sorted(set(name for name in (sections or "").split(",") if name))
+
+    if not selection:
+        return None
+
+    for selector in selection:
+        if selector not in allegro_client.section_selectors:
+            raise BadRequest(f"Unknown section {selector}")
+
+    return selection
+
+
+def is_stream_requested():
+    return (
+        request.args.get("stream") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
+
+
+def stream_all(bsn: str, selection: list = None):
+    """NDJSON, a record per section as soon as it's loaded and the complete content at the end"""
+
+    def to_line(record: dict):
+        return app.json.dumps(record, separators=(",", ":")) + "\n"
+
+    def generate():
+        section_values = {}
+
+        try:
+            if bsn is not None:
+                for name, value in allegro_client.iter_sections(
+                    bsn, selection, allegro_client.section_executor
+                ):
+                    section_values[name] = value
+                    yield to_line(
+                        {
+                            "section": allegro_client.section_paths[name],
+                            "content": value,
+                        }
+                    )
+        except Exception as error:
+            logging.exception(error)
+            yield to_line({"status": "ERROR", "message": "Server error occurred"})
+            return
+
+        yield to_line(
+            {
+                "status": "OK",
+                "content": allegro_client.create_all_response(
+                    section_values, selection
+                ),
+            }
+        )
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @app.route("/krefia/all", methods=["GET"])
 @auth.login_required
 def get_all():
     with tracer.start_as_current_span("/all"):
         user = auth.get_current_user()
-        content = allegro_client.get_all(user["id"])
 
-        return success_response_json(content)
+        # E.g. eHerkenning profiles (KvK number) can never have Krefia data
+        is_krefia_profile = user["type"] in KREFIA_PROFILE_TYPES
+
+        if is_stream_requested():
+            return stream_all(
+                user["id"] if is_krefia_profile else None, get_selection()
+            )
+
+        if not is_krefia_profile:
+            return conditional_response_json(None)
+
+        selection = get_selection()
+
+        # The data is being prefetched right now, wait for it to end up in the cache
+        if KREFIA_CACHE_TTL and selection is None:
+            prefetcher.wait_for(user["id"], KREFIA_PREFETCH_WAIT)
+
+        content, etag = allegro_client.get_all_cached(user["id"], selection)
+
+        if is_refresh_enabled():
+            refresh_scheduler.touch(user["id"])
+
+        with timed("json"):
+            return conditional_response_json(content, etag)
+
+
+@app.route("/krefia/prefetch", methods=["POST"])
+@auth.login_required
+def prefetch():
+    """Starts loading the data of a user that just logged in, the response doesn't wait for it"""
+    user = auth.get_current_user()
+    status = PREFETCH_SKIPPED
+
+    if KREFIA_CACHE_TTL and user["type"] in KREFIA_PROFILE_TYPES:
+        status = prefetcher.submit(user["id"])
+
+        if is_refresh_enabled():
+            refresh_scheduler.touch(user["id"])
+
+    return success_response_json({"prefetch": status}, 202)
 
 
 @app.route("/")
@@ -49,6 +285,35 @@ def health_check():
     )
 
 
+@app.route("/status/ready")
+def readiness_check():
+    """Ready once the Allegro clients are built and Allegro responded recently, health only means the app runs"""
+    # Started by the first readiness check, the probe thread doesn't survive the uwsgi fork
+    if not readiness_probe.is_running():
+        readiness_probe.start()
+
+    status = readiness_probe.get_status()
+
+    if not status["ready"]:
+        return error_response_json("Not ready", 503, status)
+
+    return success_response_json(status)
+
+
+@app.route("/status/metrics")
+def metrics():
+    return success_response_json(
+        {
+            "bulkheads": get_bulkhead_metrics(),
+            "hedging": hedging.get_hedge_metrics(),
+            "loadShedding": load_shedder.get_metrics(),
+            "prefetch": prefetcher.get_metrics(),
+            "logging": queued_logging.get_metrics(),
+            "refresh": refresh_scheduler.get_metrics(),
+        }
+    )
+
+
 @app.errorhandler(Exception)
 def handle_error(error):
     error_message_original = f"{type(error)}:{str(error)}"
@@ -71,6 +336,10 @@ def handle_error(error):
         )
     elif auth.is_auth_exception(error):
         return error_response_json(msg_auth_exception, 401)
+    elif isinstance(error, allegro_client.AllegroUnavailable):
+        response = error_response_json("Allegro unavailable", 503)
+        response.headers["Retry-After"] = str(math.ceil(error.retry_after) or 1)
+        return response
 
     return error_response_json(
         msg_server_error,
@@ -0,0 +1,62 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+
+
+class ServerTiming:
+    """Durations of the phases of a request, phases that run more than once are summed"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, duration: float):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0) + duration
+
+    def get_header(self):
+        metrics = [
+            f"{name};dur={duration * 1000:.1f}"
+            for name, duration in self.durations.items()
+        ]
+        metrics.append(
+            f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}"
+        )
+
+        return ", ".join(metrics)
+
+
+def start_server_timing():
+    g.server_timing = ServerTiming()
+
+
+def get_server_timing():
+    if not has_app_context():
+        return None
+
+    return g.get("server_timing")
+
+
+def set_server_timing(server_timing: ServerTiming):
+    """Shares the timing of a request with the thread doing part of its work"""
+    if server_timing is not None:
+        g.server_timing = server_timing
+
+
+@contextmanager
+def timed(name: str):
+    server_timing = get_server_timing()
+
+    if server_timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        server_timing.add(name, time.perf_counter() - start)
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from flask import g, has_app_context
+
+
+class SoapCall(NamedTuple):
+    operation: str
+    # Seconds since the start of the request
+    offset: float
+    duration: float
+
+
+class SoapCallLog:
+    """The Allegro operations called while handling a request"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def add(self, operation: str, started_at: float, duration: float):
+        with self.lock:
+            self.calls.append(
+                SoapCall(operation, started_at - self.started_at, duration)
+            )
+
+    def count(self, operation: str = None):
+        if operation is None:
+            return len(self.calls)
+
+        return sum(1 for call in self.calls if call.operation == operation)
+
+    def get_counts(self):
+        return Counter(call.operation for call in self.calls)
+
+    def get_duration(self):
+        return sum(call.duration for call in self.calls)
+
+
+def start_soap_call_log():
+    g.soap_call_log = SoapCallLog()
+    return g.soap_call_log
+
+
+def get_soap_call_log():
+    if not has_app_context():
+        return None
+
+    return g.get("soap_call_log")
+
+
+def set_soap_call_log(soap_call_log: SoapCallLog):
+    """Shares the call log of a request with the thread doing part of its work"""
+    if soap_call_log is not None:
+        g.soap_call_log = soap_call_log
+
+
+def record_soap_call(operation: str, started_at: float):
+    soap_call_log = get_soap_call_log()
+
+    if soap_call_log is not None:
+        soap_call_log.add(operation, started_at, time.perf_counter() - started_at)
+
+
+def get_soap_call_failure_scopes():
+    if not has_app_context():
+        return []
+
+    return g.get("soap_call_failure_scopes", [])
+
+
+def set_soap_call_failure_scopes(scopes: list):
+    """Shares the failure scopes of a request with the thread doing part of its work"""
+    if scopes:
+        g.soap_call_failure_scopes = scopes
+
+
+@contextmanager
+def track_soap_call_failures():
+    """Collects the operations that failed within the block, results they affected shouldn't be cached"""
+    scopes = get_soap_call_failure_scopes()
+    failures = []
+    g.soap_call_failure_scopes = scopes + [failures]
+
+    try:
+        yield failures
+    finally:
+        g.soap_call_failure_scopes = scopes
+
+
+def record_soap_call_failure(operation: str):
+    for failures in get_soap_call_failure_scopes():
+        failures.append(operation)
@@ -1,8 +1,14 @@
 import datetime
 import pprint
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase, mock
-from flask import Flask
+from flask import Flask, g
 from freezegun import freeze_time
+from requests import ConnectionError
+from zeep.wsdl.utils import etree_to_string
+
 from app import config
 
 config.KREFIA_SSO_KREDIETBANK = "https://localhost/kredietbank/sso-login"
@@ -10,14 +16,24 @@ config.KREFIA_SSO_FIBU = "https://localhost/fibu/sso-login"
 config.ALLEGRO_SOAP_ENDPOINT = "https://localhost/SOAP"
 
 from app.allegro_client import (
+    AllegroUnavailable,
+    allegro_client_failures,
     bedrijf,
+    bedrijf_code,
     call_service_method,
+    create_client,
     get_all,
+    get_all_cached,
     get_budgetbeheer,
+    get_client,
+    get_client_element,
+    get_client_status,
+    get_envelope_template,
     get_lening,
     get_leningen,
     get_notification,
     get_relatiecode_bedrijf,
+    get_relaties,
     get_result,
     get_schuldhulp_aanvraag,
     get_schuldhulp_aanvragen,
@@ -28,10 +44,27 @@ from app.allegro_client import (
     login_allowed,
     login_tijdelijk,
     notification_urls,
+    probe_allegro,
+    refresh_all_cached,
+    render_envelope,
+    run_in_app_context,
     set_session_id,
+    warm_up_clients,
 )
+from app.cache import MemoryCache
+from app.latency import reset_latencies
+from app.load_shedding import get_remaining_time
+from app.timeouts import AdaptiveTimeoutTransport
+from app.models import TPLHeader, TSRVAanvraagHeader, to_model
 from app.helpers import dotdict
-from app.fixtures.mocks import mock_client, mock_clients
+from app.fixtures.mocks import (
+    MockClient,
+    count_soap_calls,
+    fixture_client,
+    fixture_http_response,
+    mock_client,
+    mock_clients,
+)
 
 pp = pprint.PrettyPrinter(indent=4)
 
@@ -61,6 +94,93 @@ class ClientTests(FlaskTestCase):
             self.assertEqual(get_service("service1"), "Foo")
             self.assertEqual(get_service("service2"), "Bar")
 
+    @mock.patch("app.allegro_client.allegro_client", {})
+    @mock.patch("app.allegro_client.Client")
+    def test_get_client_single_flight(self, client_mock):
+        def create(**kwargs):
+            time.sleep(0.05)
+            return "client"
+
+        client_mock.side_effect = create
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            clients = list(executor.map(get_client, ["service1"] * 5))
+
+        self.assertEqual(clients, ["client"] * 5)
+        client_mock.assert_called_once()
+
+    @mock.patch("app.allegro_client.Client")
+    def test_create_client_shared_transport(self, client_mock):
+        create_client("service1")
+        create_client("service2")
+        transports = [call.kwargs["transport"] for call in client_mock.call_args_list]
+        self.assertIsNot(transports[0], transports[1])
+
+        client_mock.reset_mock()
+
+        with mock.patch("app.allegro_client.ALLEGRO_SHARED_TRANSPORT", True):
+            create_client("service1")
+            create_client("service2")
+
+        transports = [call.kwargs["transport"] for call in client_mock.call_args_list]
+        self.assertIs(transports[0], transports[1])
+        # The documents aren't kept, every client parses its own schema
+        self.assertIsNone(transports[0].cache)
+
+    @mock.patch("app.allegro_client.logging")
+    @mock.patch.dict("app.allegro_client.allegro_client_failures", clear=True)
+    @mock.patch("app.allegro_client.allegro_client", {})
+    @mock.patch("app.allegro_client.probe_allegro")
+    @mock.patch("app.allegro_client.Client")
+    def test_get_client_backoff(self, client_mock, probe_mock, logging_mock):
+        client_mock.side_effect = [ConnectionError("Offline"), "client"]
+        probe_mock.side_effect = [False, True]
+
+        self.assertIsNone(get_client("service1"))
+
+        # Fails fast while backing off
+        with self.assertRaises(AllegroUnavailable) as context:
+            get_client("service1")
+        self.assertAlmostEqual(context.exception.retry_after, 1, places=1)
+        self.assertEqual(client_mock.call_count, 1)
+        probe_mock.assert_not_called()
+
+        # The probe fails, the delay doubles without trying to build the client
+        allegro_client_failures["service1"] = (1, 0)
+        self.assertIsNone(get_client("service1"))
+        self.assertEqual(allegro_client_failures["service1"][0], 2)
+        with self.assertRaises(AllegroUnavailable) as context:
+            get_client("service1")
+        self.assertAlmostEqual(context.exception.retry_after, 2, places=1)
+        self.assertEqual(client_mock.call_count, 1)
+
+        allegro_client_failures["service1"] = (2, 0)
+        self.assertEqual(get_client("service1"), "client")
+        self.assertEqual(client_mock.call_count, 2)
+        self.assertEqual(allegro_client_failures, {})
+
+    @mock.patch("app.allegro_client.logging")
+    @mock.patch("app.allegro_client.requests.head")
+    def test_probe_allegro(self, head_mock, logging_mock):
+        self.assertTrue(probe_allegro("service1"))
+        head_mock.assert_called_with(
+            "https://localhost/SOAP?service=service1", timeout=3
+        )
+
+        head_mock.side_effect = ConnectionError("Offline")
+        self.assertFalse(probe_allegro("service1"))
+
+    @mock.patch("app.allegro_client.allegro_services", ["service1", "service2"])
+    @mock.patch("app.allegro_client.allegro_client", {"service1": "client"})
+    @mock.patch("app.allegro_client.get_client")
+    def test_warm_up_clients(self, get_client_mock):
+        get_client_mock.side_effect = [None, AllegroUnavailable("service2", 1)]
+
+        warm_up_clients()
+
+        self.assertEqual(get_client_mock.call_count, 2)
+        self.assertEqual(get_client_status(), {"service1": True, "service2": False})
+
     @mock.patch(
         "app.allegro_client.allegro_client",
         mock_client("FakeService", ["fake_method"]),
@@ -116,6 +236,135 @@ class ClientTests(FlaskTestCase):
         logging_mock.error.assert_called_with("service3b.method2, no service.")
         self.assertIsNone(content)
 
+    @mock.patch("app.allegro_client.ALLEGRO_HEDGING", True)
+    @mock.patch("app.allegro_client.call_hedged")
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client("BBRService", ["GetBBROverzicht"]),
+    )
+    def test_call_service_method_hedged(self, call_hedged_mock):
+        call_hedged_mock.side_effect = lambda operation, send: send()
+
+        with self.app.test_request_context():
+            content = call_service_method("BBRService.GetBBROverzicht", "123")
+
+        self.assertEqual(call_hedged_mock.call_args[0][0], "BBRService.GetBBROverzicht")
+        self.assertIn("Result", content)
+
+    @mock.patch("app.allegro_client.ALLEGRO_BULKHEAD", True)
+    @mock.patch("app.allegro_client.limit_concurrency")
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client("BBRService", ["GetBBROverzicht"]),
+    )
+    def test_call_service_method_latency(self, limit_concurrency_mock):
+        def wait_for_slot(service_name, fn):
+            def limited():
+                time.sleep(0.2)
+                return fn()
+
+            return limited
+
+        limit_concurrency_mock.side_effect = wait_for_slot
+
+        with mock.patch("app.hedging.record_latency") as record_latency_mock:
+            with self.app.test_request_context():
+                call_service_method("BBRService.GetBBROverzicht", "123")
+
+        # The wait for the bulkhead slot is not part of the latency of the operation
+        operation, latency = record_latency_mock.call_args[0]
+        self.assertEqual(operation, "BBRService.GetBBROverzicht")
+        self.assertLess(latency, 0.1)
+
+    @mock.patch("app.allegro_client.ALLEGRO_ADAPTIVE_TIMEOUTS", True)
+    @mock.patch("app.allegro_client.ALLEGRO_BULKHEAD", True)
+    @mock.patch("app.allegro_client.limit_concurrency")
+    @mock.patch("app.allegro_client.logging")
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client("BBRService", ["GetBBROverzicht"]),
+    )
+    def test_call_service_method_deadline_exceeded(
+        self, logging_mock, limit_concurrency_mock
+    ):
+        with self.app.test_request_context():
+            g.request_deadline = time.time() - 1
+            content = call_service_method("BBRService.GetBBROverzicht", "123")
+
+        # Fails without taking a bulkhead slot
+        self.assertIsNone(content)
+        limit_concurrency_mock.return_value.assert_not_called()
+
+    get_pl_flaky = mock.Mock(
+        side_effect=[ConnectionError("Connection reset by peer"), {"body": "foo"}]
+    )
+
+    @mock.patch("app.retry.time.sleep")
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client("FinancieringService", [("GetPL", get_pl_flaky)]),
+    )
+    def test_call_service_method_retry(self, sleep_mock):
+        with self.app.test_request_context():
+            content = call_service_method("FinancieringService.GetPL", "123")
+
+        self.assertEqual(content, "foo")
+        self.assertEqual(self.get_pl_flaky.call_count, 2)
+
+    @mock.patch("app.allegro_client.ALLEGRO_ADAPTIVE_TIMEOUTS", True)
+    @mock.patch("app.allegro_client.ALLEGRO_HEDGING", False)
+    @mock.patch("app.allegro_client.logging")
+    @mock.patch("app.retry.logging")
+    @mock.patch("app.retry.get_backoff_delay", mock.Mock(return_value=0.1))
+    @mock.patch("app.retry.ALLEGRO_TIMEOUT_FLOOR", 2)
+    def test_call_service_method_deadline(self, *logging_mocks):
+        reset_latencies()
+        client = MockClient("FinancieringService", [])
+        client.transport = AdaptiveTimeoutTransport(operation_timeout=60)
+        attempts = []
+
+        with freeze_time("2026-01-01 12:00:00") as frozen_time:
+
+            def get_pl(*args, **kwargs):
+                attempts.append(
+                    (
+                        round(g.request_deadline - time.time(), 2),
+                        round(client.transport.operation_timeout, 2),
+                    )
+                )
+                frozen_time.tick(1)
+                raise ConnectionError("Connection reset by peer")
+
+            client.service.GetPL = get_pl
+
+            with mock.patch(
+                "app.retry.time.sleep", side_effect=frozen_time.tick
+            ), mock.patch(
+                "app.allegro_client.allegro_client", {"FinancieringService": client}
+            ), self.app.test_request_context():
+                g.request_deadline = time.time() + 4.5
+                content = call_service_method("FinancieringService.GetPL", "123")
+
+        self.assertIsNone(content)
+        # Every attempt times out within the time the request has left, the 4th doesn't fit
+        self.assertEqual(attempts, [(4.5, 4.5), (3.4, 3.4), (2.3, 2.3)])
+
+    def test_run_in_app_context(self):
+        with self.app.test_request_context():
+            g.request_deadline = time.time() + 5
+            set_session_id("__test-session-id__")
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                session_id, remaining_time = executor.submit(
+                    run_in_app_context(lambda: (get_session_id(), get_remaining_time()))
+                ).result()
+
+            set_session_id(None)
+
+        # The deadline of the request caps the calls of the section threads too
+        self.assertEqual(session_id, "__test-session-id__")
+        self.assertAlmostEqual(remaining_time, 5, delta=1)
+
     @mock.patch(
         "app.allegro_client.allegro_client",
         mock_client("LoginService", ["AllegroWebLoginTijdelijk"]),
@@ -139,6 +388,55 @@ class ClientTests(FlaskTestCase):
 
         self.assertEqual(content, content_expected)
 
+    @mock.patch("app.allegro_client.KREFIA_RELATIECODE_CACHE_TTL", 60)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch("app.allegro_client.get_relatiecode_bedrijf")
+    def test_get_relaties_cached(self, get_relatiecode_bedrijf_mock):
+        get_relatiecode_bedrijf_mock.return_value = {"FIBU": 321321}
+
+        self.assertEqual(get_relaties("123"), {"FIBU": 321321})
+        self.assertEqual(get_relaties("123"), {"FIBU": 321321})
+        self.assertEqual(get_relatiecode_bedrijf_mock.call_count, 1)
+
+        get_relatiecode_bedrijf_mock.return_value = {}
+
+        self.assertEqual(get_relaties("456"), {})
+        self.assertEqual(get_relaties("456"), {})
+        self.assertEqual(get_relatiecode_bedrijf_mock.call_count, 3)
+
+    @mock.patch("app.allegro_client.KREFIA_NEGATIVE_CACHE_TTL", 60)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch("app.allegro_client.get_relatiecode_bedrijf")
+    def test_get_relaties_negative_cache(self, get_relatiecode_bedrijf_mock):
+        get_relatiecode_bedrijf_mock.return_value = None
+
+        self.assertIsNone(get_relaties("123"))
+        self.assertIsNone(get_relaties("123"))
+        self.assertEqual(get_relatiecode_bedrijf_mock.call_count, 2)
+
+        get_relatiecode_bedrijf_mock.return_value = {}
+
+        self.assertEqual(get_relaties("123"), {})
+        self.assertEqual(get_relaties("123"), {})
+        self.assertEqual(get_relatiecode_bedrijf_mock.call_count, 3)
+
+        get_relatiecode_bedrijf_mock.return_value = {"FIBU": 321321}
+
+        # Positive results are not cached without KREFIA_RELATIECODE_CACHE_TTL
+        self.assertEqual(get_relaties("456"), {"FIBU": 321321})
+        self.assertEqual(get_relaties("456"), {"FIBU": 321321})
+        self.assertEqual(get_relatiecode_bedrijf_mock.call_count, 5)
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client(
+            "LoginService", [("BSNNaarRelatieMetBedrijf", lambda *a, **k: None)]
+        ),
+    )
+    def test_get_relatiecode_bedrijf_failed(self):
+        with self.app.test_request_context():
+            self.assertIsNone(get_relatiecode_bedrijf("123"))
+
     @mock.patch(
         "app.allegro_client.allegro_client",
         mock_client("LoginService", ["AllegroWebMagAanmelden"]),
@@ -274,11 +572,13 @@ class SchuldHulpTests(FlaskTestCase):
     )
     def test_get_schuldhulp_aanvraag(self):
         with self.app.test_request_context():
-            content = get_schuldhulp_aanvraag(self.srv_header)
+            content = get_schuldhulp_aanvraag(
+                to_model(TSRVAanvraagHeader, self.srv_header)
+            )
 
         tsrv_header = self.srv_aanvraag_result.call_args[0][0]
-        self.assertTrue("Volgnummer" in tsrv_header.__dict__)
-        self.assertEqual(tsrv_header.Volgnummer, 2)
+        self.assertEqual(tsrv_header["Volgnummer"], 2)
+        self.assertEqual(tsrv_header["ExtraStatus"], "")
 
         self.assertEqual(
             content,
@@ -298,11 +598,13 @@ class SchuldHulpTests(FlaskTestCase):
     )
     def test_get_schuldhulp_aanvraag_exclude_opdrachtgever(self):
         with self.app.test_request_context():
-            content = get_schuldhulp_aanvraag(self.srv_header)
+            content = get_schuldhulp_aanvraag(
+                to_model(TSRVAanvraagHeader, self.srv_header)
+            )
 
         tsrv_header = self.srv_aanvraag_result2.call_args[0][0]
-        self.assertTrue("Volgnummer" in tsrv_header.__dict__)
-        self.assertEqual(tsrv_header.Volgnummer, 2)
+        self.assertEqual(tsrv_header["Volgnummer"], 2)
+        self.assertEqual(tsrv_header["ExtraStatus"], "")
 
         self.assertEqual(
             content,
@@ -330,8 +632,8 @@ class SchuldHulpTests(FlaskTestCase):
         self.assertEqual(self.srv_aanvraag_result.call_count, 1)
 
         tsrv_header = self.srv_aanvraag_result.call_args[0][0]
-        self.assertTrue("Volgnummer" in tsrv_header.__dict__)
-        self.assertEqual(tsrv_header.Volgnummer, 2)
+        self.assertEqual(tsrv_header["Volgnummer"], 2)
+        self.assertEqual(tsrv_header["ExtraStatus"], "")
 
         self.assertEqual(
             content,
@@ -344,6 +646,10 @@ class SchuldHulpTests(FlaskTestCase):
         )
 
 
+class ResponseBody(dict):
+    """A response body that can be weakly referenced"""
+
+
 class LeningBudgetbeheerTests(FlaskTestCase):
     pl_overzicht_result = mock.Mock(
         return_value={"body": {"Result": {"TPLHeader": [{"ID": 99}, {"ID": 88}]}}}
@@ -354,7 +660,7 @@ class LeningBudgetbeheerTests(FlaskTestCase):
         mock_client("FinancieringService", ["GetPL"]),
     )
     def test_get_lening(self):
-        tpl_header = {}
+        tpl_header = TPLHeader(RelatieCode=321321, Volgnummer=1, Startdatum=None)
         with self.app.test_request_context():
             content = get_lening(tpl_header)
 
@@ -391,6 +697,35 @@ class LeningBudgetbeheerTests(FlaskTestCase):
         ]
         self.assertEqual(content, content_expected)
 
+    def test_get_leningen_released(self):
+        response_bodies = []
+        requests = []
+
+        def get_pl_overzicht(*args, **kwargs):
+            response_body = ResponseBody(
+                Result={"TPLHeader": [{"RelatieCode": 1, "Volgnummer": 2, "Foo": 3}]}
+            )
+            response_bodies.append(weakref.ref(response_body))
+            return {"body": response_body}
+
+        def get_pl(tpl_header, **kwargs):
+            # The overview isn't referenced anymore during the detail calls
+            requests.append((tpl_header, response_bodies[0]()))
+            return {"body": {"Result": None}}
+
+        with mock.patch(
+            "app.allegro_client.allegro_client",
+            mock_client(
+                "FinancieringService",
+                [("GetPLOverzicht", get_pl_overzicht), ("GetPL", get_pl)],
+            ),
+        ), self.app.test_request_context():
+            get_leningen("__777__888__")
+
+        self.assertEqual(
+            requests, [({"RelatieCode": 1, "Volgnummer": 2, "Startdatum": None}, None)]
+        )
+
     @mock.patch(
         "app.allegro_client.allegro_client",
         mock_client("BBRService", ["GetBBROverzicht"]),
@@ -613,3 +948,450 @@ class ClientTests2(FlaskTestCase):
         expected_content = None
 
         self.assertEqual(content, expected_content)
+
+    login_tijdelijk_mock = mock.Mock(
+        side_effect=MockClient(
+            "LoginService", ["AllegroWebLoginTijdelijk"]
+        ).service.AllegroWebLoginTijdelijk
+    )
+
+    @mock.patch("app.allegro_client.KREFIA_NEGATIVE_CACHE_TTL", 60)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_client(
+            "LoginService",
+            [
+                ("AllegroWebLoginTijdelijk", login_tijdelijk_mock),
+                ("BSNNaarRelatieMetBedrijf", mock_content),
+            ],
+        ),
+    )
+    def test_get_all_no_relaties_cached(self):
+        bsn = "_1_2_3_4_5_6_"
+
+        with self.app.test_request_context():
+            self.assertIsNone(get_all(bsn))
+
+        with self.app.test_request_context():
+            self.assertIsNone(get_all(bsn))
+
+        self.assertEqual(self.login_tijdelijk_mock.call_count, 1)
+
+
+class EnvelopeTemplateTests(FlaskTestCase):
+    client = fixture_client("LoginService")
+
+    def test_get_client_element(self):
+        element = get_client_element(self.client, "ns0:ROClientIDHeader")
+        self.assertIs(element, get_client_element(self.client, "ns0:ROClientIDHeader"))
+
+    def test_render_envelope(self):
+        template, http_headers = get_envelope_template(
+            self.client, "BSNNaarRelatieMetBedrijf", 1, True
+        )
+        self.assertEqual(
+            http_headers["SOAPAction"], '"urn:LoginService-BSNNaarRelatieMetBedrijf"'
+        )
+
+        message = render_envelope(template, "{session<1>}", ("123&456",))
+        self.assertIn(b"<ns0:ID>{session&lt;1&gt;}</ns0:ID>", message)
+        self.assertIn(b"<ns0:aBSN>123&amp;456</ns0:aBSN>", message)
+
+        self.assertEqual(
+            render_envelope(template, None, (datetime.date(2020, 1, 2),)).count(
+                b"2020-01-02"
+            ),
+            1,
+        )
+
+    def test_templated_envelope_matches_zeep(self):
+        header = get_client_element(self.client, "ns0:ROClientIDHeader")
+        envelope = self.client.create_message(
+            self.client.service,
+            "BSNNaarRelatieMetBedrijf",
+            "123",
+            _soapheaders=[header(ID="abc")],
+        )
+        template, http_headers = get_envelope_template(
+            self.client, "BSNNaarRelatieMetBedrijf", 1, True
+        )
+
+        self.assertEqual(
+            render_envelope(template, "abc", ("123",)),
+            etree_to_string(envelope),
+        )
+
+    @mock.patch("app.allegro_client.ALLEGRO_TEMPLATED_ENVELOPES", True)
+    def test_call_service_method_templated(self):
+        with mock.patch(
+            "app.allegro_client.allegro_client", {"LoginService": self.client}
+        ), mock.patch.object(
+            self.client.transport,
+            "post",
+            return_value=fixture_http_response(
+                "LoginService", "BSNNaarRelatieMetBedrijf"
+            ),
+        ) as post_mock, self.app.test_request_context():
+            set_session_id("abc")
+            relatiecodes = get_relatiecode_bedrijf("123")
+
+        self.assertEqual(relatiecodes, {"FIBU": 321321, "KREDIETBANK": 123123})
+
+        address, message, http_headers = post_mock.call_args[0]
+        self.assertEqual(address, "https://localhost/SOAP?service=LoginService")
+        self.assertIn(b"<ns0:ID>abc</ns0:ID>", message)
+        self.assertIn(b"<ns0:aBSN>123</ns0:aBSN>", message)
+
+
+class SectionCacheTests(FlaskTestCase):
+    all_clients = mock_clients(
+        [
+            (
+                "LoginService",
+                [
+                    "AllegroWebMagAanmelden",
+                    "BSNNaarRelatieMetBedrijf",
+                    "AllegroWebLoginTijdelijk",
+                ],
+            ),
+            ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+            ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+            ("BBRService", ["GetBBROverzicht"]),
+            ("BerichtenBoxService", ["GetBerichten"]),
+        ]
+    )
+
+    def get_all_operations(self, bsn: str):
+        with mock.patch(
+            "app.allegro_client.call_service_method", wraps=call_service_method
+        ) as call_service_method_mock, self.app.test_request_context():
+            content = get_all(bsn)
+
+        operations = [call.args[0] for call in call_service_method_mock.call_args_list]
+        return content, operations
+
+    @freeze_time("2021-11-03")
+    @mock.patch("app.allegro_client.allegro_client", all_clients)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch("app.allegro_client.KREFIA_RELATIECODE_CACHE_TTL", 600)
+    @mock.patch(
+        "app.allegro_client.KREFIA_SECTION_CACHE_TTL",
+        {
+            "budgetbeheer": 600,
+            "schuldhulp": 600,
+            "lening": 600,
+            "fibuNotification": 0,
+            "kredietbankNotification": 60,
+        },
+    )
+    def test_section_cache(self):
+        content, operations = self.get_all_operations("123")
+        self.assertIn("FinancieringService.GetPL", operations)
+
+        content_cached, operations = self.get_all_operations("123")
+        self.assertEqual(content_cached, content)
+        self.assertEqual(
+            operations,
+            [
+                "LoginService.AllegroWebLoginTijdelijk",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+            ],
+        )
+
+        # The KREDIETBANK notification expires, the deeplinks are still cached
+        with freeze_time("2021-11-03 00:02:00"):
+            content_cached, operations = self.get_all_operations("123")
+
+        self.assertEqual(content_cached, content)
+        self.assertEqual(
+            operations,
+            [
+                "LoginService.AllegroWebLoginTijdelijk",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+            ],
+        )
+
+    @mock.patch("app.allegro_client.allegro_client", all_clients)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch("app.allegro_client.KREFIA_RELATIECODE_CACHE_TTL", 600)
+    @mock.patch(
+        "app.allegro_client.KREFIA_SECTION_CACHE_TTL",
+        {
+            "budgetbeheer": 600,
+            "schuldhulp": 600,
+            "lening": 600,
+            "fibuNotification": 600,
+            "kredietbankNotification": 600,
+        },
+    )
+    def test_all_sections_cached(self):
+        content, operations = self.get_all_operations("123")
+        self.assertEqual(len(operations), 11)
+
+        content_cached, operations = self.get_all_operations("123")
+        self.assertEqual(content_cached, content)
+        self.assertEqual(operations, [])
+
+    @freeze_time("2021-11-03")
+    @mock.patch("app.allegro_client.allegro_client", all_clients)
+    def test_get_all_selection(self):
+        with mock.patch(
+            "app.allegro_client.call_service_method", wraps=call_service_method
+        ) as call_service_method_mock, self.app.test_request_context():
+            content = get_all("123", ["notificationTriggers"])
+
+        operations = [call.args[0] for call in call_service_method_mock.call_args_list]
+
+        self.assertEqual(
+            content,
+            {
+                "notificationTriggers": {
+                    "fibu": {
+                        "datePublished": "2021-11-03",
+                        "url": config.KREFIA_SSO_FIBU,
+                    },
+                    "krediet": {
+                        "datePublished": "2021-11-03",
+                        "url": config.KREFIA_SSO_KREDIETBANK,
+                    },
+                },
+            },
+        )
+        self.assertEqual(
+            operations,
+            [
+                "LoginService.AllegroWebLoginTijdelijk",
+                "LoginService.BSNNaarRelatieMetBedrijf",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+            ],
+        )
+
+        with self.app.test_request_context():
+            content = get_all("123", ["deepLinks.budgetbeheer", "deepLinks.lening"])
+
+        self.assertEqual(
+            content,
+            {
+                "deepLinks": {
+                    "budgetbeheer": {
+                        "title": "Lopend",
+                        "url": config.KREFIA_SSO_FIBU,
+                    },
+                    "lening": {
+                        "title": "U hebt € 1.600,- geleend. Hierop moet u iedere maand € 46,92 aflossen.",
+                        "url": config.KREFIA_SSO_KREDIETBANK,
+                    },
+                },
+            },
+        )
+
+
+def mock_relaties(*bedrijfscodes):
+    def response(*args, **kwargs):
+        return {
+            "body": {
+                "Result": {
+                    "TRelatiecodeBedrijfcode": [
+                        {"Relatiecode": f"{code}{code}", "Bedrijfscode": code}
+                        for code in bedrijfscodes
+                    ]
+                }
+            }
+        }
+
+    return response
+
+
+all_clients = [
+    ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+    ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+    ("BBRService", ["GetBBROverzicht"]),
+    ("BerichtenBoxService", ["GetBerichten"]),
+]
+
+
+def mock_login_clients(relaties):
+    return mock_clients(
+        [
+            (
+                "LoginService",
+                [
+                    "AllegroWebLoginTijdelijk",
+                    "AllegroWebMagAanmelden",
+                    ("BSNNaarRelatieMetBedrijf", relaties),
+                ],
+            )
+        ]
+        + all_clients
+    )
+
+
+class SoapCallBudgetTests(FlaskTestCase):
+    """The maximum number of Allegro calls get_all may make per kind of user"""
+
+    def get_all_calls(self):
+        with self.app.test_request_context():
+            with count_soap_calls() as soap_call_log:
+                get_all("_1_2_3_4_5_6_")
+
+        # One session for all sections
+        self.assertLessEqual(
+            soap_call_log.count("LoginService.AllegroWebLoginTijdelijk"), 1
+        )
+
+        return soap_call_log
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_login_clients(mock_relaties(bedrijf_code.FIBU)),
+    )
+    def test_fibu(self):
+        soap_call_log = self.get_all_calls()
+        self.assertLessEqual(soap_call_log.count(), 5)
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_login_clients(mock_relaties(bedrijf_code.KREDIETBANK)),
+    )
+    def test_kredietbank(self):
+        soap_call_log = self.get_all_calls()
+        self.assertLessEqual(soap_call_log.count(), 8)
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_login_clients(mock_relaties(bedrijf_code.FIBU, bedrijf_code.KREDIETBANK)),
+    )
+    def test_fibu_kredietbank(self):
+        soap_call_log = self.get_all_calls()
+        self.assertLessEqual(soap_call_log.count(), 11)
+        # One login per relatie
+        self.assertLessEqual(
+            soap_call_log.count("LoginService.AllegroWebMagAanmelden"), 2
+        )
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_login_clients(mock_relaties()),
+    )
+    def test_no_relaties(self):
+        soap_call_log = self.get_all_calls()
+        self.assertLessEqual(soap_call_log.count(), 2)
+        self.assertEqual(soap_call_log.count("LoginService.AllegroWebMagAanmelden"), 0)
+
+
+def soap_fault(*args, **kwargs):
+    raise Exception("Server was unable to process request")
+
+
+def mock_failing_clients(*failing_operations):
+    """All clients with the fixtures, the given (service_name, method_name) operations fail"""
+    return mock_clients(
+        [
+            (
+                service_name,
+                [
+                    (
+                        (method_name, soap_fault)
+                        if (service_name, method_name) in failing_operations
+                        else method_name
+                    )
+                    for method_name in method_names
+                ],
+            )
+            for service_name, method_names in [
+                (
+                    "LoginService",
+                    [
+                        "AllegroWebLoginTijdelijk",
+                        "AllegroWebMagAanmelden",
+                        "BSNNaarRelatieMetBedrijf",
+                    ],
+                )
+            ]
+            + all_clients
+        ]
+    )
+
+
+@freeze_time("2021-11-03")
+@mock.patch("app.allegro_client.logging")
+class FailedCallCacheTests(FlaskTestCase):
+    """Data that is incomplete because an Allegro call failed is not cached"""
+
+    @mock.patch("app.allegro_client.KREFIA_CACHE_TTL", 60)
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    def test_get_all_cached(self, logging_mock):
+        failing_clients = mock_failing_clients(("BerichtenBoxService", "GetBerichten"))
+
+        with mock.patch(
+            "app.allegro_client.allegro_client", failing_clients
+        ), self.app.test_request_context():
+            content, etag = get_all_cached("123")
+            self.assertIsNone(content["notificationTriggers"])
+
+            with count_soap_calls() as soap_call_log:
+                get_all_cached("123")
+            self.assertEqual(soap_call_log.count("BerichtenBoxService.GetBerichten"), 2)
+
+        with mock.patch(
+            "app.allegro_client.allegro_client", mock_failing_clients()
+        ), self.app.test_request_context():
+            content, etag = get_all_cached("123")
+            self.assertIsNotNone(content["notificationTriggers"])
+
+        # A refresh that fails keeps the cached data
+        with mock.patch(
+            "app.allegro_client.allegro_client", failing_clients
+        ), self.app.test_request_context():
+            content_refreshed, etag_refreshed = refresh_all_cached("123")
+            self.assertNotEqual(etag_refreshed, etag)
+            self.assertEqual(get_all_cached("123"), (content, etag))
+
+    @mock.patch("app.allegro_client.krefia_cache", MemoryCache())
+    @mock.patch(
+        "app.allegro_client.KREFIA_SECTION_CACHE_TTL",
+        dict.fromkeys(
+            [
+                "budgetbeheer",
+                "schuldhulp",
+                "lening",
+                "fibuNotification",
+                "kredietbankNotification",
+            ],
+            600,
+        ),
+    )
+    def test_section_cache(self, logging_mock):
+        failing_clients = mock_failing_clients(
+            ("BerichtenBoxService", "GetBerichten"), ("BBRService", "GetBBROverzicht")
+        )
+
+        def get_operations():
+            with mock.patch(
+                "app.allegro_client.allegro_client", failing_clients
+            ), self.app.test_request_context(), count_soap_calls() as soap_call_log:
+                get_all("123")
+
+            return set(soap_call_log.get_counts())
+
+        self.assertIn("FinancieringService.GetPL", get_operations())
+
+        # Only the sections of which a call failed are loaded again
+        self.assertEqual(
+            get_operations(),
+            {
+                "LoginService.AllegroWebLoginTijdelijk",
+                "LoginService.BSNNaarRelatieMetBedrijf",
+                "LoginService.AllegroWebMagAanmelden",
+                "BerichtenBoxService.GetBerichten",
+                "BBRService.GetBBROverzicht",
+            },
+        )
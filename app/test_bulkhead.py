@@ -0,0 +1,143 @@
+import threading
+from unittest import TestCase, mock
+
+from requests import Timeout
+from zeep.exceptions import Fault
+
+from app.bulkhead import (
+    Bulkhead,
+    BulkheadRejected,
+    get_bulkhead_metrics,
+    limit_concurrency,
+)
+from app.timeouts import DeadlineExceeded
+
+
+class BulkheadTests(TestCase):
+    def test_limit(self):
+        bulkhead = Bulkhead("test", 2, max_queue=0)
+
+        bulkhead.acquire()
+        bulkhead.acquire()
+
+        with self.assertRaises(BulkheadRejected):
+            bulkhead.acquire()
+
+        self.assertEqual(bulkhead.get_metrics()["rejected"], 1)
+        self.assertEqual(bulkhead.get_metrics()["inFlight"], 2)
+
+        bulkhead.release()
+        bulkhead.acquire()
+
+    def test_queue_timeout(self):
+        bulkhead = Bulkhead("test", 1, max_queue=1, queue_timeout=0.01)
+        bulkhead.acquire()
+
+        with self.assertRaises(BulkheadRejected):
+            bulkhead.acquire()
+
+        metrics = bulkhead.get_metrics()
+        self.assertEqual(metrics["timedOut"], 1)
+        self.assertEqual(metrics["queueDepth"], 0)
+
+    def test_queue(self):
+        bulkhead = Bulkhead("test", 1, max_queue=1, queue_timeout=5)
+        bulkhead.acquire()
+
+        acquired = threading.Event()
+
+        def waiter():
+            bulkhead.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+
+        self.assertFalse(acquired.wait(0.05))
+        self.assertEqual(bulkhead.get_metrics()["queueDepth"], 1)
+
+        bulkhead.release()
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+
+        self.assertEqual(bulkhead.get_metrics()["inFlight"], 1)
+
+    def test_adaptive(self):
+        bulkhead = Bulkhead("test", 8, adaptive=True, latency_target=1)
+
+        bulkhead.acquire()
+        bulkhead.release(duration=2)
+        self.assertEqual(bulkhead.get_metrics()["limit"], 4)
+
+        bulkhead.acquire()
+        bulkhead.release(failed=True)
+        self.assertEqual(bulkhead.get_metrics()["limit"], 2)
+
+        for _ in range(50):
+            bulkhead.acquire()
+            bulkhead.release(duration=0.1)
+
+        self.assertEqual(bulkhead.get_metrics()["limit"], 8)
+
+        for _ in range(10):
+            bulkhead.acquire()
+            bulkhead.release(duration=2)
+
+        self.assertEqual(bulkhead.get_metrics()["limit"], 1)
+
+    def test_slot(self):
+        bulkhead = Bulkhead("test", 1)
+
+        with self.assertRaises(ValueError):
+            with bulkhead.slot():
+                self.assertEqual(bulkhead.get_metrics()["inFlight"], 1)
+                raise ValueError()
+
+        self.assertEqual(bulkhead.get_metrics()["inFlight"], 0)
+
+    def test_slot_adaptive(self):
+        bulkhead = Bulkhead("test", 8, adaptive=True, latency_target=1)
+
+        # Business errors and calls that didn't reach Allegro don't lower the limit
+        for error in [
+            Fault("Relatie onbekend"),
+            BulkheadRejected("global"),
+            DeadlineExceeded("Service.op"),
+        ]:
+            with self.assertRaises(type(error)):
+                with bulkhead.slot():
+                    raise error
+
+        self.assertEqual(bulkhead.get_metrics()["limit"], 8)
+
+        with self.assertRaises(Timeout):
+            with bulkhead.slot():
+                raise Timeout()
+
+        self.assertEqual(bulkhead.get_metrics()["limit"], 4)
+
+    @mock.patch("app.bulkhead.global_bulkhead", Bulkhead("global", 1, max_queue=0))
+    def test_limit_concurrency(self):
+        def fn(value):
+            metrics = get_bulkhead_metrics()
+            self.assertEqual(metrics["global"]["inFlight"], 1)
+            self.assertEqual(metrics["services"]["TestService"]["inFlight"], 1)
+            return value
+
+        self.assertEqual(limit_concurrency("TestService", fn)("foo"), "foo")
+        self.assertEqual(get_bulkhead_metrics()["global"]["inFlight"], 0)
+
+    @mock.patch(
+        "app.bulkhead.global_bulkhead", Bulkhead("global", 0, max_queue=0, min_limit=0)
+    )
+    @mock.patch(
+        "app.bulkhead.service_bulkheads",
+        {"TestService": Bulkhead("TestService", 8, adaptive=True)},
+    )
+    def test_limit_concurrency_rejected(self):
+        with self.assertRaises(BulkheadRejected):
+            limit_concurrency("TestService", lambda: None)()
+
+        metrics = get_bulkhead_metrics()
+        self.assertEqual(metrics["services"]["TestService"]["inFlight"], 0)
+        self.assertEqual(metrics["services"]["TestService"]["limit"], 8)
@@ -0,0 +1,154 @@
+import os
+import sqlite3
+import stat
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from app.cache import (
+    MemoryCache,
+    SQLiteCache,
+    create_cache,
+    deserialize,
+    hash_key,
+    serialize,
+)
+
+
+class MemoryCacheTests(TestCase):
+    def test_hash_key(self):
+        self.assertEqual(hash_key("all", "123"), hash_key("all", "123"))
+        self.assertNotEqual(hash_key("all", "123"), hash_key("all", "124"))
+        self.assertNotIn("123", hash_key("all", "123"))
+
+        # Without the secret the key of a BSN can't be computed
+        with mock.patch("app.cache.KREFIA_CACHE_KEY_SECRET", "other"):
+            key = hash_key("all", "123")
+        self.assertNotEqual(key, hash_key("all", "123"))
+
+    def test_get_set(self):
+        cache = MemoryCache()
+        self.assertIsNone(cache.get("foo"))
+        self.assertEqual(cache.get("foo", "default"), "default")
+
+        cache.set("foo", {"bar": None}, 10)
+        self.assertEqual(cache.get("foo"), {"bar": None})
+
+        value, expires_at = cache.get_entry("foo")
+        self.assertAlmostEqual(expires_at, time.time() + 10, delta=1)
+
+        cache.delete("foo")
+        self.assertIsNone(cache.get("foo"))
+
+        cache.set("foo", 1, 10)
+        cache.clear()
+        self.assertIsNone(cache.get("foo"))
+
+    def test_expiry(self):
+        cache = MemoryCache()
+        cache.set("foo", "bar", 10)
+
+        with mock.patch("app.cache.time.time", return_value=time.time() + 11):
+            self.assertIsNone(cache.get("foo"))
+
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_max_entries(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set("a", 1, 10)
+        cache.set("b", 2, 10)
+        cache.get("a")
+        cache.set("c", 3, 10)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_serialize(self):
+        value = {"deepLinks": {"lening": {"title": "€ 1.600,-"}}, "foo": None}
+        self.assertEqual(deserialize(serialize(value)), value)
+
+    def test_get_set(self):
+        cache = SQLiteCache(self.path)
+        self.assertIsNone(cache.get("foo"))
+
+        cache.set("foo", {"FIBU": 123}, 10)
+        self.assertEqual(cache.get("foo"), {"FIBU": 123})
+
+        value, expires_at = cache.get_entry("foo")
+        self.assertAlmostEqual(expires_at, time.time() + 10, delta=1)
+
+        cache.delete("foo")
+        self.assertIsNone(cache.get("foo"))
+
+        cache.set("foo", 1, 10)
+        cache.clear()
+        self.assertIsNone(cache.get("foo"))
+
+    def test_shared(self):
+        cache = SQLiteCache(self.path)
+        cache.set("foo", "bar", 10)
+
+        # E.g. a respawned worker
+        self.assertEqual(SQLiteCache(self.path).get("foo"), "bar")
+
+    def test_expiry(self):
+        cache = SQLiteCache(self.path)
+        cache.set("foo", "bar", 10)
+
+        with mock.patch("app.cache.time.time", return_value=time.time() + 11):
+            self.assertIsNone(cache.get("foo"))
+
+    def test_prune(self):
+        cache = SQLiteCache(self.path, max_entries=2)
+        cache.set("expired", 0, -1)
+        cache.set("a", 1, 10)
+        cache.set("b", 2, 20)
+        cache.set("c", 3, 30)
+        cache.prune()
+
+        rows = cache.connection().execute("SELECT key FROM cache").fetchall()
+        self.assertEqual(sorted(row[0] for row in rows), ["b", "c"])
+
+    def test_read_error(self):
+        cache = SQLiteCache(self.path)
+        cache.connection().execute("DROP TABLE cache")
+
+        self.assertIsNone(cache.get("foo"))
+        cache.set("foo", "bar", 10)
+        cache.prune()
+        cache.delete("foo")
+        cache.clear()
+
+    def test_prune_error(self):
+        cache = SQLiteCache(self.path)
+        cache.PRUNE_EVERY = 1
+        connection = mock.Mock()
+        connection.execute.side_effect = [
+            None,
+            sqlite3.OperationalError("database is locked"),
+        ]
+
+        with mock.patch.object(cache, "connection", return_value=connection):
+            cache.set("foo", "bar", 10)
+
+        self.assertEqual(connection.execute.call_count, 2)
+
+    def test_permissions(self):
+        SQLiteCache(self.path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_create_cache(self):
+        self.assertIsInstance(create_cache("memory"), MemoryCache)
+
+        with mock.patch("app.cache.KREFIA_CACHE_PATH", self.path):
+            self.assertIsInstance(create_cache("sqlite"), SQLiteCache)
@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from requests.exceptions import Timeout
+
+from app import hedging
+from app.hedging import (
+    HedgeBudget,
+    call_hedged,
+    count_hedge_stat,
+    get_hedge_delay,
+    get_hedge_metrics,
+    timed_call,
+)
+from app.latency import get_latency_window, record_latency, reset_latencies
+
+
+class HedgeBudgetTests(TestCase):
+    def test_budget(self):
+        budget = HedgeBudget(ratio=0.5, max_tokens=1)
+        self.assertFalse(budget.acquire())
+
+        budget.add_call()
+        self.assertFalse(budget.acquire())
+
+        budget.add_call()
+        self.assertTrue(budget.acquire())
+        self.assertFalse(budget.acquire())
+
+        for _ in range(10):
+            budget.add_call()
+
+        self.assertTrue(budget.acquire())
+        self.assertFalse(budget.acquire())
+
+    def test_count_hedge_stat(self):
+        calls = get_hedge_metrics()["calls"]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for _ in range(800):
+                executor.submit(count_hedge_stat, "calls")
+
+        self.assertEqual(get_hedge_metrics()["calls"], calls + 800)
+
+
+class HedgingTests(TestCase):
+    def setUp(self):
+        budget_patcher = mock.patch("app.hedging.hedge_budget", HedgeBudget(ratio=1))
+        budget_patcher.start()
+        self.addCleanup(budget_patcher.stop)
+
+    def tearDown(self):
+        reset_latencies()
+
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_DEFAULT_DELAY", 3)
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_MIN_DELAY", 0.5)
+    def test_get_hedge_delay(self):
+        self.assertEqual(get_hedge_delay("Service.op"), 3)
+
+        for _ in range(20):
+            record_latency("Service.op", 1)
+
+        self.assertEqual(get_hedge_delay("Service.op"), 1)
+
+        for _ in range(200):
+            record_latency("Service.op", 0.01)
+
+        self.assertEqual(get_hedge_delay("Service.op"), 0.5)
+
+    def test_timed_call(self):
+        timed_call("Service.op", mock.Mock(return_value="result"))
+
+        with self.assertRaises(Timeout):
+            timed_call("Service.op", mock.Mock(side_effect=Timeout()))
+
+        with self.assertRaises(ValueError):
+            timed_call("Service.op", mock.Mock(side_effect=ValueError()))
+
+        self.assertEqual(len(get_latency_window("Service.op")), 2)
+
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_DEFAULT_DELAY", 0.01)
+    def test_fast_call(self):
+        fn = mock.Mock(return_value="result")
+        self.assertEqual(call_hedged("Service.fast", fn), "result")
+        self.assertEqual(fn.call_count, 1)
+
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_DEFAULT_DELAY", 0.01)
+    def test_hedge_wins(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.2)
+                return "slow"
+            return "fast"
+
+        hedge_won = get_hedge_metrics()["hedge_won"]
+
+        self.assertEqual(call_hedged("Service.slow", fn), "fast")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(get_hedge_metrics()["hedge_won"], hedge_won + 1)
+
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_DEFAULT_DELAY", 0.01)
+    def test_hedge_failure(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            if len(calls) == 1:
+                time.sleep(0.1)
+                return "slow"
+            raise ConnectionError("reset")
+
+        self.assertEqual(call_hedged("Service.failing", fn), "slow")
+
+        def fn_error():
+            time.sleep(0.05)
+            raise ConnectionError("reset")
+
+        with self.assertRaises(ConnectionError):
+            call_hedged("Service.failing", fn_error)
+
+    @mock.patch("app.hedging.ALLEGRO_HEDGE_DEFAULT_DELAY", 0.01)
+    def test_budget_exhausted(self):
+        hedging.hedge_budget.ratio = 0
+        fn = mock.Mock(side_effect=lambda: time.sleep(0.05) or "result")
+        self.assertEqual(call_hedged("Service.slow", fn), "result")
+        self.assertEqual(fn.call_count, 1)
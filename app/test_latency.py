@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from app.latency import (
+    LatencyWindow,
+    get_latency_percentile,
+    record_latency,
+    reset_latencies,
+)
+
+
+class LatencyTests(TestCase):
+    def tearDown(self):
+        reset_latencies()
+
+    def test_percentile(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(95))
+
+        for duration in range(1, 101):
+            window.record(duration / 100)
+
+        self.assertEqual(len(window), 100)
+        self.assertEqual(window.percentile(95), 0.95)
+        self.assertEqual(window.percentile(50), 0.5)
+        self.assertEqual(window.percentile(0), 0.01)
+
+    def test_window_size(self):
+        window = LatencyWindow(size=10)
+
+        for duration in range(1, 21):
+            window.record(duration)
+
+        self.assertEqual(len(window), 10)
+        self.assertEqual(window.percentile(0), 11)
+
+    def test_min_samples(self):
+        record_latency("Service.op", 1.0)
+        self.assertIsNone(get_latency_percentile("Service.op", 95, min_samples=2))
+
+        record_latency("Service.op", 2.0)
+        self.assertEqual(get_latency_percentile("Service.op", 95, min_samples=2), 2.0)
@@ -0,0 +1,95 @@
+import time
+from unittest import TestCase, mock
+
+from flask import Flask, g
+
+from app.latency import get_latency_window, record_latency, reset_latencies
+from app.load_shedding import (
+    REQUEST_LATENCY_KEY,
+    LoadShedder,
+    get_expected_duration,
+    get_queue_wait,
+    get_remaining_time,
+    get_time_left,
+    parse_request_start,
+)
+
+
+class LoadSheddingTests(TestCase):
+    app = Flask(__name__)
+
+    def tearDown(self):
+        reset_latencies()
+
+    def test_parse_request_start(self):
+        self.assertEqual(parse_request_start("t=1600000000.5"), 1600000000.5)
+        self.assertEqual(parse_request_start("1600000000"), 1600000000)
+        self.assertEqual(parse_request_start("1600000000500"), 1600000000.5)
+        self.assertEqual(parse_request_start("1600000000500000"), 1600000000.5)
+        self.assertIsNone(parse_request_start("foo"))
+        self.assertIsNone(parse_request_start(None))
+
+    def test_get_queue_wait(self):
+        self.assertEqual(get_queue_wait(100, 103), 3)
+        self.assertEqual(get_queue_wait(103, 100), 0)
+        self.assertIsNone(get_queue_wait(None, 100))
+
+    @mock.patch("app.load_shedding.KREFIA_REQUEST_DEFAULT_DURATION", 3)
+    def test_get_expected_duration(self):
+        self.assertEqual(get_expected_duration(), 3)
+
+        for _ in range(20):
+            record_latency(REQUEST_LATENCY_KEY, 1)
+
+        self.assertEqual(get_expected_duration(), 1)
+
+    @mock.patch("app.load_shedding.KREFIA_REQUEST_DEFAULT_DURATION", 2)
+    def test_shed(self):
+        shedder = LoadShedder(budget=10)
+
+        with self.app.app_context():
+            self.assertTrue(shedder.start(time.time() - 5))
+            self.assertAlmostEqual(g.queue_wait, 5, delta=1)
+            self.assertAlmostEqual(get_remaining_time(), 5, delta=1)
+            self.assertEqual(shedder.get_metrics()["inFlight"], 1)
+            shedder.finish()
+
+        with self.app.app_context():
+            self.assertFalse(shedder.start(time.time() - 9))
+            shedder.finish()
+
+        with self.app.app_context():
+            self.assertTrue(shedder.start(None))
+            self.assertAlmostEqual(get_remaining_time(), 10, delta=1)
+            shedder.finish()
+
+        metrics = shedder.get_metrics()
+        self.assertEqual(metrics["inFlight"], 0)
+        self.assertEqual(metrics["accepted"], 2)
+        self.assertEqual(metrics["shed"], 1)
+
+    def test_measure(self):
+        shedder = LoadShedder(budget=10)
+        reset_latencies()
+
+        with self.app.app_context():
+            self.assertTrue(shedder.start(None, measure=False))
+            shedder.finish()
+
+        self.assertEqual(len(get_latency_window(REQUEST_LATENCY_KEY)), 0)
+        self.assertEqual(shedder.get_metrics()["inFlight"], 0)
+
+        with self.app.app_context():
+            self.assertTrue(shedder.start(None))
+            shedder.finish()
+
+        self.assertEqual(len(get_latency_window(REQUEST_LATENCY_KEY)), 1)
+
+    def test_get_remaining_time(self):
+        self.assertIsNone(get_remaining_time())
+
+        with self.app.app_context():
+            self.assertIsNone(get_remaining_time())
+
+        self.assertIsNone(get_time_left(None))
+        self.assertAlmostEqual(get_time_left(time.time() + 3), 3, delta=1)
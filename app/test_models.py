@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from app.fixtures.mocks import fixture_client, fixture_http_response
+from app.models import (
+    TBBRHeader,
+    TRelatiecodeBedrijfcode,
+    TSRVAanvraagHeader,
+    get_models,
+    to_model,
+)
+
+
+class ModelsTests(TestCase):
+    def test_to_model(self):
+        header = to_model(TBBRHeader, {"RelatieCode": 1, "Volgnummer": 3, "Team": ""})
+        self.assertEqual(header, TBBRHeader(RelatieCode=1, Volgnummer=3))
+
+        header = to_model(TSRVAanvraagHeader, {"RelatieCode": 1})
+        self.assertEqual(header.RelatieCode, 1)
+        self.assertIsNone(header.Status)
+
+    def test_get_models(self):
+        operation = "BBRService.GetBBROverzicht"
+        header = {"RelatieCode": 1, "Volgnummer": 3}
+
+        self.assertEqual(
+            get_models(operation, {"Result": {"TBBRHeader": [header]}}),
+            [TBBRHeader(1, 3)],
+        )
+        self.assertEqual(
+            get_models(operation, {"Result": {"TBBRHeader": [header, header]}}),
+            [TBBRHeader(1, 3), TBBRHeader(1, 3)],
+        )
+        self.assertEqual(get_models(operation, {"Result": None}), [])
+        self.assertEqual(get_models(operation, None), [])
+
+        with self.assertLogs(level="ERROR"):
+            self.assertEqual(get_models(operation, {"Foo": None}), [])
+
+    def test_get_models_zeep(self):
+        client = fixture_client("LoginService")
+        binding = client.service._binding
+        response_body = binding.process_reply(
+            client,
+            binding.get("BSNNaarRelatieMetBedrijf"),
+            fixture_http_response("LoginService", "BSNNaarRelatieMetBedrijf"),
+        )["body"]
+
+        self.assertEqual(
+            get_models("LoginService.BSNNaarRelatieMetBedrijf", response_body),
+            [
+                TRelatiecodeBedrijfcode(123123, 2, "Kredietbank, Gemeente Amsterdam"),
+                TRelatiecodeBedrijfcode(321321, 10, "FiBu, Gemeente Amsterdam"),
+            ],
+        )
@@ -0,0 +1,80 @@
+import threading
+from concurrent.futures import wait
+from unittest import TestCase, mock
+
+from app.cache import hash_key
+from app.prefetch import (
+    PREFETCH_DUPLICATE,
+    PREFETCH_QUEUED,
+    PREFETCH_REJECTED,
+    Prefetcher,
+)
+
+
+class PrefetcherTests(TestCase):
+    def create_prefetcher(self, cached=False, **kwargs):
+        self.release = threading.Event()
+        self.prefetch = mock.Mock(side_effect=lambda user_id: self.release.wait(5))
+        return Prefetcher(self.prefetch, lambda user_id: cached, **kwargs)
+
+    def wait_all(self, prefetcher):
+        futures = list(prefetcher.pending.values())
+        self.release.set()
+        wait(futures)
+
+    def test_submit(self):
+        prefetcher = self.create_prefetcher()
+
+        self.assertEqual(prefetcher.submit("user1"), PREFETCH_QUEUED)
+        self.assertEqual(prefetcher.submit("user1"), PREFETCH_DUPLICATE)
+        self.assertIn(hash_key("user1"), prefetcher.pending)
+
+        self.wait_all(prefetcher)
+
+        self.prefetch.assert_called_once_with("user1")
+        self.assertEqual(prefetcher.pending, {})
+        self.assertEqual(prefetcher.stats["prefetched"], 1)
+        self.assertEqual(prefetcher.stats["duplicate"], 1)
+
+        # Done, the next login prefetches again
+        self.assertEqual(prefetcher.submit("user1"), PREFETCH_QUEUED)
+        wait(prefetcher.pending.values())
+
+    def test_max_pending(self):
+        prefetcher = self.create_prefetcher(max_pending=1)
+
+        self.assertEqual(prefetcher.submit("user1"), PREFETCH_QUEUED)
+        self.assertEqual(prefetcher.submit("user2"), PREFETCH_REJECTED)
+        self.assertEqual(prefetcher.stats["rejected"], 1)
+
+        self.wait_all(prefetcher)
+
+    def test_cached(self):
+        prefetcher = self.create_prefetcher(cached=True)
+        prefetcher.submit("user1")
+
+        self.wait_all(prefetcher)
+
+        self.prefetch.assert_not_called()
+        self.assertEqual(prefetcher.stats["cached"], 1)
+
+    def test_failure(self):
+        prefetcher = self.create_prefetcher()
+        self.prefetch.side_effect = Exception("Could not login to Allegro")
+
+        with self.assertLogs(level="ERROR"):
+            prefetcher.submit("user1")
+            self.wait_all(prefetcher)
+
+        self.assertEqual(prefetcher.stats["failed"], 1)
+        self.assertEqual(prefetcher.pending, {})
+
+    def test_wait_for(self):
+        prefetcher = self.create_prefetcher()
+        self.assertFalse(prefetcher.wait_for("user1", 1))
+
+        prefetcher.submit("user1")
+        self.assertFalse(prefetcher.wait_for("user1", 0.01))
+
+        self.release.set()
+        self.assertTrue(prefetcher.wait_for("user1", 5))
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock
+
+from app.profiling import SamplingProfiler, should_profile
+
+
+def busy_wait(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTests(TestCase):
+    @mock.patch("app.profiling.KREFIA_PROFILING_SAMPLE_RATE", 0)
+    def test_should_profile(self):
+        self.assertFalse(should_profile())
+        self.assertFalse(should_profile("0"))
+        self.assertTrue(should_profile("1"))
+
+        with mock.patch("app.profiling.KREFIA_PROFILING", True):
+            self.assertTrue(should_profile())
+
+        with mock.patch("app.profiling.KREFIA_PROFILING_SAMPLE_RATE", 1):
+            self.assertTrue(should_profile())
+
+        with mock.patch("app.profiling.IS_PRODUCTION", True):
+            self.assertFalse(should_profile("1"))
+
+    def test_sampling_profiler(self):
+        profiler = SamplingProfiler(interval=0.001).start()
+
+        with ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="krefia-section"
+        ) as executor:
+            executor.submit(busy_wait, 0.05)
+            busy_wait(0.05)
+
+        profiler.stop()
+
+        self.assertGreater(profiler.samples, 0)
+        self.assertGreater(profiler.duration, 0.05)
+
+        roots = {stack.split(";")[0] for stack in profiler.stacks}
+        self.assertTrue({"request", "krefia-section"} <= roots)
+        for root in ["request", "krefia-section"]:
+            self.assertTrue(
+                any(
+                    stack.startswith(root + ";") and "busy_wait" in stack
+                    for stack in profiler.stacks
+                )
+            )
+
+        summary = profiler.get_summary()
+        self.assertIn("busy_wait (app/test_profiling.py", summary[0][0])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = profiler.write("test", directory)
+
+            with open(path) as file:
+                lines = file.read().splitlines()
+
+        self.assertTrue(os.path.basename(path).endswith("-test.folded"))
+        self.assertEqual(len(lines), len(profiler.stacks))
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertEqual(profiler.stacks[stack], int(count))
+
+        with mock.patch("app.profiling.logging") as logging_mock:
+            profiler.log_summary(path)
+
+        self.assertIn(path, logging_mock.info.call_args.args[0])
+
+    def test_other_threads_ignored(self):
+        stopped = threading.Event()
+        thread = threading.Thread(target=stopped.wait, name="krefia-refresh_0")
+        thread.start()
+
+        profiler = SamplingProfiler(interval=0.001).start()
+        busy_wait(0.02)
+        profiler.stop()
+        stopped.set()
+        thread.join()
+
+        self.assertTrue(profiler.stacks)
+        for stack in profiler.stacks:
+            self.assertFalse(stack.startswith("krefia-refresh"))
@@ -0,0 +1,145 @@
+import logging
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from app.queued_logging import DroppingQueueHandler, QueuedLogging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter("%(levelname)s %(funcName)s %(message)s"))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class QueuedLoggingTests(TestCase):
+    def get_logger(self, handler: logging.Handler):
+        logger = logging.getLogger(f"test-queued-logging-{id(handler)}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        return logger
+
+    def test_dropping_queue_handler(self):
+        handler = DroppingQueueHandler(2)
+        logger = self.get_logger(handler)
+        args = {"body": "foo"}
+
+        logger.debug("Response %s", args)
+        logger.info("second")
+        logger.info("third")
+
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(handler.dropped, 1)
+
+        record = handler.queue.get_nowait()
+        self.assertEqual(record.msg, "Response {'body': 'foo'}")
+        self.assertIsNone(record.args)
+
+    def test_disabled_level(self):
+        list_handler = ListHandler()
+        list_handler.setLevel(logging.INFO)
+        queued_logging = QueuedLogging(list_handler, 100)
+        logger = self.get_logger(queued_logging.queue_handler)
+        response = mock.Mock(__str__=mock.Mock(return_value="response"))
+
+        logger.debug("Response %s", response)
+        self.assertEqual(queued_logging.get_metrics()["queued"], 0)
+        response.__str__.assert_not_called()
+
+        logger.info("Response %s", response)
+        self.assertEqual(queued_logging.get_metrics()["queued"], 1)
+        response.__str__.assert_called_once()
+
+    def test_queued_logging(self):
+        list_handler = ListHandler()
+        queued_logging = QueuedLogging(list_handler, 100)
+        logger = self.get_logger(queued_logging.queue_handler)
+        queued_logging.start()
+
+        logger.info("Hello %s", "world")
+
+        try:
+            raise ValueError("Oops")
+        except ValueError:
+            logger.exception("Failed")
+
+        queued_logging.stop()
+
+        self.assertEqual(list_handler.lines[0], "INFO test_queued_logging Hello world")
+        # The traceback is formatted by the writer thread
+        self.assertTrue(
+            list_handler.lines[1].startswith("ERROR test_queued_logging Failed")
+        )
+        self.assertIn("ValueError: Oops", list_handler.lines[1])
+        self.assertEqual(queued_logging.get_metrics(), {"queued": 0, "dropped": 0})
+
+    def test_restart_after_fork(self):
+        list_handler = ListHandler()
+        queued_logging = QueuedLogging(list_handler, 1)
+        logger = self.get_logger(queued_logging.queue_handler)
+
+        # Not started, the queue fills up
+        logger.info("first")
+        logger.info("second")
+        queue = queued_logging.queue_handler.queue
+
+        queued_logging.restart_after_fork()
+        self.assertIsNot(queued_logging.queue_handler.queue, queue)
+
+        logger.info("third")
+        queued_logging.stop()
+        queued_logging.stop()
+
+        self.assertEqual(list_handler.lines, ["INFO test_restart_after_fork third"])
+        self.assertEqual(queued_logging.get_metrics()["dropped"], 1)
+
+    @mock.patch("app.queued_logging.STOP_TIMEOUT", 0.01)
+    def test_stop_full_queue(self):
+        written = threading.Event()
+        blocked = threading.Event()
+
+        class BlockingHandler(logging.Handler):
+            def emit(self, record):
+                written.set()
+                blocked.wait()
+
+        queued_logging = QueuedLogging(BlockingHandler(), 1)
+        logger = self.get_logger(queued_logging.queue_handler)
+        queued_logging.start()
+
+        logger.info("first")
+        written.wait()
+        logger.info("second")
+
+        # The writer is stuck, stop gives up instead of hanging
+        queued_logging.stop()
+        self.assertIsNone(queued_logging.listener)
+        blocked.set()
+
+    def test_forked_without_hooks(self):
+        # Like a uwsgi worker, the at-fork hooks of this QueuedLogging aren't registered
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "worker.log")
+            queued_logging = QueuedLogging(logging.FileHandler(path), 100)
+            logger = self.get_logger(queued_logging.queue_handler)
+            queued_logging.start()
+            logger.info("master")
+
+            pid = os.fork()
+
+            if pid == 0:  # pragma: no cover
+                logger.error("worker")
+                queued_logging.stop()
+                os._exit(0)
+
+            os.waitpid(pid, 0)
+            queued_logging.stop()
+
+            with open(path) as file:
+                self.assertEqual(sorted(file.read().splitlines()), ["master", "worker"])
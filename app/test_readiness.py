@@ -0,0 +1,71 @@
+import time
+from unittest import TestCase, mock
+
+from app.readiness import ReadinessProbe
+
+
+class ReadinessProbeTests(TestCase):
+    def create_probe(self, **kwargs):
+        self.probe = mock.Mock(return_value=True)
+        self.warm_up = mock.Mock()
+        self.clients = {"LoginService": True, "BBRService": True}
+        return ReadinessProbe(
+            self.probe, self.warm_up, lambda: dict(self.clients), **kwargs
+        )
+
+    def test_not_probed(self):
+        readiness_probe = self.create_probe()
+        status = readiness_probe.get_status()
+
+        self.assertFalse(status["ready"])
+        self.assertIsNone(status["probeAge"])
+        self.probe.assert_not_called()
+
+    def test_check(self):
+        readiness_probe = self.create_probe()
+        readiness_probe.check()
+
+        self.warm_up.assert_called_once()
+        status = readiness_probe.get_status()
+        self.assertTrue(status["ready"])
+        self.assertEqual(status["lastProbeAt"], status["lastSuccessAt"])
+
+        self.clients["BBRService"] = False
+        self.assertFalse(readiness_probe.get_status()["ready"])
+
+    def test_probe_failure(self):
+        readiness_probe = self.create_probe(max_age=10)
+        readiness_probe.check()
+
+        self.probe.return_value = False
+        readiness_probe.check()
+        status = readiness_probe.get_status()
+        self.assertTrue(status["ready"])
+        self.assertGreaterEqual(status["lastProbeAt"], status["lastSuccessAt"])
+
+        # Unreachable for longer than max age
+        with mock.patch("app.readiness.time.time", return_value=time.time() + 11):
+            self.assertFalse(readiness_probe.get_status()["ready"])
+
+    def test_errors(self):
+        readiness_probe = self.create_probe()
+        self.warm_up.side_effect = Exception("Could not build client")
+        self.probe.side_effect = Exception("Offline")
+
+        with self.assertLogs(level="ERROR") as logs:
+            readiness_probe.check()
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertFalse(readiness_probe.get_status()["ready"])
+
+    def test_start(self):
+        readiness_probe = self.create_probe(interval=0.01)
+        readiness_probe.start()
+        readiness_probe.start()
+        self.assertTrue(readiness_probe.is_running())
+
+        time.sleep(0.05)
+        readiness_probe.stop()
+
+        self.assertFalse(readiness_probe.is_running())
+        self.assertGreater(self.probe.call_count, 1)
@@ -0,0 +1,176 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from flask import Flask
+from freezegun import freeze_time
+
+from app import config
+
+config.KREFIA_SSO_KREDIETBANK = "https://localhost/kredietbank/sso-login"
+config.KREFIA_SSO_FIBU = "https://localhost/fibu/sso-login"
+
+from app.allegro_client import get_all
+from app.fixtures.mocks import (
+    load_response_file,
+    load_xml,
+    lxml_to_dict,
+    mock_clients,
+    replay_clients,
+)
+from app.recording import load_corpus, record_response, scrub
+
+fixture_clients = mock_clients(
+    [
+        (
+            "LoginService",
+            [
+                "AllegroWebMagAanmelden",
+                "BSNNaarRelatieMetBedrijf",
+                "AllegroWebLoginTijdelijk",
+            ],
+        ),
+        ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+        ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+        ("BBRService", ["GetBBROverzicht"]),
+        ("BerichtenBoxService", ["GetBerichten"]),
+    ]
+)
+
+
+def load_xml_dict(service_name: str, method_name: str):
+    response = lxml_to_dict(load_xml(load_response_file(service_name, method_name)))
+    return response["Envelope"]["Body"][f"{service_name}___{method_name}Response"]
+
+
+class RecordingTests(TestCase):
+    app = Flask(__name__)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_scrub(self):
+        body = {
+            "Result": {
+                "TRelatiecodeBedrijfcode": [
+                    {
+                        "Relatiecode": "123123",
+                        "Bedrijfscode": 2,
+                        "Bedrijfsnaam": "Kredietbank",
+                    },
+                    {"Relatiecode": 321321, "Bedrijfscode": 10, "Bedrijfsnaam": None},
+                ]
+            },
+            "Omschrijving": "BSN 123456789 bekend",
+            "IsNieuw": True,
+            "Status": "BSN 123456789",
+        }
+
+        self.assertEqual(
+            scrub(body),
+            {
+                "Result": {
+                    "TRelatiecodeBedrijfcode": [
+                        {
+                            "Relatiecode": "xxxxxx",
+                            "Bedrijfscode": 2,
+                            "Bedrijfsnaam": "Kredietbank",
+                        },
+                        {
+                            "Relatiecode": 999999,
+                            "Bedrijfscode": 10,
+                            "Bedrijfsnaam": None,
+                        },
+                    ]
+                },
+                "Omschrijving": "xxxxxxxxxxxxxxxxxxxx",
+                "IsNieuw": True,
+                "Status": "BSN 000000000",
+            },
+        )
+
+    def test_scrub_fixtures(self):
+        for service_name, method_name in [
+            ("BerichtenBoxService", "GetBerichten"),
+            ("BBRService", "GetBBROverzicht"),
+            ("LoginService", "AllegroWebLoginTijdelijk"),
+            ("LoginService", "AllegroWebMagAanmelden"),
+            ("FinancieringService", "GetPL"),
+            ("SchuldHulpService", "GetSRVAanvraag"),
+        ]:
+            body = json.dumps(
+                scrub(load_xml_dict(service_name, method_name)), default=str
+            )
+
+            for personal_data in [
+                "Bergeracq",
+                "van Tol",
+                "gaarne ID partner",
+                "JKL-Test",
+                "77776666655555",
+                "AnonymousLoginNA",
+                "321321",
+            ]:
+                self.assertNotIn(personal_data, body)
+
+        berichten = scrub(load_xml_dict("BerichtenBoxService", "GetBerichten"))
+        bericht = berichten["Result"]["TBBoxHeader"][0]
+        self.assertEqual(bericht["AfzenderOntvanger"], "x" * 19)
+        self.assertEqual(bericht["Tijdstip"], "2021-07-14T12:34:17")
+
+        lening = scrub(load_xml_dict("FinancieringService", "GetPL"))["Result"]
+        self.assertEqual(lening["MedelenerCode"], "x")
+        self.assertEqual(lening["NettoKredietsom"], "1600")
+
+    def test_record_response(self):
+        record_response("LoginService.Foo", {"Naam": "Jan"}, 0.25, self.directory.name)
+        os.makedirs(os.path.join(self.directory.name, "LoginService.Bar"))
+
+        self.assertEqual(
+            load_corpus(self.directory.name),
+            {
+                "LoginService.Foo": [
+                    {
+                        "operation": "LoginService.Foo",
+                        "duration": 0.25,
+                        "body": {"Naam": "xxx"},
+                    },
+                ]
+            },
+        )
+
+    @mock.patch("app.recording.logging")
+    def test_record_response_failed(self, logging_mock):
+        record_response("LoginService.Foo", {"Naam": "Jan"}, 0.25, "/dev/null")
+        logging_mock.error.assert_called_once()
+
+    @freeze_time("2021-11-03")
+    @mock.patch("app.allegro_client.ALLEGRO_RECORD", True)
+    def test_record_replay(self):
+        with mock.patch("app.recording.ALLEGRO_RECORD_PATH", self.directory.name):
+            with mock.patch("app.allegro_client.allegro_client", fixture_clients):
+                with self.app.test_request_context():
+                    content = get_all("_1_2_3_4_5_6_")
+
+            corpus = load_corpus()
+
+        self.assertEqual(len(corpus["LoginService.AllegroWebMagAanmelden"]), 2)
+
+        with mock.patch(
+            "app.allegro_client.allegro_client",
+            replay_clients(self.directory.name, speed=0),
+        ):
+            with self.app.test_request_context():
+                self.assertEqual(get_all("_1_2_3_4_5_6_"), content)
+
+    def test_replay_latency(self):
+        record_response("LoginService.Foo", {"Result": 1}, 0.02, self.directory.name)
+        clients = replay_clients(self.directory.name, speed=2)
+
+        with mock.patch("app.fixtures.mocks.time.sleep") as sleep_mock:
+            response = clients["LoginService"].service.Foo("bar")
+
+        sleep_mock.assert_called_with(0.01)
+        self.assertEqual(response, {"body": {"Result": 1}})
@@ -0,0 +1,88 @@
+import time
+from concurrent.futures import wait
+from unittest import TestCase, mock
+
+from app.refresh import RefreshScheduler
+
+
+class RefreshSchedulerTests(TestCase):
+    def create_scheduler(self, expires_in, **kwargs):
+        self.refresh = mock.Mock()
+        return RefreshScheduler(
+            self.refresh,
+            lambda user_id: time.time() + expires_in[user_id],
+            refresh_before_expiry=60,
+            pacing=0,
+            **kwargs,
+        )
+
+    def test_run_once(self):
+        scheduler = self.create_scheduler({"user1": 30, "user2": 300})
+        scheduler.touch("user1")
+        scheduler.touch("user2")
+
+        wait(scheduler.run_once())
+
+        self.refresh.assert_called_once_with("user1")
+        self.assertEqual(scheduler.stats["refreshed"], 1)
+        self.assertEqual(scheduler.in_progress, set())
+
+    def test_not_cached(self):
+        scheduler = RefreshScheduler(mock.Mock(), lambda user_id: None)
+        scheduler.touch("user1")
+        self.assertEqual(scheduler.get_due(), [])
+
+    def test_inactive_users(self):
+        scheduler = self.create_scheduler({"user1": 30}, active_window=10)
+        scheduler.touch("user1")
+
+        with mock.patch("app.refresh.time.time", return_value=time.time() + 11):
+            self.assertEqual(scheduler.get_due(), [])
+
+        self.assertEqual(len(scheduler.users), 0)
+
+    def test_max_users(self):
+        scheduler = self.create_scheduler({"user1": 30, "user2": 30}, max_users=1)
+        scheduler.touch("user1")
+        scheduler.touch("user2")
+
+        self.assertEqual([user_id for key, user_id in scheduler.get_due()], ["user2"])
+        self.assertEqual(len(scheduler.users), 1)
+
+    def test_refresh_failure(self):
+        scheduler = self.create_scheduler({"user1": 30})
+        self.refresh.side_effect = Exception("Could not login to Allegro")
+        scheduler.touch("user1")
+
+        wait(scheduler.run_once())
+
+        self.assertEqual(scheduler.stats["failed"], 1)
+
+    def test_start_stop(self):
+        scheduler = self.create_scheduler({"user1": 30}, interval=0.01)
+        scheduler.touch("user1")
+
+        scheduler.start()
+        self.assertTrue(scheduler.is_running())
+        scheduler.start()
+
+        for _ in range(100):
+            if self.refresh.called:
+                break
+            time.sleep(0.01)
+
+        scheduler.stop()
+        self.assertFalse(scheduler.is_running())
+        self.refresh.assert_called_with("user1")
+
+    def test_get_due_unlocked(self):
+        scheduler = self.create_scheduler({"user1": 30})
+        scheduler.touch("user1")
+
+        def get_expires_at(user_id):
+            # touch() from a request thread doesn't wait for the expiry lookups
+            self.assertFalse(scheduler.lock.locked())
+            return time.time() + 30
+
+        scheduler.get_expires_at = get_expires_at
+        self.assertEqual(len(scheduler.get_due()), 1)
@@ -0,0 +1,85 @@
+from unittest import TestCase, mock
+
+from requests import ConnectionError, Timeout
+from zeep.exceptions import Fault, TransportError
+
+from app.retry import (
+    RetryPolicy,
+    call_with_retry,
+    get_backoff_delay,
+    get_retry_policy,
+    is_transient_error,
+)
+
+
+@mock.patch("app.retry.time.sleep")
+class RetryTests(TestCase):
+    def test_is_transient_error(self, sleep_mock):
+        self.assertTrue(is_transient_error(ConnectionError()))
+        self.assertTrue(is_transient_error(Timeout()))
+        self.assertTrue(is_transient_error(TransportError(status_code=503)))
+        self.assertFalse(is_transient_error(TransportError(status_code=500)))
+        self.assertFalse(is_transient_error(Fault("Invalid relatiecode")))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    def test_get_retry_policy(self, sleep_mock):
+        self.assertEqual(get_retry_policy("FinancieringService.GetPL").attempts, 3)
+        self.assertEqual(
+            get_retry_policy("LoginService.AllegroWebLoginTijdelijk").attempts, 1
+        )
+
+    def test_get_backoff_delay(self, sleep_mock):
+        policy = RetryPolicy(attempts=5, base_delay=1, max_delay=3)
+
+        for _ in range(20):
+            self.assertLessEqual(get_backoff_delay(policy, 1), 1)
+            self.assertLessEqual(get_backoff_delay(policy, 2), 2)
+            self.assertLessEqual(get_backoff_delay(policy, 4), 3)
+
+    def test_retry(self, sleep_mock):
+        fn = mock.Mock(side_effect=[ConnectionError(), Timeout(), "result"])
+
+        self.assertEqual(call_with_retry("FinancieringService.GetPL", fn), "result")
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(sleep_mock.call_count, 2)
+
+    def test_attempts_exhausted(self, sleep_mock):
+        fn = mock.Mock(side_effect=ConnectionError())
+
+        with self.assertRaises(ConnectionError):
+            call_with_retry("FinancieringService.GetPL", fn)
+
+        self.assertEqual(fn.call_count, 3)
+
+    def test_no_retry(self, sleep_mock):
+        fn = mock.Mock(side_effect=Fault("Invalid relatiecode"))
+
+        with self.assertRaises(Fault):
+            call_with_retry("FinancieringService.GetPL", fn)
+
+        fn = mock.Mock(side_effect=ConnectionError())
+
+        with self.assertRaises(ConnectionError):
+            call_with_retry("LoginService.AllegroWebLoginTijdelijk", fn)
+
+        self.assertEqual(fn.call_count, 1)
+        sleep_mock.assert_not_called()
+
+    def test_time_budget(self, sleep_mock):
+        fn = mock.Mock(side_effect=[ConnectionError(), "result"])
+
+        with self.assertRaises(ConnectionError):
+            call_with_retry("FinancieringService.GetPL", fn, lambda: 1)
+
+        fn = mock.Mock(side_effect=[ConnectionError(), "result"])
+        self.assertEqual(
+            call_with_retry("FinancieringService.GetPL", fn, lambda: 10), "result"
+        )
+
+        # Enough time for the delay and an attempt with the minimum timeout
+        with mock.patch("app.retry.ALLEGRO_TIMEOUT_FLOOR", 0.5):
+            fn = mock.Mock(side_effect=[ConnectionError(), "result"])
+            self.assertEqual(
+                call_with_retry("FinancieringService.GetPL", fn, lambda: 1.5),
+                "result",
+            )
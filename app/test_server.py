@@ -1,14 +1,19 @@
+import json
 import os
+import time
 from unittest import mock
 
 from app import config
-from app.auth import FlaskServerTestCase
+from app.auth import PROFILE_TYPE_COMMERCIAL, FlaskServerTestCase
 from app.fixtures.mocks import mock_client, mock_clients
 
 config.KREFIA_SSO_KREDIETBANK = "https://localhost/kredietbank/sso-login"
 config.KREFIA_SSO_FIBU = "https://localhost/fibu/sso-login"
 config.ALLEGRO_SOAP_ENDPOINT = "https://localhost/SOAP"
 
+from app import server
+from app.allegro_client import AllegroUnavailable
+from app.cache import krefia_cache
 from app.server import app
 
 
@@ -31,6 +36,85 @@ class ApiTests(FlaskServerTestCase):
             '{"content":{"buildId":"999","gitSha":"abcdefghijk","otapEnv":"unittesting"},"status":"OK"}\n',
         )
 
+    def test_metrics(self):
+        response = self.client.get("/status/metrics")
+        self.assertEqual(response.status_code, 200)
+
+        content = response.get_json()["content"]
+        self.assertIn("global", content["bulkheads"])
+        self.assertIn("hedged", content["hedging"])
+        self.assertIn("dropped", content["logging"])
+
+    @mock.patch("app.server.readiness_probe")
+    def test_ready(self, readiness_probe_mock):
+        readiness_probe_mock.is_running.return_value = False
+        readiness_probe_mock.get_status.return_value = {
+            "ready": False,
+            "clients": {"LoginService": False},
+        }
+
+        response = self.client.get("/status/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            response.get_json()["content"], readiness_probe_mock.get_status.return_value
+        )
+        readiness_probe_mock.start.assert_called()
+
+        readiness_probe_mock.get_status.return_value = {
+            "ready": True,
+            "clients": {"LoginService": True},
+        }
+
+        response = self.client.get("/status/ready")
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("app.allegro_client.get_all")
+    def test_load_shedding(self, get_all_mock):
+        get_all_mock.return_value = None
+        request_start = f"t={time.time() - 60}"
+
+        response = self.get_secure(
+            "/krefia/all", headers={"X-Request-Start": request_start}
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "5")
+        self.assertEqual(response.get_json()["message"], "Server overloaded")
+        get_all_mock.assert_not_called()
+
+        response = self.get_secure(
+            "/krefia/all", headers={"X-Request-Start": f"t={time.time()}"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        metrics = self.client.get("/status/metrics").get_json()["content"]
+        self.assertEqual(metrics["loadShedding"]["inFlight"], 0)
+        self.assertGreaterEqual(metrics["loadShedding"]["shed"], 1)
+
+    @mock.patch("app.server.SamplingProfiler")
+    @mock.patch("app.allegro_client.get_all")
+    def test_get_all_profiled(self, get_all_mock, profiler_mock):
+        get_all_mock.return_value = None
+        profiler = profiler_mock.return_value.start.return_value
+
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.status_code, 200)
+        profiler_mock.assert_not_called()
+
+        response = self.get_secure("/krefia/all", headers={"X-Krefia-Profile": "1"})
+        self.assertEqual(response.status_code, 200)
+        profiler.stop.assert_called_once()
+        profiler.write.assert_called_with("krefia-all")
+        profiler.log_summary.assert_called_with(profiler.write.return_value)
+
+    @mock.patch("app.allegro_client.get_all")
+    def test_allegro_unavailable(self, get_all_mock):
+        get_all_mock.side_effect = AllegroUnavailable("LoginService", 1.5)
+
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(response.get_json()["message"], "Allegro unavailable")
+
     def mock_response(*args, **kwargs):
         return {"body": {"FOo": "Barrr"}}
 
@@ -130,6 +214,256 @@ class ApiTests(FlaskServerTestCase):
 
         self.assertEqual(data, expected)
 
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_clients(
+            [
+                (
+                    "LoginService",
+                    [
+                        "AllegroWebMagAanmelden",
+                        "BSNNaarRelatieMetBedrijf",
+                        "AllegroWebLoginTijdelijk",
+                    ],
+                ),
+                ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+                ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+                ("BBRService", [("GetBBROverzicht", mock_no_result)]),
+                ("BerichtenBoxService", [("GetBerichten", mock_no_result)]),
+            ]
+        ),
+    )
+    def test_get_all_server_timing(self):
+        response = self.get_secure("/krefia/all")
+        metrics = [
+            metric.split(";")[0]
+            for metric in response.headers["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(
+            metrics,
+            [
+                "auth",
+                "login",
+                "relaties",
+                "section-budgetbeheer",
+                "section-fibuNotification",
+                "section-schuldhulp",
+                "section-lening",
+                "section-kredietbankNotification",
+                "json",
+                "total",
+            ],
+        )
+
+        with mock.patch.dict(app.config, {"SERVER_TIMING": False}):
+            response = self.get_secure("/krefia/all")
+        self.assertNotIn("Server-Timing", response.headers)
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_clients(
+            [
+                (
+                    "LoginService",
+                    [
+                        "AllegroWebMagAanmelden",
+                        "BSNNaarRelatieMetBedrijf",
+                        "AllegroWebLoginTijdelijk",
+                    ],
+                ),
+                ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+                ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+                ("BBRService", [("GetBBROverzicht", mock_no_result)]),
+                ("BerichtenBoxService", [("GetBerichten", mock_no_result)]),
+            ]
+        ),
+    )
+    def test_get_all_conditional(self):
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.status_code, 200)
+
+        etag = response.headers["ETag"]
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn("private", response.headers["Cache-Control"])
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+        self.assertIn("Authorization", response.headers["Vary"])
+
+        response = self.get_secure("/krefia/all", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        self.assertEqual(response.headers["ETag"], etag)
+
+        response = self.get_secure(
+            "/krefia/all", headers={"If-None-Match": f'"other", W/{etag}'}
+        )
+        self.assertEqual(response.status_code, 304)
+
+        response = self.get_secure("/krefia/all", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    @mock.patch("app.allegro_client.KREFIA_CACHE_TTL", 60)
+    @mock.patch("app.server.KREFIA_CACHE_TTL", 60)
+    @mock.patch("app.server.KREFIA_REFRESH", True)
+    @mock.patch("app.server.refresh_scheduler")
+    @mock.patch("app.allegro_client.get_all")
+    def test_get_all_cached(self, get_all_mock, refresh_scheduler_mock):
+        get_all_mock.return_value = {"deepLinks": {}, "notificationTriggers": None}
+        refresh_scheduler_mock.is_running.return_value = False
+
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.get_json()["content"], get_all_mock.return_value)
+        self.assertEqual(get_all_mock.call_count, 1)
+
+        refresh_scheduler_mock.start.assert_called()
+        refresh_scheduler_mock.touch.assert_called_with(self.TEST_BSN)
+
+        with self.app.app_context():
+            server.refresh_user(self.TEST_BSN)
+
+        self.assertEqual(get_all_mock.call_count, 2)
+        krefia_cache.clear()
+
+    @mock.patch("app.allegro_client.KREFIA_CACHE_TTL", 60)
+    @mock.patch("app.server.KREFIA_CACHE_TTL", 60)
+    @mock.patch("app.allegro_client.get_all")
+    def test_prefetch(self, get_all_mock):
+        get_all_mock.return_value = {"deepLinks": {}, "notificationTriggers": None}
+
+        response = self.post_secure("/krefia/prefetch")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()["content"], {"prefetch": "queued"})
+
+        response = self.get_secure("/krefia/all")
+        self.assertEqual(response.get_json()["content"], get_all_mock.return_value)
+        self.assertEqual(get_all_mock.call_count, 1)
+
+        # The quick 202 doesn't count towards the expected duration of /krefia/all
+        with mock.patch("app.server.KREFIA_LOAD_SHEDDING", True), mock.patch(
+            "app.load_shedding.record_latency"
+        ) as record_latency_mock:
+            response = self.post_secure("/krefia/prefetch")
+            self.assertEqual(response.status_code, 202)
+            record_latency_mock.assert_not_called()
+
+        response = self.post_secure(
+            "/krefia/prefetch", profile_type=PROFILE_TYPE_COMMERCIAL
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.get_json()["content"], {"prefetch": "skipped"})
+        krefia_cache.clear()
+
+    @mock.patch(
+        "app.allegro_client.allegro_client",
+        mock_clients(
+            [
+                (
+                    "LoginService",
+                    [
+                        "AllegroWebMagAanmelden",
+                        "BSNNaarRelatieMetBedrijf",
+                        "AllegroWebLoginTijdelijk",
+                    ],
+                ),
+                ("SchuldHulpService", ["GetSRVAanvraag", "GetSRVOverzicht"]),
+                ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+                ("BBRService", [("GetBBROverzicht", mock_no_result)]),
+                ("BerichtenBoxService", [("GetBerichten", mock_no_result)]),
+            ]
+        ),
+    )
+    def test_get_all_stream(self):
+        response = self.get_secure("/krefia/all?stream=ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(
+            sorted(record["section"] for record in records[:-1]),
+            [
+                "deepLinks.budgetbeheer",
+                "deepLinks.lening",
+                "deepLinks.schuldhulp",
+                "notificationTriggers.fibu",
+                "notificationTriggers.krediet",
+            ],
+        )
+
+        summary = records[-1]
+        self.assertEqual(summary["status"], "OK")
+        self.assertEqual(
+            summary["content"]["deepLinks"]["schuldhulp"]["title"],
+            "Afkoopvoorstellen zijn verstuurd",
+        )
+        self.assertIsNone(summary["content"]["notificationTriggers"])
+
+        response = self.get_secure(
+            "/krefia/all?sections=deepLinks.lening",
+            headers={"Accept": "application/x-ndjson"},
+        )
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(records[0]["section"], "deepLinks.lening")
+        self.assertEqual(list(records[1]["content"]["deepLinks"].keys()), ["lening"])
+
+    @mock.patch("app.allegro_client.get_user_relaties")
+    def test_get_all_stream_error(self, get_user_relaties_mock):
+        get_user_relaties_mock.side_effect = Exception("Could not login to Allegro")
+
+        response = self.get_secure("/krefia/all?stream=ndjson")
+        records = [json.loads(line) for line in response.data.decode().splitlines()]
+
+        self.assertEqual(
+            records, [{"status": "ERROR", "message": "Server error occurred"}]
+        )
+
+    def test_get_all_stream_commercial(self):
+        response = self.get_secure(
+            "/krefia/all?stream=ndjson", profile_type=PROFILE_TYPE_COMMERCIAL
+        )
+        self.assertEqual(response.data, b'{"content":null,"status":"OK"}\n')
+
+    @mock.patch("app.allegro_client.get_all")
+    def test_get_all_sections(self, get_all_mock):
+        get_all_mock.return_value = {"notificationTriggers": None}
+
+        response = self.get_secure(
+            "/krefia/all?sections=notificationTriggers,deepLinks.lening"
+        )
+        self.assertEqual(response.status_code, 200)
+        get_all_mock.assert_called_with(
+            self.TEST_BSN, ["deepLinks.lening", "notificationTriggers"]
+        )
+
+        response = self.get_secure(
+            "/krefia/all?sections=notificationTriggers,,deepLinks.lening,"
+        )
+        self.assertEqual(response.status_code, 200)
+        get_all_mock.assert_called_with(
+            self.TEST_BSN, ["deepLinks.lening", "notificationTriggers"]
+        )
+
+        response = self.get_secure("/krefia/all?sections=,")
+        self.assertEqual(response.status_code, 200)
+        get_all_mock.assert_called_with(self.TEST_BSN, None)
+
+        response = self.get_secure("/krefia/all?sections=deepLinks.foo")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["status"], "ERROR")
+
+    @mock.patch("app.allegro_client.get_all")
+    def test_get_all_commercial(self, get_all_mock):
+        response = self.get_secure("/krefia/all", profile_type=PROFILE_TYPE_COMMERCIAL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"content": None, "status": "OK"})
+        get_all_mock.assert_not_called()
+
     def test_not_authenticated(self):
         response = self.client.get("/krefia/all")
         data = response.get_json()
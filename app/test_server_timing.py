@@ -0,0 +1,53 @@
+import threading
+from unittest import TestCase
+
+from flask import Flask
+
+from app.server_timing import (
+    ServerTiming,
+    get_server_timing,
+    set_server_timing,
+    start_server_timing,
+    timed,
+)
+
+
+class ServerTimingTests(TestCase):
+    app = Flask(__name__)
+
+    def test_server_timing(self):
+        server_timing = ServerTiming()
+        server_timing.add("login", 0.01)
+        server_timing.add("cache", 0.002)
+        server_timing.add("login", 0.0155)
+
+        metrics = server_timing.get_header().split(", ")
+        self.assertEqual(metrics[:2], ["login;dur=25.5", "cache;dur=2.0"])
+        self.assertTrue(metrics[2].startswith("total;dur="))
+
+    def test_timed(self):
+        # No request is being timed
+        with timed("login"):
+            pass
+
+        with self.app.test_request_context():
+            with timed("login"):
+                pass
+
+            start_server_timing()
+            server_timing = get_server_timing()
+
+            with timed("login"):
+                pass
+
+            def run():
+                with self.app.app_context():
+                    set_server_timing(server_timing)
+                    with timed("section-lening"):
+                        pass
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(list(server_timing.durations), ["login", "section-lening"])
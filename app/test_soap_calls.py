@@ -0,0 +1,81 @@
+import threading
+from unittest import TestCase
+
+from flask import Flask, g
+
+from app.soap_calls import (
+    SoapCallLog,
+    get_soap_call_log,
+    record_soap_call,
+    record_soap_call_failure,
+    set_soap_call_failure_scopes,
+    set_soap_call_log,
+    start_soap_call_log,
+    track_soap_call_failures,
+)
+
+
+class SoapCallLogTests(TestCase):
+    app = Flask(__name__)
+
+    def test_soap_call_log(self):
+        soap_call_log = SoapCallLog()
+        soap_call_log.add("LoginService.A", soap_call_log.started_at + 0.5, 0.25)
+        soap_call_log.add("LoginService.B", soap_call_log.started_at + 1, 0.5)
+        soap_call_log.add("LoginService.A", soap_call_log.started_at + 1, 0.25)
+
+        self.assertEqual(soap_call_log.count(), 3)
+        self.assertEqual(soap_call_log.count("LoginService.A"), 2)
+        self.assertEqual(
+            soap_call_log.get_counts(), {"LoginService.A": 2, "LoginService.B": 1}
+        )
+        self.assertEqual(soap_call_log.get_duration(), 1)
+        self.assertEqual(soap_call_log.calls[0].offset, 0.5)
+
+    def test_record_soap_call(self):
+        # Nothing is recorded outside a request
+        record_soap_call("LoginService.A", 0)
+
+        with self.app.test_request_context():
+            self.assertIsNone(get_soap_call_log())
+
+            soap_call_log = start_soap_call_log()
+            record_soap_call("LoginService.A", soap_call_log.started_at)
+
+            def run():
+                with self.app.app_context():
+                    set_soap_call_log(soap_call_log)
+                    record_soap_call("LoginService.B", soap_call_log.started_at)
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(soap_call_log.count(), 2)
+
+    def test_track_soap_call_failures(self):
+        # Nothing is recorded outside a request
+        record_soap_call_failure("LoginService.A")
+
+        with self.app.test_request_context():
+            record_soap_call_failure("LoginService.A")
+
+            with track_soap_call_failures() as failures:
+                record_soap_call_failure("LoginService.B")
+
+                with track_soap_call_failures() as inner_failures:
+                    scopes = g.soap_call_failure_scopes
+
+                    def run():
+                        with self.app.app_context():
+                            set_soap_call_failure_scopes(scopes)
+                            record_soap_call_failure("LoginService.C")
+
+                    thread = threading.Thread(target=run)
+                    thread.start()
+                    thread.join()
+
+            record_soap_call_failure("LoginService.D")
+
+        self.assertEqual(failures, ["LoginService.B", "LoginService.C"])
+        self.assertEqual(inner_failures, ["LoginService.C"])
@@ -0,0 +1,106 @@
+import threading
+from unittest import TestCase, mock
+
+from app.latency import record_latency, reset_latencies
+from app.timeouts import (
+    AdaptiveTimeoutTransport,
+    DeadlineExceeded,
+    get_operation_timeout,
+    with_deadline,
+    with_operation_timeout,
+)
+
+
+class AdaptiveTimeoutTransportTests(TestCase):
+    def test_call_timeout(self):
+        transport = AdaptiveTimeoutTransport(operation_timeout=60)
+        other_thread_timeouts = []
+
+        def other_thread():
+            other_thread_timeouts.append(transport.operation_timeout)
+
+        with mock.patch.object(transport.session, "post") as post_mock:
+            with transport.call_timeout(1.5):
+                thread = threading.Thread(target=other_thread)
+                thread.start()
+                thread.join()
+
+                transport.post("https://localhost/SOAP", b"<xml/>", {})
+
+            self.assertEqual(post_mock.call_args.kwargs["timeout"], 1.5)
+
+            transport.post("https://localhost/SOAP", b"<xml/>", {})
+            self.assertEqual(post_mock.call_args.kwargs["timeout"], 60)
+
+        self.assertEqual(other_thread_timeouts, [60])
+
+
+@mock.patch("app.timeouts.ALLEGRO_REQUEST_TIMEOUT", 60)
+@mock.patch("app.timeouts.ALLEGRO_TIMEOUT_FLOOR", 2)
+@mock.patch("app.timeouts.ALLEGRO_TIMEOUT_MULTIPLIER", 3)
+class OperationTimeoutTests(TestCase):
+    def tearDown(self):
+        reset_latencies()
+
+    def record_latencies(self, operation: str, latency: float):
+        for _ in range(20):
+            record_latency(operation, latency)
+
+    def test_get_operation_timeout(self):
+        # Not enough calls observed yet
+        self.assertEqual(get_operation_timeout("Service.op"), 60)
+        self.assertEqual(get_operation_timeout("Service.op", 10), 10)
+
+        self.record_latencies("Service.fast", 0.1)
+        self.assertEqual(get_operation_timeout("Service.fast"), 2)
+
+        self.record_latencies("Service.normal", 4)
+        self.assertEqual(get_operation_timeout("Service.normal"), 12)
+        self.assertEqual(get_operation_timeout("Service.normal", 5), 5)
+        # The request is over its budget already, don't make it worse
+        with self.assertRaises(DeadlineExceeded):
+            get_operation_timeout("Service.normal", 0)
+
+        self.record_latencies("Service.slow", 30)
+        self.assertEqual(get_operation_timeout("Service.slow"), 60)
+
+    def test_with_operation_timeout(self):
+        transport = AdaptiveTimeoutTransport(operation_timeout=60)
+        client = mock.Mock(transport=transport)
+        self.record_latencies("Service.op", 1)
+
+        fn = with_operation_timeout(
+            client, "Service.op", lambda: transport.operation_timeout
+        )
+        self.assertEqual(fn(), 3)
+        self.assertEqual(transport.operation_timeout, 60)
+
+        # The timeout follows the time left at the moment of the call
+        remaining_time = mock.Mock(side_effect=[2.5, 1.5, -0.5])
+        fn = with_operation_timeout(
+            client,
+            "Service.op",
+            lambda: transport.operation_timeout,
+            remaining_time,
+        )
+        self.assertEqual(fn(), 2.5)
+        self.assertEqual(fn(), 1.5)
+
+        # Fails before calling Allegro, instead of with the full timeout
+        with self.assertRaises(DeadlineExceeded):
+            fn()
+
+        # Mocked clients are called as-is
+        fn = mock.Mock()
+        self.assertIs(with_operation_timeout(mock.Mock(), "Service.op", fn), fn)
+
+    def test_with_deadline(self):
+        fn = mock.Mock(return_value="result")
+
+        self.assertEqual(with_deadline("Service.op", fn)(), "result")
+        self.assertEqual(with_deadline("Service.op", fn, lambda: 0.5)(), "result")
+
+        with self.assertRaises(DeadlineExceeded):
+            with_deadline("Service.op", fn, lambda: 0)()
+
+        self.assertEqual(fn.call_count, 2)
@@ -0,0 +1,106 @@
+import threading
+from contextlib import contextmanager
+
+from zeep.transports import Transport
+
+from app.config import (
+    ALLEGRO_REQUEST_TIMEOUT,
+    ALLEGRO_TIMEOUT_FLOOR,
+    ALLEGRO_TIMEOUT_MULTIPLIER,
+    ALLEGRO_TIMEOUT_PERCENTILE,
+)
+from app.latency import get_latency_percentile
+
+
+class DeadlineExceeded(Exception):
+    """The request is past its deadline, there's no time left to call Allegro"""
+
+
+class AdaptiveTimeoutTransport(Transport):
+    """Transport of which the operation timeout can be set per thread, for the duration of a call"""
+
+    def __init__(self, *args, **kwargs):
+        self.local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def operation_timeout(self):
+        return getattr(self.local, "timeout", None) or self.default_operation_timeout
+
+    @operation_timeout.setter
+    def operation_timeout(self, timeout: float):
+        self.default_operation_timeout = timeout
+
+    @contextmanager
+    def call_timeout(self, timeout: float):
+        previous = getattr(self.local, "timeout", None)
+        self.local.timeout = timeout
+
+        try:
+            yield
+        finally:
+            self.local.timeout = previous
+
+
+def check_deadline(operation: str, remaining_time: float = None):
+    """Raises DeadlineExceeded when the request has no time left"""
+    if remaining_time is not None and remaining_time <= 0:
+        raise DeadlineExceeded(operation)
+
+
+def get_operation_timeout(operation: str, remaining_time: float = None):
+    """A multiple of the observed latency percentile of the operation, within the floor and
+    ALLEGRO_REQUEST_TIMEOUT. The ceiling is used until enough calls have been observed.
+
+    Raises DeadlineExceeded when the request has no time left.
+    """
+    check_deadline(operation, remaining_time)
+    latency = get_latency_percentile(operation, ALLEGRO_TIMEOUT_PERCENTILE)
+
+    if latency is None:
+        timeout = ALLEGRO_REQUEST_TIMEOUT
+    else:
+        timeout = min(
+            max(latency * ALLEGRO_TIMEOUT_MULTIPLIER, ALLEGRO_TIMEOUT_FLOOR),
+            ALLEGRO_REQUEST_TIMEOUT,
+        )
+
+    # There's no use in waiting longer than the request may take
+    if remaining_time is not None:
+        timeout = min(timeout, remaining_time)
+
+    return timeout
+
+
+def with_deadline(operation: str, fn, get_remaining_time=lambda: None):
+    """Wraps fn, raises DeadlineExceeded instead of calling fn when the request has no time left.
+
+    Wrap it around the bulkhead, so a request past its deadline doesn't take (or wait for) a slot.
+    """
+
+    def call():
+        check_deadline(operation, get_remaining_time())
+        return fn()
+
+    return call
+
+
+def with_operation_timeout(client, operation: str, fn, get_remaining_time=lambda: None):
+    """Wraps fn, the calls it makes through the transport of client time out adaptively.
+
+    The timeout is computed on every call, from the time the request has left at that moment,
+    so retries and hedges of the call don't outlive the request.
+    """
+    transport = getattr(client, "transport", None)
+
+    if not isinstance(transport, AdaptiveTimeoutTransport):
+        return fn
+
+    def call():
+        timeout = get_operation_timeout(operation, get_remaining_time())
+
+        # Set on the thread that actually sends the request (e.g. a hedging worker)
+        with transport.call_timeout(timeout):
+            return fn()
+
+    return call
@@ -0,0 +1,74 @@
+import gc
+import logging
+import sys
+import threading
+import tracemalloc
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from app import allegro_client
+from app.fixtures.mocks import FIXTURES_PATH
+
+# Measures the memory held by the five service clients, with and without the shared transport.
+# The service descriptions are served from the fixtures over http, like Allegro serves them.
+# Usage: python -m scripts.client_memory [shared|separate]
+
+services = [
+    "LoginService",
+    "SchuldHulpService",
+    "FinancieringService",
+    "BBRService",
+    "BerichtenBoxService",
+]
+
+logging.getLogger("zeep").setLevel(logging.ERROR)
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+server = ThreadingHTTPServer(
+    ("127.0.0.1", 0), partial(QuietHandler, directory=FIXTURES_PATH)
+)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def get_service_description(service_name: str):
+    # The fixtures only describe the LoginService, a url per service like the Allegro endpoint
+    return f"http://127.0.0.1:{server.server_port}/LoginService.wsdl?service={service_name}"
+
+
+def create_clients(shared: bool):
+    with mock.patch("app.allegro_client.ALLEGRO_SHARED_TRANSPORT", shared), mock.patch(
+        "app.allegro_client.get_allegro_service_description", get_service_description
+    ):
+        return [allegro_client.create_client(service) for service in services]
+
+
+# The first client imports and initialises the modules it uses, don't count that
+create_clients(False)
+
+modes = sys.argv[1:] or ["separate", "shared"]
+
+for mode in modes:
+    allegro_client.get_shared_transport.cache_clear()
+    gc.collect()
+
+    tracemalloc.start()
+    clients = create_clients(mode == "shared")
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{mode}: {len([c for c in clients if c])}/{len(services)} clients, "
+        f"current {current / 1024:.0f} KiB, peak {peak / 1024:.0f} KiB"
+    )
+
+    del clients
+
+server.shutdown()
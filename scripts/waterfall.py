@@ -0,0 +1,263 @@
+import argparse
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from unittest import mock
+
+from app import allegro_client
+from app.config import ALLEGRO_REQUEST_TIMEOUT
+from app.fixtures.mocks import load_response_file, mock_clients
+from app.server import app
+from app.timeouts import AdaptiveTimeoutTransport
+
+# Prints a timeline of the Allegro calls get_all makes for a BSN.
+# Usage: python -m scripts.waterfall <bsn> [--stand-in [--latency 80]] [--concurrent]
+
+TIMELINE_WIDTH = 50
+
+stand_in_operations = [
+    (
+        "LoginService",
+        [
+            "AllegroWebLoginTijdelijk",
+            "BSNNaarRelatieMetBedrijf",
+            "AllegroWebMagAanmelden",
+        ],
+    ),
+    ("SchuldHulpService", ["GetSRVOverzicht", "GetSRVAanvraag"]),
+    ("FinancieringService", ["GetPLOverzicht", "GetPL"]),
+    ("BBRService", ["GetBBROverzicht"]),
+    ("BerichtenBoxService", ["GetBerichten"]),
+]
+
+current = threading.local()
+lock = threading.Lock()
+spans = []
+exchanges = []
+
+
+def record(records: list, **values):
+    with lock:
+        records.append(values)
+
+
+class TimingTransport(AdaptiveTimeoutTransport):
+    """Records the duration and size of every request/response pair"""
+
+    def post(self, address, message, headers):
+        start = time.perf_counter()
+        response = super().post(address, message, headers)
+
+        record(
+            exchanges,
+            operation=getattr(current, "operation", None),
+            start=start,
+            end=time.perf_counter(),
+            sent=len(message),
+            received=len(response.content),
+        )
+
+        return response
+
+
+def stand_in_method(service_name: str, method_name: str, method, latency: float):
+    """Responds with the fixture after a fixed delay, like TimingTransport would have recorded it"""
+    received = len(load_response_file(service_name, method_name))
+
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        time.sleep(latency)
+        end = time.perf_counter()
+        record(
+            exchanges,
+            operation=getattr(current, "operation", None),
+            start=start,
+            end=end,
+            sent=None,
+            received=received,
+        )
+
+        return method(*args, **kwargs)
+
+    return call
+
+
+def get_stand_in_clients(latency: float):
+    clients = mock_clients(stand_in_operations)
+
+    for service_name, method_names in stand_in_operations:
+        service = clients[service_name].service
+
+        for method_name in method_names:
+            method = getattr(service, method_name)
+            setattr(
+                service,
+                method_name,
+                stand_in_method(service_name, method_name, method, latency),
+            )
+
+    return clients
+
+
+def traced(call_service_method):
+    def call(operation: str, *args):
+        current.operation = operation
+        start = time.perf_counter()
+
+        try:
+            return call_service_method(operation, *args)
+        finally:
+            record(
+                spans,
+                operation=operation,
+                thread=threading.current_thread().name,
+                start=start,
+                end=time.perf_counter(),
+            )
+            current.operation = None
+
+    return call
+
+
+def get_critical_path(spans: list):
+    """Walks back from the call that ended last, through the calls each one had to wait for"""
+    path = set()
+    span = max(spans, key=lambda s: s["end"], default=None)
+
+    while span:
+        path.add(id(span))
+        before = [s for s in spans if s["end"] <= span["start"]]
+        span = max(before, key=lambda s: s["end"], default=None)
+
+    return path
+
+
+def get_concurrency(span: dict, spans: list):
+    return sum(
+        1 for s in spans if s["start"] < span["end"] and s["end"] > span["start"]
+    )
+
+
+def format_bytes(size):
+    if size is None:
+        return "-"
+
+    if size >= 1024:
+        return f"{size / 1024:.1f}K"
+
+    return str(size)
+
+
+def print_waterfall(started_at: float, ended_at: float):
+    total = ended_at - started_at
+    critical_path = get_critical_path(spans)
+
+    def ms(seconds: float):
+        return f"{seconds * 1000:7.1f}"
+
+    print(
+        f"{'':2}{'operation':42} {'start':>7} {'end':>7} {'net':>7} {'zeep':>7}"
+        f" {'sent':>6} {'recv':>6} {'conc':>4}  {'thread':16} timeline"
+    )
+
+    for span in sorted(spans, key=lambda s: s["start"]):
+        span_exchanges = [
+            e
+            for e in exchanges
+            if e["operation"] == span["operation"]
+            and e["start"] >= span["start"]
+            and e["end"] <= span["end"]
+        ]
+        network = sum(e["end"] - e["start"] for e in span_exchanges)
+        sent = [e["sent"] for e in span_exchanges if e["sent"] is not None]
+        received = sum(e["received"] for e in span_exchanges)
+
+        offset = int((span["start"] - started_at) / total * TIMELINE_WIDTH)
+        length = max(1, int((span["end"] - span["start"]) / total * TIMELINE_WIDTH))
+        bar = " " * offset + "#" * length
+
+        marker = "*" if id(span) in critical_path else " "
+
+        print(
+            f"{marker} {span['operation']:42}"
+            f" {ms(span['start'] - started_at)} {ms(span['end'] - started_at)}"
+            f" {ms(network)} {ms(span['end'] - span['start'] - network)}"
+            f" {format_bytes(sum(sent) if sent else None):>6} {format_bytes(received):>6}"
+            f" {get_concurrency(span, spans):>4}  {span['thread'][:16]:16} |{bar}"
+        )
+
+    busy = sum(s["end"] - s["start"] for s in spans)
+    print(
+        f"\n{len(spans)} calls, {len(exchanges)} round-trips, total {total * 1000:.1f}ms,"
+        f" {busy * 1000:.1f}ms in calls. * = critical path, net = waiting on Allegro,"
+        " zeep = building the request and parsing the response"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Timeline of the Allegro calls get_all makes for a BSN"
+    )
+    parser.add_argument("bsn")
+    parser.add_argument(
+        "--stand-in",
+        action="store_true",
+        help="respond with the fixtures instead of calling Allegro",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=50,
+        help="response time of the stand-in, ms",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="load the sections concurrently, like the streamed response does",
+    )
+    args = parser.parse_args()
+
+    logging.getLogger("zeep").setLevel(logging.ERROR)
+
+    with ExitStack() as stack:
+        stack.enter_context(
+            mock.patch(
+                "app.allegro_client.call_service_method",
+                traced(allegro_client.call_service_method),
+            )
+        )
+
+        if args.stand_in:
+            stack.enter_context(
+                mock.patch(
+                    "app.allegro_client.allegro_client",
+                    get_stand_in_clients(args.latency / 1000),
+                )
+            )
+        else:
+            transport = TimingTransport(
+                timeout=ALLEGRO_REQUEST_TIMEOUT,
+                operation_timeout=ALLEGRO_REQUEST_TIMEOUT,
+            )
+            stack.enter_context(
+                mock.patch("app.allegro_client.get_transport", lambda: transport)
+            )
+
+            # Building the clients (downloading the WSDLs) is not part of the timeline
+            for service_name, method_names in stand_in_operations:
+                allegro_client.get_client(service_name)
+
+        executor = allegro_client.section_executor if args.concurrent else None
+
+        with app.app_context():
+            started_at = time.perf_counter()
+            sections = dict(allegro_client.iter_sections(args.bsn, executor=executor))
+            ended_at = time.perf_counter()
+
+    print_waterfall(started_at, ended_at)
+    print(f"\nSections: {', '.join(name for name, value in sections.items() if value)}")
+
+
+if __name__ == "__main__":
+    main()